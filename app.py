@@ -1,10 +1,17 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response
 from flask_login import LoginManager, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 import uuid
+import hmac
 import config
 import json
+import logging
 from datetime import datetime
+from functools import wraps
+from utils.logging_setup import setup_logging
+
+setup_logging(config.Config.LOG_LEVEL, config.Config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.config.from_object(config.Config)
@@ -27,34 +34,48 @@ login_manager.login_view = 'login'
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+def login_or_api_key_required(api_key_setting: str):
+    """已登录用户，或请求头 X-API-Key 与配置项 api_key_setting 一致的调用方才能访问；配置为空时只接受已登录用户"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            api_key = getattr(config.Config, api_key_setting)
+            provided = request.headers.get('X-API-Key', '')
+            if current_user.is_authenticated or (api_key and hmac.compare_digest(provided, api_key)):
+                return view(*args, **kwargs)
+            return jsonify({'error': '请先登录或提供有效的 API 密钥'}), 401
+        return wrapper
+    return decorator
+
 # 导入其他模块
 from utils.data_loader import DataLoader
 from utils.retrieval import CircuitRetriever
 from utils.llm_client import DeepSeekClient
 from utils.dialogue_manager import DialogueManager
+from utils.metrics import registry as metrics_registry, span, process_memory
 
 # 初始化组件
-print("正在初始化数据加载器...")
+logger.info("正在初始化数据加载器...")
 data_loader = DataLoader(config.Config.DATA_FILE)
 
-print("正在初始化检索器...")
+logger.info("正在初始化检索器...")
 retriever = CircuitRetriever(data_loader)
 
-print("正在初始化大模型客户端...")
+logger.info("正在初始化大模型客户端...")
 llm_client = DeepSeekClient()
 
-print("正在初始化对话管理器...")
+logger.info("正在初始化对话管理器...")
 dialogue_manager = DialogueManager(data_loader, retriever, llm_client)
 
-print("✅ 初始化完成！")
+logger.info("✅ 初始化完成！")
 
 # 创建数据库表
 with app.app_context():
     try:
         db.create_all()
-        print("✅ 数据库表创建成功")
+        logger.info("✅ 数据库表创建成功")
     except Exception as e:
-        print(f"数据库初始化失败: {e}")
+        logger.warning("数据库初始化失败: %s", e)
         # Railway上第一次失败是正常的，PostgreSQL还没创建好
 
 # ==================== 认证相关路由 ====================
@@ -75,7 +96,8 @@ def login():
     
     if user and check_password_hash(user.password_hash, password):
         from auth_utils import AuthUtils
-        AuthUtils.login(user, db.session, remember=True)
+        with span('db_write'):
+            AuthUtils.login(user, db.session, remember=True)
         return jsonify({
             'success': True,
             'message': '登录成功',
@@ -133,11 +155,12 @@ def register():
             password_hash=AuthUtils.hash_password(password),
             created_at=datetime.utcnow()
         )
-        db.session.add(user)
-        db.session.commit()
-        
-        # 使用新创建的user对象登录
-        AuthUtils.login(user, db.session, remember=True)
+        with span('db_write'):
+            db.session.add(user)
+            db.session.commit()
+            
+            # 使用新创建的user对象登录
+            AuthUtils.login(user, db.session, remember=True)
         
         return jsonify({
             'success': True,
@@ -226,8 +249,9 @@ def delete_conversation(conversation_id):
         return jsonify({'success': False, 'message': '对话不存在'}), 404
     
     try:
-        db.session.delete(conversation)
-        db.session.commit()
+        with span('db_write'):
+            db.session.delete(conversation)
+            db.session.commit()
         return jsonify({'success': True, 'message': '对话已删除'})
     except Exception as e:
         db.session.rollback()
@@ -242,35 +266,36 @@ def save_conversation():
     messages = data.get('messages', [])
     
     try:
-        # 创建新对话
-        conversation = Conversation(
-            user_id=current_user.id,
-            title=title[:200],  # 限制标题长度
-            created_at=datetime.utcnow(),
-            updated_at=datetime.utcnow()
-        )
-        db.session.add(conversation)
-        db.session.flush()  # 获取conversation.id
-        
-        # 保存消息
-        for msg_data in messages:
-            message = Message(
-                conversation_id=conversation.id,
-                role=msg_data.get('role', 'user'),
-                content=msg_data.get('content', ''),
-                message_type=msg_data.get('message_type', 'message'),
-                timestamp=datetime.utcnow()
+        with span('db_write'):
+            # 创建新对话
+            conversation = Conversation(
+                user_id=current_user.id,
+                title=title[:200],  # 限制标题长度
+                created_at=datetime.utcnow(),
+                updated_at=datetime.utcnow()
             )
+            db.session.add(conversation)
+            db.session.flush()  # 获取conversation.id
+        
+            # 保存消息
+            for msg_data in messages:
+                message = Message(
+                    conversation_id=conversation.id,
+                    role=msg_data.get('role', 'user'),
+                    content=msg_data.get('content', ''),
+                    message_type=msg_data.get('message_type', 'message'),
+                    timestamp=datetime.utcnow()
+                )
             
-            # 保存选项和结果（如果有）
-            if 'options' in msg_data:
-                message.options = json.dumps(msg_data['options'])
-            if 'results' in msg_data:
-                message.results = json.dumps(msg_data['results'])
+                # 保存选项和结果（如果有）
+                if 'options' in msg_data:
+                    message.options = json.dumps(msg_data['options'])
+                if 'results' in msg_data:
+                    message.results = json.dumps(msg_data['results'])
             
-            db.session.add(message)
+                db.session.add(message)
         
-        db.session.commit()
+            db.session.commit()
         
         return jsonify({
             'success': True,
@@ -304,15 +329,9 @@ def chat():
     session_id = session.get('session_id', str(uuid.uuid4()))
     
     try:
-        session_obj = dialogue_manager.get_session(session_id)
-        
-        # 检查是否是选项选择（只能通过点击选项触发）
-        if user_message in session_obj.available_options:
-            # 直接处理选项选择
-            response = dialogue_manager._handle_option_selection(session_obj, user_message)
-        else:
-            # 处理其他类型消息
-            response = dialogue_manager.process_query(session_id, user_message)
+        # 同一会话的请求依次处理，重复提交共享进行中轮次的响应
+        with span('chat_turn'):
+            response = dialogue_manager.handle_message(session_id, user_message, config.Config.CHAT_TURN_BUDGET)
         
         # 如果是重置响应，需要清除前端历史
         if response.get('type') == 'reset':
@@ -325,7 +344,7 @@ def chat():
         })
         
     except Exception as e:
-        print(f"处理消息时出错: {e}")
+        logger.exception("处理消息时出错: %s", e)
         return jsonify({
             'success': False,
             'error': '处理请求时出错，请重试。'
@@ -346,58 +365,179 @@ def reset():
         'message': '对话已重置'
     })
 
+def status_payload():
+    """服务状态（WSGI 和 ASGI 入口共用）"""
+    return {
+        'status': 'ok',
+        'data_count': len(data_loader),
+        'initialized': True,
+        # 各模型的熔断状态、并发和排队数；熔断打开时对话改走规则意图和本地关键词/问题
+        'llm': llm_client.gateway.status(),
+        # 批量检索的离线大模型名额
+        'llm_offline': {'in_flight': llm_client.offline_limiter.in_flight, 'queued': llm_client.offline_limiter.queued},
+        # 请求对冲的各提示类型阈值和剩余预算
+        'llm_hedging': llm_client.hedger.status(),
+        # 本 worker 的内存占用（预加载模式下共享页按 worker 数分摊进 pss_mb）
+        'catalog_store': data_loader.store,
+        'memory': process_memory()
+    }
+
 @app.route('/api/status')
 def status():
     """检查服务状态"""
-    return jsonify({
-        'status': 'ok',
-        'data_count': len(data_loader.data) if data_loader.data is not None else 0,
-        'initialized': True
-    })
+    return jsonify(status_payload())
+
+def suggest_payload(query: str, limit: str = None):
+    """输入联想（WSGI 和 ASGI 入口共用）：补全查询的最后一个词，按包含该词的资料数从多到少排列"""
+    try:
+        limit = min(int(limit), config.Config.SUGGEST_LIMIT) if limit else config.Config.SUGGEST_LIMIT
+    except ValueError:
+        limit = config.Config.SUGGEST_LIMIT
+    
+    with span('suggest'):
+        suggestions = data_loader.suggest_index.suggest(query[:100], max(limit, 1))
+    return {'query': query, 'suggestions': suggestions}
+
+@app.route('/api/suggest')
+def suggest():
+    """输入联想：/api/suggest?q=东风天&limit=8"""
+    return jsonify(suggest_payload(request.args.get('q', ''), request.args.get('limit')))
+
+@app.route('/api/search/explain', methods=['POST'])
+@login_required
+def search_explain():
+    """
+    解释一次检索：返回各字段的关键词命中数、被忽略的关键词、两两交集大小、
+    并集大小、匹配分数分布和各阶段耗时。
+    请求体传入 keywords（关键词列表）或 query（由大模型提取关键词）
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': '请求体应为 JSON 对象'}), 400
+    keywords = data.get('keywords')
+    query = data.get('query', '')
+    
+    if not isinstance(query, str):
+        return jsonify({'error': 'query 应为字符串'}), 400
+    if keywords is not None and not (isinstance(keywords, list) and all(isinstance(kw, str) for kw in keywords)):
+        return jsonify({'error': 'keywords 应为字符串数组'}), 400
+    query = query.strip()
+    if not keywords and not query:
+        return jsonify({'error': '请提供 keywords 或 query'}), 400
+    
+    try:
+        if not keywords:
+            keywords = dialogue_manager.extract_keywords(query)
+        keywords = [str(kw).strip() for kw in keywords if str(kw).strip()]
+        
+        results, explain_info = retriever.search(keywords, explain=True)
+        
+        return jsonify({
+            'success': True,
+            'query': query,
+            'keywords': keywords,
+            'explain': explain_info,
+            'top_results': retriever.format_results_for_display(results, config.Config.MAX_RESULTS_DISPLAY)
+        })
+        
+    except Exception as e:
+        logger.exception("检索解释失败: %s", e)
+        return jsonify({
+            'success': False,
+            'error': '检索解释失败，请重试。'
+        }), 500
+
+@app.route('/api/search/batch', methods=['POST'])
+@login_or_api_key_required('BATCH_SEARCH_API_KEY')
+def search_batch():
+    """
+    批量检索（离线对接用，不经过对话和会话状态）
+    请求体：queries（每项为关键词列表或原始查询文本）、offset / limit（每个查询返回第几名起的多少个 ID）、
+    extractor（原始查询的关键词提取：local 默认，用目录词表本地提取；llm 由大模型提取，查询数上限小得多，
+    且所有批量请求共用一个很小的离线并发名额，不会占满大模型的并发名额、挤占对话）、
+    stream（为真或 Accept 为 application/x-ndjson 时逐行返回 NDJSON，最后一行为统计信息）
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': '请求体应为 JSON 对象'}), 400
+    queries = data.get('queries')
+    extractor = data.get('extractor', 'local')
+
+    if not isinstance(queries, list) or not queries:
+        return jsonify({'error': '请提供 queries（关键词列表或查询文本的数组）'}), 400
+    if len(queries) > config.Config.BATCH_SEARCH_MAX_QUERIES:
+        return jsonify({'error': f'单次最多 {config.Config.BATCH_SEARCH_MAX_QUERIES} 个查询'}), 400
+    if not all(isinstance(query, (str, list)) for query in queries):
+        return jsonify({'error': 'queries 的每一项应为关键词列表或查询文本'}), 400
+    if extractor not in ('llm', 'local'):
+        return jsonify({'error': 'extractor 应为 llm 或 local'}), 400
+    if extractor == 'llm' and len(queries) > config.Config.BATCH_SEARCH_MAX_LLM_QUERIES:
+        return jsonify({'error': f'extractor 为 llm 时单次最多 {config.Config.BATCH_SEARCH_MAX_LLM_QUERIES} 个查询'}), 400
+    try:
+        offset = max(int(data.get('offset', 0)), 0)
+        limit = min(max(int(data.get('limit', 20)), 1), config.Config.BATCH_SEARCH_MAX_LIMIT)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'offset 和 limit 应为整数'}), 400
+
+    stream = bool(data.get('stream')) or request.accept_mimetypes.best == 'application/x-ndjson'
+    extract = (lambda query: dialogue_manager.extract_keywords(query, offline=True)) if extractor == 'llm' else None
+    stats = {}
+    results = retriever.search_batch(queries, offset, limit, extract=extract, stats=stats)
+
+    if stream:
+        def generate():
+            try:
+                for result in results:
+                    yield json.dumps(result, ensure_ascii=False) + '\n'
+                yield json.dumps({'stats': stats}, ensure_ascii=False) + '\n'
+            except Exception as e:
+                logger.exception("批量检索失败: %s", e)
+                yield json.dumps({'error': '批量检索失败，请重试。', 'stats': stats}, ensure_ascii=False) + '\n'
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    try:
+        return jsonify({
+            'success': True,
+            'results': list(results),
+            'stats': stats
+        })
+
+    except Exception as e:
+        logger.exception("批量检索失败: %s", e)
+        return jsonify({
+            'success': False,
+            'error': '批量检索失败，请重试。'
+        }), 500
+
+@app.route('/api/metrics')
+def metrics():
+    """
+    Prometheus 文本格式的进程内指标（各阶段耗时、大模型耗时与 token 用量）
+    配置了 METRICS_TOKEN 时须携带 Authorization: Bearer <令牌>，否则只接受本机请求
+    """
+    token = config.Config.METRICS_TOKEN
+    if token:
+        allowed = hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    else:
+        # 同机反向代理转发的请求也来自本机，带转发头的一律拒绝
+        forwarded = 'X-Forwarded-For' in request.headers or 'Forwarded' in request.headers
+        allowed = request.remote_addr in ('127.0.0.1', '::1') and not forwarded
+    if not allowed:
+        return jsonify({'error': '无权访问指标'}), 403
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route('/api/show_current_results', methods=['POST'])
 def show_current_results():
-    """查看当前所有结果（不经过大模型）"""
+    """查看当前结果（不经过大模型），请求体可带 cursor（上一页返回的 next_cursor）和 limit（每页条数）"""
     session_id = session.get('session_id')
     if not session_id:
         return jsonify({'error': '会话不存在'}), 400
     
+    data = request.get_json(silent=True) or {}
     try:
-        session_obj = dialogue_manager.get_session(session_id)
-        
-        if session_obj.current_results is None or session_obj.current_results.empty:
-            response = {
-                'type': 'message',
-                'content': '📊 **当前没有搜索结果**\n\n请先进行搜索。'
-            }
-        else:
-            # 格式化当前所有结果
-            formatted_results = retriever.format_results_for_display(session_obj.current_results)
-            
-            # 构建结果消息
-            total_count = len(formatted_results)
-            message = f"📊 **当前搜索结果（共 {total_count} 条）**\n\n"
-            
-            for i, result in enumerate(formatted_results, 1):
-                message += f"**{i}.** `{result['ID']}` - {result['关联文件名称']}\n"
-            
-            # 添加统计信息
-            if session_obj.current_query:
-                message += f"\n🔍 **搜索关键词**：{session_obj.current_query}"
-            
-            if session_obj.keywords:
-                message += f"\n📝 **提取关键词**：{', '.join(session_obj.keywords)}"
-            
-            if session_obj.previous_questions:
-                message += f"\n🔧 **已筛选条件**：{len(session_obj.previous_questions)} 个"
-                for j, q in enumerate(session_obj.previous_questions, 1):
-                    choice = q.get('user_choice', '未选择')
-                    message += f"\n    {j}. {choice}"
-            
-            response = {
-                'type': 'message',
-                'content': message
-            }
+        # 持有会话锁读取，避免与正在进行的对话轮次交错
+        with dialogue_manager.session_turn(session_id) as session_obj:
+            response = dialogue_manager.current_results_message(session_obj, data.get('cursor'), data.get('limit'))
         
         return jsonify({
             'success': True,
@@ -405,7 +545,7 @@ def show_current_results():
         })
         
     except Exception as e:
-        print(f"获取当前结果时出错: {e}")
+        logger.exception("获取当前结果时出错: %s", e)
         return jsonify({
             'success': False,
             'error': '获取结果时出错，请重试。'
@@ -432,7 +572,7 @@ def fuzzy_correct():
         })
         
     except Exception as e:
-        print(f"模糊匹配修正失败: {e}")
+        logger.exception("模糊匹配修正失败: %s", e)
         return jsonify({
             'success': False,
             'error': '修正失败，请重试。'
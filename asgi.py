@@ -0,0 +1,229 @@
+"""
+ASGI 入口：对话、状态、输入联想和结果接口由异步流水线处理，其余路由（认证、历史记录、页面）交给 Flask
+
+与 app.py 共用 DataLoader、CircuitRetriever、DialogueManager 和 Flask 的会话 Cookie，
+等待大模型响应期间不占用线程，单个进程即可同时承载大量进行中的对话：
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+import json
+import logging
+import uuid
+from http.cookies import SimpleCookie
+from typing import Dict, Optional
+from urllib.parse import parse_qs
+
+import aiohttp
+import openai
+from itsdangerous import BadSignature
+from uvicorn.middleware.wsgi import WSGIMiddleware
+from werkzeug.http import dump_cookie
+
+import config
+from app import app as flask_app, dialogue_manager, status_payload, suggest_payload
+from utils.metrics import span
+
+logger = logging.getLogger(__name__)
+
+
+class Request:
+    """一次 HTTP 请求：读取请求体，并解码 Flask 会话 Cookie"""
+
+    def __init__(self, scope: Dict, receive):
+        self.scope = scope
+        self.receive = receive
+        self.session = self._load_session()
+
+    async def body(self) -> bytes:
+        chunks = []
+        while True:
+            message = await self.receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    def arg(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """查询字符串参数"""
+        values = parse_qs(self.scope.get('query_string', b'').decode('utf-8')).get(name)
+        return values[0] if values else default
+
+    async def json(self) -> Dict:
+        """解析 JSON 请求体（空请求体为 {}）；不是合法的 JSON 对象时抛出 ValueError"""
+        body = await self.body()
+        data = json.loads(body) if body else {}
+        if not isinstance(data, dict):
+            raise ValueError('请求体应为 JSON 对象')
+        return data
+
+    def _load_session(self) -> Dict:
+        serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+        cookies = SimpleCookie()
+        for name, value in self.scope.get('headers', []):
+            if name == b'cookie':
+                cookies.load(value.decode('latin-1'))
+
+        morsel = cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+        if morsel is None or serializer is None:
+            return {}
+        try:
+            max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+            return serializer.loads(morsel.value, max_age=max_age)
+        except BadSignature:
+            return {}
+
+
+def session_cookie(session: Dict) -> bytes:
+    """按 Flask 的方式签名会话并生成 Set-Cookie 头"""
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    cookie = dump_cookie(
+        flask_app.config['SESSION_COOKIE_NAME'],
+        serializer.dumps(dict(session)),
+        path=flask_app.config['SESSION_COOKIE_PATH'] or '/',
+        domain=flask_app.config['SESSION_COOKIE_DOMAIN'],
+        secure=flask_app.config['SESSION_COOKIE_SECURE'],
+        httponly=flask_app.config['SESSION_COOKIE_HTTPONLY'],
+        samesite=flask_app.config['SESSION_COOKIE_SAMESITE']
+    )
+    return cookie.encode('latin-1')
+
+
+async def send_json(send, payload: Dict, status: int = 200, cookie: Optional[bytes] = None):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode())
+    ]
+    if cookie:
+        headers.append((b'set-cookie', cookie))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def read_json(request: Request, send) -> Optional[Dict]:
+    """读取 JSON 请求体；格式错误时直接返回 400 并得到 None"""
+    try:
+        return await request.json()
+    except ValueError:
+        await send_json(send, {'error': '请求体不是有效的 JSON'}, 400)
+        return None
+
+
+async def chat(request: Request, send):
+    """处理聊天请求"""
+    data = await read_json(request, send)
+    if data is None:
+        return
+    user_message = (data.get('message') or '').strip()
+
+    if not user_message:
+        await send_json(send, {'error': '消息不能为空'}, 400)
+        return
+
+    # 获取会话ID
+    session_id = request.session.get('session_id', str(uuid.uuid4()))
+
+    try:
+        # 同一会话的请求依次处理，重复提交共享进行中轮次的响应
+        with span('chat_turn'):
+            response = await dialogue_manager.handle_message_async(
+                session_id, user_message, config.Config.CHAT_TURN_BUDGET)
+
+        if response.get('type') == 'reset':
+            response['should_clear_history'] = True
+
+        await send_json(send, {'success': True, 'response': response})
+
+    except Exception as e:
+        logger.exception("处理消息时出错: %s", e)
+        await send_json(send, {'success': False, 'error': '处理请求时出错，请重试。'}, 500)
+
+
+async def reset(request: Request, send):
+    """重置对话"""
+    session_id = request.session.get('session_id')
+    if session_id:
+        await dialogue_manager.reset_session_async(session_id)
+
+    # 生成新的会话ID
+    session = dict(request.session, session_id=str(uuid.uuid4()))
+    await send_json(send, {'success': True, 'message': '对话已重置'}, cookie=session_cookie(session))
+
+
+async def status(request: Request, send):
+    """检查服务状态"""
+    await send_json(send, status_payload())
+
+
+async def suggest(request: Request, send):
+    """输入联想（在事件循环中直接计算，单次查询远小于 1 毫秒）"""
+    await send_json(send, suggest_payload(request.arg('q', ''), request.arg('limit')))
+
+
+async def show_current_results(request: Request, send):
+    """查看当前结果（不经过大模型），请求体可带 cursor 和 limit 分页"""
+    session_id = request.session.get('session_id')
+    if not session_id:
+        await send_json(send, {'error': '会话不存在'}, 400)
+        return
+
+    data = await read_json(request, send)
+    if data is None:
+        return
+    try:
+        async with dialogue_manager.async_session_turn(session_id) as session_obj:
+            response = dialogue_manager.current_results_message(session_obj, data.get('cursor'), data.get('limit'))
+        await send_json(send, {'success': True, 'response': response})
+
+    except Exception as e:
+        logger.exception("获取当前结果时出错: %s", e)
+        await send_json(send, {'success': False, 'error': '获取结果时出错，请重试。'}, 500)
+
+
+ROUTES = {
+    ('POST', '/api/chat'): chat,
+    ('POST', '/api/reset'): reset,
+    ('GET', '/api/status'): status,
+    ('GET', '/api/suggest'): suggest,
+    ('POST', '/api/show_current_results'): show_current_results
+}
+
+
+class CircuitNavigatorASGI:
+    """
+    异步路由表之外的请求转交 Flask（在线程池中执行）；
+    进程内复用一个 aiohttp 连接池发送大模型请求
+    """
+
+    def __init__(self, routes: Dict, fallback):
+        self.routes = routes
+        self.fallback = fallback
+        self.http_session: Optional[aiohttp.ClientSession] = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+
+        handler = self.routes.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+        if handler is None:
+            await self.fallback(scope, receive, send)
+            return
+
+        if self.http_session is None or self.http_session.closed:
+            self.http_session = aiohttp.ClientSession()
+        # openai 从上下文变量读取 aiohttp 会话；每个请求运行在独立的上下文中
+        openai.aiosession.set(self.http_session)
+        await handler(Request(scope, receive), send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.http_session is not None:
+                    await self.http_session.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = CircuitNavigatorASGI(ROUTES, WSGIMiddleware(flask_app))
@@ -0,0 +1,282 @@
+"""
+检索引擎的合成目录微基准
+
+从真实的资料清单学习各层级路径段、路径深度和文件名词元的分布，
+生成 1 万 / 10 万 / 100 万行的合成目录（品牌、车型代号按比例扩充），
+分别测量 DataLoader 加载、CircuitRetriever.search（1–8 个关键词）、
+filter_by_selection 和 format_results_for_display 的耗时与吞吐，以及进程峰值 RSS。
+
+每个规模在独立子进程中运行，峰值 RSS 互不干扰：
+    python -m benchmarks.catalog_bench --sizes 10000,100000,1000000 --output catalog_bench.json
+--backend sqlite 时检索使用 FTS5 后端（索引建在临时目录中，同时记录建索引耗时和索引文件大小）；
+--store compact 时目录以紧凑形式加载（对比 load.rss_delta_mb 即可看到内存差异）
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List
+
+import pandas as pd
+
+import config
+
+# 合成品牌时使用的汉字，组合出真实目录中没有的品牌名
+_BRAND_CHARS = '东风解放重汽红岩徐工三一柳工临工山推福田欧曼江铃庆铃陕汽华菱大运豪沃乘龙'
+_SERIES_LETTERS = 'ABCDEFGHJKLMNPRSTVXYZ'
+
+
+def _current_rss_mb() -> float:
+    """当前常驻内存（MB）"""
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+
+
+def _peak_rss_mb() -> float:
+    """进程峰值常驻内存（MB），Linux 上 ru_maxrss 单位为 KB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class CatalogProfile:
+    """真实目录的分布：路径深度、各层级路径段、文件名词元"""
+
+    def __init__(self, data: pd.DataFrame):
+        self.depths = Counter()
+        self.level_segments: Dict[int, Counter] = {}
+        self.filename_tokens = Counter()
+
+        for path in data['层级路径'].tolist():
+            segments = [seg.strip() for seg in str(path).split('->') if seg.strip()]
+            self.depths[len(segments)] += 1
+            for level, segment in enumerate(segments):
+                self.level_segments.setdefault(level, Counter())[segment] += 1
+
+        for filename in data['关联文件名称'].tolist():
+            for token in str(filename).rsplit('.', 1)[0].split('_'):
+                if token:
+                    self.filename_tokens[token] += 1
+
+
+def _weighted_sampler(counter: Counter, rng: random.Random):
+    items = list(counter.keys())
+    weights = list(counter.values())
+    return lambda: rng.choices(items, weights)[0]
+
+
+def generate_catalog(profile: CatalogProfile, rows: int, seed: int = 0) -> List[List[str]]:
+    """
+    生成合成目录
+    - 路径深度和前几层路径段按真实分布抽样
+    - 最后两层替换为合成的品牌和车型代号，品牌/车型数量随行数按平方根增长
+    - 文件名由品牌、车型和 2–4 个真实文件名词元以下划线拼接
+    """
+    rng = random.Random(seed)
+    depth_sampler = _weighted_sampler(profile.depths, rng)
+    level_samplers = {level: _weighted_sampler(counter, rng) for level, counter in profile.level_segments.items()}
+    token_sampler = _weighted_sampler(profile.filename_tokens, rng)
+
+    brand_count = max(30, int(rows ** 0.5 / 3))
+    brands = sorted({''.join(rng.sample(_BRAND_CHARS, 2)) for _ in range(brand_count * 2)})[:brand_count]
+    series_count = max(200, int(rows ** 0.5 * 2))
+    series = [
+        f"{rng.choice(_SERIES_LETTERS)}{rng.choice(_SERIES_LETTERS)}{rng.randint(10, 999)}{rng.choice(['', 'C9', 'G', 'E', 'KL'])}"
+        for _ in range(series_count)
+    ]
+    extensions = ['', '', '.DOCX', '.PDF']
+
+    catalog = []
+    for row_id in range(1, rows + 1):
+        depth = max(3, depth_sampler())
+        segments = [level_samplers[level]() for level in range(depth - 2)]
+        brand = rng.choice(brands)
+        model = rng.choice(series)
+        segments.extend([brand, model])
+
+        tokens = [token_sampler() for _ in range(rng.randint(2, 4))]
+        filename = '_'.join([brand, model] + tokens) + rng.choice(extensions)
+        catalog.append([str(row_id), '->'.join(segments), filename])
+
+    return catalog
+
+
+def write_catalog(catalog: List[List[str]], path: str):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['ID', '层级路径', '关联文件名称'])
+        writer.writerows(catalog)
+
+
+def _keyword_pool(catalog: List[List[str]], rng: random.Random, size: int = 200) -> List[str]:
+    """从合成目录中抽取关键词：路径段、文件名词元及其前缀（只保留不含标点的词）"""
+    pool = set()
+    for _, path, filename in rng.sample(catalog, min(len(catalog), size)):
+        pool.update(path.split('->')[1:])
+        pool.update(token[:4] for token in filename.rsplit('.', 1)[0].split('_'))
+    return sorted(kw for kw in pool if len(kw) >= 2 and re.fullmatch(r'\w+', kw))
+
+
+def _timed(func, repeat: int) -> Dict:
+    """执行 repeat 次，返回每次耗时统计和最后一次的返回值"""
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    total = sum(samples)
+    return {
+        'repeat': repeat,
+        'mean_ms': total / repeat * 1000,
+        'p95_ms': samples[min(repeat - 1, int(repeat * 0.95))] * 1000,
+        'ops_per_s': repeat / total if total else None
+    }, result
+
+
+def run_size(rows: int, queries: int, seed: int, backend_name: str, store: str) -> Dict:
+    """在当前进程中对单个规模做完整测量"""
+    from utils.data_loader import DataLoader
+    from utils.retrieval import CircuitRetriever, create_search_backend
+
+    rng = random.Random(seed)
+    real = pd.read_csv(config.Config.DATA_FILE, encoding='utf-8').dropna()
+    real.columns = ['ID', '层级路径', '关联文件名称']
+    profile = CatalogProfile(real)
+    del real
+
+    start = time.perf_counter()
+    catalog = generate_catalog(profile, rows, seed)
+    generate_s = time.perf_counter() - start
+    keyword_pool = _keyword_pool(catalog, rng)
+
+    report = {'rows': rows, 'backend': backend_name, 'store': store, 'generate_s': generate_s}
+
+    tmp = tempfile.mkdtemp()
+    try:
+        csv_path = os.path.join(tmp, 'catalog.csv')
+        write_catalog(catalog, csv_path)
+        report['csv_mb'] = os.path.getsize(csv_path) / 1024 / 1024
+        del catalog
+
+        rss_before = _current_rss_mb()
+        start = time.perf_counter()
+        data_loader = DataLoader(csv_path, store)
+        load_s = time.perf_counter() - start
+        report['load'] = {
+            'seconds': load_s,
+            'rows_per_s': rows / load_s,
+            'rss_delta_mb': _current_rss_mb() - rss_before
+        }
+
+        if backend_name == 'sqlite':
+            from utils.fts_backend import SqliteFtsBackend
+            fts_path = os.path.join(tmp, 'catalog_fts.db')
+            start = time.perf_counter()
+            backend = SqliteFtsBackend(data_loader, fts_path)
+            report['index'] = {'seconds': time.perf_counter() - start, 'size_mb': os.path.getsize(fts_path) / 1024 / 1024}
+        else:
+            backend = create_search_backend('pandas', data_loader)
+        retriever = CircuitRetriever(data_loader, backend)
+        report.update(_measure(data_loader, retriever, keyword_pool, rng, rows, queries))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    report['rss_mb'] = _current_rss_mb()
+    report['peak_rss_mb'] = _peak_rss_mb()
+    return report
+
+
+def _measure(data_loader, retriever, keyword_pool: List[str], rng: random.Random, rows: int, queries: int) -> Dict:
+    """检索、筛选和格式化的耗时"""
+    report = {}
+
+    # 1–8 个关键词的检索
+    report['search'] = {}
+    broad_results = None
+    for keyword_count in range(1, 9):
+        keyword_sets = [rng.sample(keyword_pool, keyword_count) for _ in range(queries)]
+        iterator = iter(keyword_sets)
+        stats, results = _timed(lambda: retriever.search(next(iterator)), queries)
+        stats['last_result_rows'] = len(results)
+        report['search'][keyword_count] = stats
+        if broad_results is None or len(results) > len(broad_results):
+            broad_results = results
+
+    # 在较大的结果集上按路径段筛选
+    if broad_results is not None and not broad_results.empty:
+        segment = broad_results['层级路径'].iloc[0].split('->')[-1]
+        stats, filtered = _timed(
+            lambda: data_loader.filter_by_selection(broad_results, segment, '层级路径', '包含'), queries)
+        stats['input_rows'] = len(broad_results)
+        stats['output_rows'] = len(filtered)
+        report['filter_by_selection'] = stats
+
+    # 格式化：展示用的前 5 条和整份结果
+    if data_loader.catalog is not None:
+        display_rows = data_loader.catalog.frame(range(min(rows, 10000)))
+    else:
+        display_rows = data_loader.data.head(min(rows, 10000))
+    stats, _ = _timed(lambda: retriever.format_results_for_display(display_rows, 5), queries)
+    report['format_top5'] = stats
+    stats, formatted = _timed(lambda: retriever.format_results_for_display(display_rows), max(1, queries // 5))
+    stats['rows'] = len(formatted)
+    stats['rows_per_s'] = len(formatted) * stats['ops_per_s']
+    report['format_all'] = stats
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='合成目录上的检索引擎微基准')
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='逗号分隔的目录行数')
+    parser.add_argument('--queries', type=int, default=5, help='每种关键词个数执行的查询次数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', default=config.Config.SEARCH_BACKEND, choices=['pandas', 'sqlite'],
+                        help='检索后端')
+    parser.add_argument('--store', default=config.Config.CATALOG_STORE, choices=['dataframe', 'compact'],
+                        help='目录的内存形式')
+    parser.add_argument('--output', default='catalog_bench.json')
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        json.dump(run_size(args.child, args.queries, args.seed, args.backend, args.store), sys.stdout, ensure_ascii=False)
+        return
+
+    reports = []
+    for rows in [int(size) for size in args.sizes.split(',') if size]:
+        print(f'⏳ 测量 {rows} 行 ...', flush=True)
+        completed = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.catalog_bench', '--child', str(rows),
+             '--queries', str(args.queries), '--seed', str(args.seed), '--backend', args.backend,
+             '--store', args.store],
+            capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            # 通常是内存不足或超时，记录下来继续下一个规模
+            reports.append({'rows': rows, 'error': completed.stderr.strip().splitlines()[-1:] or ['failed']})
+            print(f'  ❌ 失败: {reports[-1]["error"]}')
+            continue
+
+        report = json.loads(completed.stdout)
+        reports.append(report)
+        search_ms = ', '.join(f"{k}:{v['mean_ms']:.0f}" for k, v in report['search'].items())
+        print(f"  加载 {report['load']['seconds']:.2f}s，检索均值(ms) {search_ms}，"
+              f"格式化 {report['format_all']['rows_per_s']:.0f} 行/s，峰值 RSS {report['peak_rss_mb']:.0f}MB")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(reports, f, ensure_ascii=False, indent=2)
+    print(f'结果已写入 {args.output}')
+
+
+if __name__ == '__main__':
+    main()
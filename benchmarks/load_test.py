@@ -0,0 +1,361 @@
+"""
+端到端并发压测
+
+在本地启动大模型替身服务和真实的 Flask 应用（默认 gunicorn，按参数设置 workers/threads），
+每个虚拟用户使用独立的 cookie，循环执行：
+    /login → / → /api/chat（新搜索）→ /api/chat（点击选项）→ /api/chat（线索）
+    → /api/show_current_results → /api/save_conversation
+并发数逐级增加，报告每级的吞吐、各接口的尾延迟、worker CPU 占用和错误
+（包括会话落到另一个 worker 上导致的会话丢失）。
+
+    python -m benchmarks.load_test --workers 2 --threads 1 --concurrency 1,2,4,8,16 --duration 20
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import config
+from benchmarks.mock_llm import LatencyModel, MockLLMServer
+from benchmarks.replay import load_keyword_queries, summarize
+
+# 新搜索之后追加的线索
+_CLUES = ['针脚', '仪表', 'ECU', '保险丝', '国六']
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class AppProcess:
+    """以子进程方式运行应用：优先 gunicorn，未安装时退回 Flask 自带的多线程服务"""
+
+    def __init__(self, llm_base_url: str, workers: int, threads: int, worker_class: str = 'sync',
+                 env: Optional[Dict[str, str]] = None):
+        self.port = _free_port()
+        self.workers = workers
+        self.threads = threads
+        self.worker_class = worker_class
+        self.tmpdir = tempfile.mkdtemp(prefix='circuit-load-')
+        self.env = dict(
+            os.environ,
+            LLM_BASE_URL=llm_base_url,
+            LLM_API_KEY='mock',
+            DATABASE_URL=f"sqlite:///{os.path.join(self.tmpdir, 'load.db')}",
+            SECRET_KEY='load-test',
+            LOG_LEVEL='WARNING'
+        )
+        self.env.update(env or {})
+        self.process = None
+        self.server_kind = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+    def start(self):
+        if shutil.which('gunicorn'):
+            self.server_kind = 'gunicorn'
+            command = [
+                'gunicorn', 'app:app', '--bind', f'127.0.0.1:{self.port}',
+                '--workers', str(self.workers), '--threads', str(self.threads),
+                '--worker-class', self.worker_class, '--timeout', '120'
+            ]
+        else:
+            self.server_kind = 'flask-threaded'
+            command = [
+                sys.executable, '-c',
+                f'import app; app.app.run(host="127.0.0.1", port={self.port}, threaded=True)'
+            ]
+        # 应用按相对路径读取数据文件，需要在项目根目录下启动
+        project_root = os.path.dirname(os.path.abspath(config.__file__))
+        self.process = subprocess.Popen(command, cwd=project_root, env=self.env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        self._wait_ready()
+        return self
+
+    def _wait_ready(self, timeout: float = 60):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'应用启动失败: {self.process.stderr.read().decode(errors="replace")[-2000:]}')
+            try:
+                urllib.request.urlopen(f'{self.base_url}/api/status', timeout=2).read()
+                return
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                time.sleep(0.3)
+        raise RuntimeError('应用启动超时')
+
+    def worker_pids(self) -> List[int]:
+        """gunicorn 的 worker 是主进程的子进程；单进程服务时就是进程本身"""
+        if self.server_kind != 'gunicorn':
+            return [self.process.pid]
+        children = []
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+            except OSError:
+                continue
+            if int(fields[1]) == self.process.pid:
+                children.append(int(entry))
+        return children
+
+    @staticmethod
+    def cpu_seconds(pid: int) -> float:
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            return 0.0
+        # utime + stime，单位为时钟滴答
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+class VirtualUser:
+    """一个模拟用户：独立 cookie，按固定流程发请求并记录耗时"""
+
+    def __init__(self, base_url: str, index: int, queries: List[str], recorder: 'LoadRecorder', seed: int):
+        self.base_url = base_url
+        self.username = f'load_user_{index}'
+        self.password = 'load-test-pass'
+        self.queries = queries
+        self.recorder = recorder
+        self.rng = random.Random(seed + index)
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def _request(self, name: str, path: str, payload: Optional[Dict] = None, method: str = 'POST'):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else None
+        request = urllib.request.Request(f'{self.base_url}{path}', data=data, method=method)
+        if data is not None:
+            request.add_header('Content-Type', 'application/json')
+
+        start = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=130) as response:
+                body = response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            body, status = e.read(), e.code
+        except Exception as e:
+            self.recorder.record(name, time.perf_counter() - start, error=type(e).__name__)
+            return None
+        elapsed = time.perf_counter() - start
+
+        if status >= 400:
+            self.recorder.record(name, elapsed, error=f'http_{status}')
+            return None
+        self.recorder.record(name, elapsed)
+        try:
+            return json.loads(body)
+        except ValueError:
+            return {}
+
+    def register(self):
+        self._request('register', '/register', {
+            'username': self.username,
+            'email': f'{self.username}@example.com',
+            'password': self.password
+        })
+
+    def run_conversation(self):
+        """执行一轮完整流程"""
+        self._request('login', '/login', {'username': self.username, 'password': self.password})
+        self._request('index', '/', method='GET')
+
+        query = self.rng.choice(self.queries)
+        messages = [{'role': 'user', 'content': query}]
+        result = self._request('chat_new', '/api/chat', {'message': query})
+        response = (result or {}).get('response') or {}
+        had_results = response.get('type') in ('question', 'results')
+        messages.append({'role': 'assistant', 'content': response.get('content', ''),
+                         'message_type': response.get('type', 'message')})
+
+        if response.get('type') == 'question' and response.get('options'):
+            options = [opt for opt in response['options'] if not opt.startswith('其他')] or response['options']
+            choice = self.rng.choice(options)
+            result = self._request('chat_option', '/api/chat', {'message': choice})
+            clicked = (result or {}).get('response') or {}
+            # 选项只有在持有该会话的 worker 上才会被识别，否则会被当成普通输入
+            if result is not None and clicked.get('type') not in ('question', 'results') \
+                    and '没有找到' not in clicked.get('content', ''):
+                self.recorder.record_error('lost_session')
+            messages.append({'role': 'user', 'content': choice})
+
+            clue = self.rng.choice(_CLUES)
+            self._request('chat_clue', '/api/chat', {'message': clue})
+            messages.append({'role': 'user', 'content': clue})
+
+        shown = self._request('show_results', '/api/show_current_results', {})
+        if had_results and shown is not None and '当前没有搜索结果' in ((shown.get('response') or {}).get('content', '')):
+            self.recorder.record_error('lost_session')
+
+        self._request('save', '/api/save_conversation', {'title': query, 'messages': messages})
+
+
+class LoadRecorder:
+    """线程安全地收集各接口的耗时和错误"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.requests = 0
+
+    def record(self, name: str, elapsed: float, error: str = None):
+        with self._lock:
+            self.samples[name].append(elapsed)
+            self.requests += 1
+            if error:
+                self.errors[f'{name}:{error}'] += 1
+
+    def record_error(self, kind: str):
+        with self._lock:
+            self.errors[kind] += 1
+
+
+def run_step(app: AppProcess, users: List[VirtualUser], duration: float) -> Dict:
+    """以给定的用户数持续压测 duration 秒"""
+    recorder = LoadRecorder()
+    for user in users:
+        user.recorder = recorder
+
+    pids = app.worker_pids()
+    cpu_before = {pid: app.cpu_seconds(pid) for pid in pids}
+    stop_at = time.time() + duration
+    conversations = [0] * len(users)
+
+    def loop(i: int, user: VirtualUser):
+        while time.time() < stop_at:
+            user.run_conversation()
+            conversations[i] += 1
+
+    threads = [threading.Thread(target=loop, args=(i, user), daemon=True) for i, user in enumerate(users)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    worker_cpu = {str(pid): (app.cpu_seconds(pid) - cpu_before.get(pid, 0.0)) / elapsed for pid in pids}
+    all_samples = [value for samples in recorder.samples.values() for value in samples]
+
+    return {
+        'concurrency': len(users),
+        'duration_s': elapsed,
+        'requests': recorder.requests,
+        'throughput_rps': recorder.requests / elapsed,
+        'conversations_per_s': sum(conversations) / elapsed,
+        'latency': summarize(all_samples),
+        'endpoints': {name: summarize(samples) for name, samples in sorted(recorder.samples.items())},
+        'errors': dict(recorder.errors),
+        # 每个 worker 的 CPU 占用（1.0 表示占满一个核）
+        'worker_cpu': worker_cpu
+    }
+
+
+def find_saturation(steps: List[Dict]) -> Optional[int]:
+    """吞吐增长不足 10% 而 p95 增长超过 50% 的第一级并发，视为饱和点"""
+    for previous, current in zip(steps, steps[1:]):
+        if previous['throughput_rps'] <= 0:
+            continue
+        gain = current['throughput_rps'] / previous['throughput_rps'] - 1
+        p95_growth = current['latency']['p95_ms'] / max(previous['latency']['p95_ms'], 1e-9) - 1
+        if gain < 0.1 and p95_growth > 0.5:
+            return current['concurrency']
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='驱动真实 Flask 应用的并发压测')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker 数')
+    parser.add_argument('--threads', type=int, default=1, help='每个 worker 的线程数')
+    parser.add_argument('--worker-class', default='sync', help='gunicorn worker 类型')
+    parser.add_argument('--concurrency', default='1,2,4,8,16', help='逐级的并发用户数')
+    parser.add_argument('--duration', type=float, default=20, help='每级持续秒数')
+    parser.add_argument('--chat-latency', default='lognormal:0.3:0.5', help='deepseek-chat 延迟分布')
+    parser.add_argument('--reasoner-latency', default='lognormal:1.5:0.6', help='deepseek-reasoner 延迟分布')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='load_test.json')
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(',') if level]
+    queries = load_keyword_queries()
+
+    mock = MockLLMServer(
+        latency={
+            config.Config.LLM_MODEL: LatencyModel(args.chat_latency, args.seed),
+            config.Config.LLM_REASONER_MODEL: LatencyModel(args.reasoner_latency, args.seed + 1)
+        },
+        seed=args.seed
+    ).start()
+    app = AppProcess(mock.base_url, args.workers, args.threads, args.worker_class)
+
+    try:
+        app.start()
+        print(f'应用已启动（{app.server_kind}，workers={args.workers}，threads={args.threads}）：{app.base_url}')
+
+        users = [VirtualUser(app.base_url, i, queries, LoadRecorder(), args.seed) for i in range(max(levels))]
+        for user in users:
+            user.register()
+
+        steps = []
+        for level in levels:
+            step = run_step(app, users[:level], args.duration)
+            steps.append(step)
+            print(f"并发 {level:>3}: {step['throughput_rps']:7.1f} req/s，p50 {step['latency']['p50_ms']:7.0f}ms，"
+                  f"p95 {step['latency']['p95_ms']:7.0f}ms，p99 {step['latency']['p99_ms']:7.0f}ms，"
+                  f"worker CPU {sum(step['worker_cpu'].values()):.2f}，错误 {step['errors'] or '无'}")
+    finally:
+        app.stop()
+        mock.stop()
+
+    report = {
+        'meta': {
+            'server': app.server_kind,
+            'workers': args.workers,
+            'threads': args.threads,
+            'worker_class': args.worker_class,
+            'duration_s': args.duration,
+            'chat_latency': args.chat_latency,
+            'reasoner_latency': args.reasoner_latency
+        },
+        'steps': steps,
+        'saturation_concurrency': find_saturation(steps)
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if report['saturation_concurrency']:
+        print(f"⚠️ 并发 {report['saturation_concurrency']} 时吞吐不再增长而尾延迟明显上升")
+    print(f'结果已写入 {args.output}')
+
+
+if __name__ == '__main__':
+    main()
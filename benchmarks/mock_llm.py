@@ -0,0 +1,315 @@
+"""
+本地 OpenAI 兼容的大模型替身服务
+
+按系统提示识别四类提示（意图识别、关键词提取、模糊修正、问题设计），
+用规则或预置答案生成回复（合并了多条输入的批量提示逐条作答），并按配置的延迟分布模拟上游耗时。
+
+单独启动：
+    python -m benchmarks.mock_llm --port 8765 --chat-latency lognormal:0.4:0.5
+然后设置 LLM_BASE_URL=http://127.0.0.1:8765 LLM_API_KEY=mock 运行应用。
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+# 四类提示与系统提示中的识别片段
+PROMPT_MARKERS = {
+    'intent': '意图识别专家',
+    'keywords': '关键词提取助手',
+    'fuzzy_correct': '修正不规范的查询',
+    'question_design': '设计有效的问题'
+}
+
+# 微批处理合并多条输入时的分节标题（见 utils.llm_client.batch_prompt）
+BATCH_MARKER = '## 批量输入'
+
+# 规则分词时移除的常见词
+_STOP_PHRASES = ['电路图', '线路图', '接线图', '原理图', '图纸', '我要找', '我想找', '帮我找', '需要', '的', '图']
+
+# 意图规则：包含这些词的短输入视为新搜索而不是线索
+_BRAND_WORDS = ['东风', '三一', '徐工', '红岩', '解放', '重汽', '小松', '福田', '欧曼', '乘龙', '康明斯', '玉柴']
+
+
+class LatencyModel:
+    """
+    延迟分布，规格字符串：
+    - fixed:秒
+    - uniform:最小秒:最大秒
+    - lognormal:中位数秒:sigma
+    - stall:正常秒:停顿秒:停顿概率（偶发长停顿，用于评估请求对冲）
+    """
+
+    def __init__(self, spec: str = 'fixed:0', seed: int = 0):
+        self.spec = spec
+        parts = spec.split(':')
+        self.kind = parts[0]
+        self.params = [float(value) for value in parts[1:]]
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        with self._lock:
+            if self.kind == 'fixed':
+                return self.params[0] if self.params else 0.0
+            if self.kind == 'uniform':
+                return self._random.uniform(self.params[0], self.params[1])
+            if self.kind == 'lognormal':
+                median, sigma = self.params
+                return self._random.lognormvariate(0, sigma) * median
+            if self.kind == 'stall':
+                normal, stall, probability = self.params
+                return stall if self._random.random() < probability else normal
+        raise ValueError(f'未知的延迟分布: {self.spec}')
+
+
+def classify_prompt(messages: List[Dict]) -> str:
+    """根据系统提示判断提示类型"""
+    system = ' '.join(m.get('content', '') for m in messages if m.get('role') == 'system')
+    for prompt_type, marker in PROMPT_MARKERS.items():
+        if marker in system:
+            return prompt_type
+    return 'unknown'
+
+
+def rule_keywords(query: str) -> List[str]:
+    """规则分词：去掉常见词后按中文串、字母数字串切分，过长的中文串按两字切分"""
+    for phrase in _STOP_PHRASES:
+        query = query.replace(phrase, ' ')
+    keywords = []
+    for token in re.findall(r'[A-Za-z0-9]+|[\u4e00-\u9fff]+', query):
+        if re.match(r'[\u4e00-\u9fff]', token) and len(token) > 4:
+            keywords.extend(token[i:i + 2] for i in range(0, len(token), 2))
+        else:
+            keywords.append(token)
+    return [kw for kw in keywords if len(kw) >= 2]
+
+
+def _extract(pattern: str, text: str, default: str = '') -> str:
+    matches = re.findall(pattern, text)
+    return matches[-1] if matches else default
+
+
+def rule_answer(prompt_type: str, prompt: str) -> Dict:
+    """按提示类型生成规则答案"""
+    if prompt_type == 'keywords':
+        query = _extract(r'用户查询："(.*)"', prompt)
+        return {'keywords': rule_keywords(query)}
+
+    if prompt_type == 'intent':
+        user_input = _extract(r'## 用户输入\n"(.*)"', prompt)
+        current_query = _extract(r'- 当前搜索主题: (.*)', prompt).strip()
+        is_clue = (current_query and len(user_input) <= 8
+                   and not any(brand in user_input for brand in _BRAND_WORDS))
+        if is_clue:
+            return {
+                'intent': 'provide_clue',
+                'confidence': 'medium',
+                'reasoning': 'mock: 短输入视为线索',
+                'additional_info': {'clue_keywords': rule_keywords(user_input) or [user_input]}
+            }
+        return {
+            'intent': 'new_search',
+            'confidence': 'high',
+            'reasoning': 'mock: 新搜索',
+            'additional_info': {'new_query': user_input}
+        }
+
+    if prompt_type == 'fuzzy_correct':
+        query = _extract(r'## 用户原始查询\n"(.*)"', prompt)
+        return {
+            'original_query': query,
+            'corrected_query': query,
+            'explanation': 'mock: 未修正',
+            'confidence': 'high'
+        }
+
+    if prompt_type == 'question_design':
+        block = re.search(r'## 提取的潜在选项（基于实际数据）\n(.*?)\n\n## ', prompt, re.S)
+        extracted = json.loads(block.group(1)) if block else {}
+        # 集合转列表的顺序受哈希随机化影响，排序后保证可复现
+        path_options = sorted(extracted.get('path_keywords', []))
+        filename_options = sorted(extracted.get('filename_keywords', []))
+        if len(path_options) >= 2:
+            options, field = path_options[:4], '层级路径'
+        else:
+            options, field = filename_options[:4], '关联文件名称'
+        return {
+            'analysis': 'mock: 基于提取的潜在选项',
+            'question': '请选择您需要的类别：',
+            'options': options,
+            'filter_field': field,
+            'filter_logic': '包含',
+            'design_reasoning': 'mock'
+        }
+
+    return {}
+
+
+class MockLLMServer:
+    """
+    OpenAI 兼容的 /chat/completions 替身
+    latency: 按模型名配置的 LatencyModel，未配置的模型使用 default_latency
+    canned: 预置答案，键为提示类型或用户提示的 sha1，值为返回的 JSON 对象
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 latency: Optional[Dict[str, LatencyModel]] = None,
+                 default_latency: Optional[LatencyModel] = None,
+                 canned: Optional[Dict[str, Dict]] = None,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency or {}
+        self.default_latency = default_latency or LatencyModel('fixed:0')
+        self.canned = canned or {}
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.request_counts: Dict[str, int] = {}
+
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'MockLLMServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def complete(self, body: Dict) -> Dict:
+        """生成一次补全响应（不含延迟）"""
+        messages = body.get('messages', [])
+        model = body.get('model', '')
+        prompt_type = classify_prompt(messages)
+        prompt = ''.join(m.get('content', '') for m in messages if m.get('role') == 'user')
+
+        with self._lock:
+            self.request_counts[prompt_type] = self.request_counts.get(prompt_type, 0) + 1
+
+        digest = hashlib.sha1(prompt.encode('utf-8')).hexdigest()
+        if BATCH_MARKER in prompt:
+            # 微批处理的多条目提示：逐条生成答案，按编号顺序放入 results
+            items = re.split(r'\n### 输入 \d+\n', prompt.split(BATCH_MARKER, 1)[1])[1:]
+            answer = {'results': [self.canned.get(prompt_type) or rule_answer(prompt_type, item) for item in items]}
+        else:
+            answer = self.canned.get(digest) or self.canned.get(prompt_type) or rule_answer(prompt_type, prompt)
+        content = json.dumps(answer, ensure_ascii=False)
+
+        return {
+            'id': f'mock-{digest[:12]}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop'
+            }],
+            'usage': {
+                # 粗略估计：中文约每字一个 token
+                'prompt_tokens': len(prompt),
+                'completion_tokens': len(content),
+                'total_tokens': len(prompt) + len(content)
+            }
+        }
+
+    def _should_fail(self) -> bool:
+        if self.error_rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # 响应头和响应体分两次写出，关闭 Nagle 避免与延迟确认叠加出 40ms 的假延迟
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    self._reply(404, {'error': {'message': 'not found'}})
+                    return
+
+                model = body.get('model', '')
+                time.sleep(server.latency.get(model, server.default_latency).sample())
+
+                if server._should_fail():
+                    self._reply(503, {'error': {'message': 'mock upstream error', 'type': 'server_error'}})
+                    return
+
+                self._reply(200, server.complete(body))
+
+            def _reply(self, status: int, payload: Dict):
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 OpenAI 兼容的大模型替身服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--chat-latency', default='fixed:0', help='deepseek-chat 的延迟分布')
+    parser.add_argument('--reasoner-latency', default='fixed:0', help='deepseek-reasoner 的延迟分布')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回 503 的比例')
+    parser.add_argument('--canned', help='预置答案 JSON 文件')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    import config
+    canned = None
+    if args.canned:
+        with open(args.canned, encoding='utf-8') as f:
+            canned = json.load(f)
+
+    server = MockLLMServer(
+        args.host, args.port,
+        latency={
+            config.Config.LLM_MODEL: LatencyModel(args.chat_latency, args.seed),
+            config.Config.LLM_REASONER_MODEL: LatencyModel(args.reasoner_latency, args.seed + 1)
+        },
+        canned=canned,
+        error_rate=args.error_rate,
+        seed=args.seed
+    )
+    print(f'Mock LLM 服务已启动: {server.base_url}')
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""
+端到端回放基准
+
+启动本地大模型替身服务，把 data/keywords.txt 和按目录生成的合成查询
+逐条送入 DialogueManager：新搜索之后按固定规则点击选项，直到得到结果或达到轮数上限。
+统计各阶段耗时的 p50/p95/p99、每个已解决查询的大模型调用次数和每个会话的内存占用，
+结果写成 JSON，可与保存的基线比较。
+
+    python -m benchmarks.replay --synthetic 50 --output bench.json
+    python -m benchmarks.replay --baseline bench.json --output bench_new.json
+"""
+import argparse
+import json
+import os
+import pickle
+import platform
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import config
+from benchmarks.mock_llm import LatencyModel, MockLLMServer
+from utils.metrics import LLM_LATENCY, STAGE_LATENCY
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """最近秩法分位数"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize(samples: List[float]) -> Dict:
+    """耗时样本（秒）汇总为毫秒统计"""
+    return {
+        'count': len(samples),
+        'mean_ms': sum(samples) / len(samples) * 1000 if samples else 0.0,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000
+    }
+
+
+class StageRecorder:
+    """订阅阶段耗时和大模型耗时直方图，保留原始样本"""
+
+    def __init__(self):
+        self.stages = defaultdict(list)
+        self.llm = defaultdict(list)
+        self.llm_calls = 0
+
+    def _on_stage(self, value, labels):
+        self.stages[labels.get('stage', '')].append(value)
+
+    def _on_llm(self, value, labels):
+        self.llm[f"{labels.get('model', '')}/{labels.get('prompt', '')}"].append(value)
+        self.llm_calls += 1
+
+    def __enter__(self):
+        STAGE_LATENCY.add_observer(self._on_stage)
+        LLM_LATENCY.add_observer(self._on_llm)
+        return self
+
+    def __exit__(self, *exc):
+        STAGE_LATENCY.remove_observer(self._on_stage)
+        LLM_LATENCY.remove_observer(self._on_llm)
+
+
+def load_keyword_queries(path: str = 'data/keywords.txt') -> List[str]:
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def synthetic_queries(data, count: int, seed: int = 0) -> List[str]:
+    """从目录中抽样行，用路径末两级加文档类型拼出查询"""
+    rng = random.Random(seed)
+    suffixes = ['电路图', '针脚图', '线路图', '仪表图', '']
+    paths = data['层级路径'].tolist()
+    queries = []
+    for _ in range(count):
+        segments = [seg.strip() for seg in rng.choice(paths).split('->') if seg.strip()]
+        tail = ''.join(segments[-2:]) if len(segments) >= 2 else ''.join(segments)
+        queries.append(f'{tail}{rng.choice(suffixes)}')
+    return queries
+
+
+def session_memory_bytes(session) -> int:
+    """会话状态（含结果 DataFrame 和回退栈）序列化后的大小，近似其内存占用"""
+    return len(pickle.dumps(session, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def run_conversation(manager, session_id: str, query: str, max_turns: int, recorder: StageRecorder) -> Dict:
+    """执行一次完整对话：新搜索后总是点击第一个非“其他”选项"""
+    calls_before = recorder.llm_calls
+
+    start = time.perf_counter()
+    response = manager.process_query(session_id, query)
+    recorder.stages['turn'].append(time.perf_counter() - start)
+    turns = 1
+
+    session = manager.get_session(session_id)
+    while response.get('type') == 'question' and turns < max_turns:
+        options = response.get('options') or []
+        if not options:
+            break
+        choice = next((opt for opt in options if not opt.startswith('其他')), options[0])
+
+        start = time.perf_counter()
+        response = manager._handle_option_selection(session, choice)
+        recorder.stages['turn'].append(time.perf_counter() - start)
+        turns += 1
+
+    return {
+        'query': query,
+        'turns': turns,
+        'resolved': response.get('type') == 'results',
+        'llm_calls': recorder.llm_calls - calls_before,
+        'session_bytes': session_memory_bytes(session)
+    }
+
+
+def build_manager(base_url: str):
+    """按应用相同的方式组装组件，但大模型指向替身服务"""
+    config.Config.LLM_BASE_URL = base_url
+    config.Config.LLM_API_KEY = 'mock'
+
+    from utils.data_loader import DataLoader
+    from utils.dialogue_manager import DialogueManager
+    from utils.llm_client import DeepSeekClient
+    from utils.retrieval import CircuitRetriever
+
+    data_loader = DataLoader(config.Config.DATA_FILE)
+    retriever = CircuitRetriever(data_loader)
+    llm_client = DeepSeekClient()
+    return DialogueManager(data_loader, retriever, llm_client)
+
+
+def run_replay(args) -> Dict:
+    server = MockLLMServer(
+        latency={
+            config.Config.LLM_MODEL: LatencyModel(args.chat_latency, args.seed),
+            config.Config.LLM_REASONER_MODEL: LatencyModel(args.reasoner_latency, args.seed + 1)
+        },
+        seed=args.seed
+    ).start()
+
+    try:
+        manager = build_manager(server.base_url)
+        queries = load_keyword_queries(args.keywords) + synthetic_queries(
+            manager.data_loader.frame(), args.synthetic, args.seed)
+
+        conversations = []
+        with StageRecorder() as recorder:
+            for i, query in enumerate(queries):
+                conversations.append(run_conversation(manager, f'replay-{i}', query, args.max_turns, recorder))
+    finally:
+        server.stop()
+
+    resolved = [c for c in conversations if c['resolved']]
+    session_bytes = [c['session_bytes'] for c in conversations]
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'catalog_rows': len(manager.data_loader),
+            'queries': len(queries),
+            'synthetic': args.synthetic,
+            'seed': args.seed,
+            'max_turns': args.max_turns,
+            'chat_latency': args.chat_latency,
+            'reasoner_latency': args.reasoner_latency
+        },
+        'stages': {stage: summarize(samples) for stage, samples in sorted(recorder.stages.items())},
+        'llm': {
+            'calls_total': recorder.llm_calls,
+            'calls_per_resolved_query': (sum(c['llm_calls'] for c in resolved) / len(resolved)) if resolved else None,
+            'by_model_prompt': {key: summarize(samples) for key, samples in sorted(recorder.llm.items())},
+            'server_requests': dict(server.request_counts)
+        },
+        'queries': {
+            'total': len(conversations),
+            'resolved': len(resolved),
+            'mean_turns': sum(c['turns'] for c in conversations) / len(conversations) if conversations else 0
+        },
+        'memory': {
+            'session_bytes_mean': sum(session_bytes) / len(session_bytes) if session_bytes else 0,
+            'session_bytes_max': max(session_bytes) if session_bytes else 0
+        }
+    }
+
+
+def compare_with_baseline(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """比较各阶段 p95 和每个已解决查询的大模型调用数，返回超出容差的回归项"""
+    regressions = []
+    for stage, current in report['stages'].items():
+        previous = baseline.get('stages', {}).get(stage)
+        if not previous:
+            continue
+        # 忽略 1ms 以内的抖动
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance) and current['p95_ms'] - previous['p95_ms'] > 1:
+            regressions.append(f"{stage}: p95 {previous['p95_ms']:.1f}ms -> {current['p95_ms']:.1f}ms")
+
+    current_calls = report['llm']['calls_per_resolved_query']
+    previous_calls = baseline.get('llm', {}).get('calls_per_resolved_query')
+    if current_calls and previous_calls and current_calls > previous_calls * (1 + tolerance):
+        regressions.append(f'calls_per_resolved_query: {previous_calls:.2f} -> {current_calls:.2f}')
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='使用本地大模型替身的端到端回放基准')
+    parser.add_argument('--keywords', default='data/keywords.txt', help='回放的真实查询')
+    parser.add_argument('--synthetic', type=int, default=50, help='额外生成的合成查询数')
+    parser.add_argument('--max-turns', type=int, default=6, help='每个对话的最大轮数')
+    parser.add_argument('--chat-latency', default='lognormal:0.05:0.5', help='deepseek-chat 延迟分布')
+    parser.add_argument('--reasoner-latency', default='lognormal:0.2:0.6', help='deepseek-reasoner 延迟分布')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--baseline', help='基线 JSON，用于比较')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的相对退化比例')
+    args = parser.parse_args()
+
+    if os.environ.get('PYTHONHASHSEED') != str(args.seed):
+        # 选项提取经过 set，固定字符串哈希种子才能保证每次回放走相同的对话路径
+        env = dict(os.environ, PYTHONHASHSEED=str(args.seed))
+        os.execve(sys.executable, [sys.executable, '-m', 'benchmarks.replay'] + sys.argv[1:], env)
+
+    report = run_replay(args)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"回放 {report['queries']['total']} 个查询，已解决 {report['queries']['resolved']} 个，结果已写入 {args.output}")
+    for stage, stats in report['stages'].items():
+        print(f"  {stage:<24} n={stats['count']:<5} p50={stats['p50_ms']:8.1f}ms "
+              f"p95={stats['p95_ms']:8.1f}ms p99={stats['p99_ms']:8.1f}ms")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(report, baseline, args.tolerance)
+        if regressions:
+            print('⚠️ 相对基线的退化：')
+            for item in regressions:
+                print(f'  - {item}')
+            sys.exit(1)
+        print('✅ 未发现超出容差的退化')
+
+
+if __name__ == '__main__':
+    main()
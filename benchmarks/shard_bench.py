@@ -0,0 +1,113 @@
+"""
+分片检索的加速比报告
+
+在合成目录（分布取自真实资料清单，见 catalog_bench）上对比单进程检索引擎（紧凑目录 + 关键词位图，关闭位图缓存）
+和不同分片数的多进程分片检索（SEARCH_BACKEND=sharded）：
+    - 1–8 个关键词的单次检索耗时与加速比
+    - 批量查询吞吐：同一批查询由与分片数相同的线程并发提交
+
+    python -m benchmarks.shard_bench --rows 1000000 --shards 1,2,4,8
+加速比受 CPU 核数限制（报告中记录了 cpu_count），分片数超过核数时不会更快。
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import pandas as pd
+
+import config
+from benchmarks.catalog_bench import CatalogProfile, _keyword_pool, generate_catalog, write_catalog
+
+
+def _time_searches(retriever, keyword_sets: Dict[int, List[List[str]]]) -> Dict:
+    """每种关键词个数的平均耗时（毫秒）"""
+    report = {}
+    for count, sets in keyword_sets.items():
+        samples = []
+        for keywords in sets:
+            start = time.perf_counter()
+            retriever.search(keywords)
+            samples.append((time.perf_counter() - start) * 1000)
+        report[count] = statistics.mean(samples)
+    return report
+
+
+def _batch_qps(retriever, batch: List[List[str]], threads: int) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(retriever.search, batch))
+    return len(batch) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多进程分片检索相对单进程检索的加速比')
+    parser.add_argument('--rows', type=int, default=1000000, help='合成目录的行数')
+    parser.add_argument('--shards', default='1,2,4,8', help='逗号分隔的分片数')
+    parser.add_argument('--queries', type=int, default=5, help='每种关键词个数执行的查询次数')
+    parser.add_argument('--batch', type=int, default=64, help='批量吞吐测试的查询数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='shard_bench.json')
+    args = parser.parse_args()
+
+    from utils.catalog_index import CatalogIndex
+    from utils.data_loader import DataLoader
+    from utils.retrieval import CircuitRetriever, CompactSearchBackend
+    from utils.sharded_retrieval import ShardedSearchBackend
+
+    rng = random.Random(args.seed)
+    real = pd.read_csv(config.Config.DATA_FILE, encoding='utf-8').dropna()
+    real.columns = ['ID', '层级路径', '关联文件名称']
+    catalog = generate_catalog(CatalogProfile(real), args.rows, args.seed)
+    keyword_pool = _keyword_pool(catalog, rng)
+    keyword_sets = {count: [rng.sample(keyword_pool, count) for _ in range(args.queries)] for count in range(1, 9)}
+    batch = [rng.sample(keyword_pool, rng.randint(2, 5)) for _ in range(args.batch)]
+
+    tmp = tempfile.mkdtemp()
+    try:
+        csv_path = os.path.join(tmp, 'catalog.csv')
+        write_catalog(catalog, csv_path)
+        del catalog, real
+        data_loader = DataLoader(csv_path, 'compact')
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    # 单进程引擎：关闭关键词位图缓存，与分片检索一样每次都实际扫描
+    data_loader.index = CatalogIndex(None, catalog=data_loader.catalog, cache_size=0)
+    single = CircuitRetriever(data_loader, CompactSearchBackend(data_loader))
+    baseline = _time_searches(single, keyword_sets)
+    baseline_qps = _batch_qps(single, batch, 1)
+    print(f"单进程：检索均值(ms) {', '.join(f'{k}:{v:.0f}' for k, v in baseline.items())}，批量 {baseline_qps:.1f} 查询/s")
+
+    report = {'rows': args.rows, 'cpu_count': os.cpu_count(), 'single': {'search_ms': baseline, 'batch_qps': baseline_qps},
+              'sharded': []}
+    for shards in [int(value) for value in args.shards.split(',') if value]:
+        backend = ShardedSearchBackend(data_loader, shards)
+        try:
+            retriever = CircuitRetriever(data_loader, backend)
+            # 首次检索时才启动进程池，不计入耗时
+            retriever.search(keyword_sets[1][0])
+            search_ms = _time_searches(retriever, keyword_sets)
+            qps = _batch_qps(retriever, batch, shards)
+        finally:
+            backend.close()
+        speedup = {count: baseline[count] / value for count, value in search_ms.items()}
+        report['sharded'].append({'shards': shards, 'search_ms': search_ms, 'speedup': speedup,
+                                  'batch_qps': qps, 'batch_speedup': qps / baseline_qps})
+        print(f"{shards} 个分片：检索均值(ms) {', '.join(f'{k}:{v:.0f}' for k, v in search_ms.items())}，"
+              f"加速比 {min(speedup.values()):.2f}–{max(speedup.values()):.2f}，"
+              f"批量 {qps:.1f} 查询/s（{qps / baseline_qps:.2f}×）")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'结果已写入 {args.output}')
+
+
+if __name__ == '__main__':
+    main()
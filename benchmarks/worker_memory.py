@@ -0,0 +1,113 @@
+"""
+gunicorn 多 worker 的内存报告：对比普通模式与预加载模式（PRELOAD_APP=true）
+
+分别启动 gunicorn（相同的 worker 数和目录存储方式），向各 worker 发送检索请求使其访问整个目录，
+再读取主进程和每个 worker 的 /proc/<pid>/smaps_rollup：
+    - rss_mb：常驻内存，共享页在每个进程中都计入
+    - pss_mb：共享页按进程数分摊，各进程之和即整组进程的实际占用
+    - private_dirty_mb：进程独有的页（预加载模式下即写时复制复制出的页）
+
+    python -m benchmarks.worker_memory --workers 4 --store compact
+    python -m benchmarks.worker_memory --workers 4 --store compact --rows 1000000
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import urllib.request
+from typing import Dict, List
+
+import pandas as pd
+
+import config
+from benchmarks.catalog_bench import CatalogProfile, _keyword_pool, generate_catalog, write_catalog
+from benchmarks.load_test import AppProcess
+from utils.metrics import process_memory
+
+
+def _warm_up(base_url: str, keyword_pool: List[str], requests: int, seed: int):
+    """发送检索请求，让每个 worker 都访问一遍目录和索引"""
+    rng = random.Random(seed)
+    for _ in range(requests):
+        payload = json.dumps({'keywords': rng.sample(keyword_pool, min(3, len(keyword_pool)))}).encode('utf-8')
+        request = urllib.request.Request(f'{base_url}/api/search/explain', data=payload, method='POST',
+                                         headers={'Content-Type': 'application/json'})
+        urllib.request.urlopen(request, timeout=120).read()
+
+
+def measure(preload: bool, workers: int, store: str, data_file: str, keyword_pool: List[str],
+            requests: int, seed: int) -> Dict:
+    env = {'PRELOAD_APP': 'true' if preload else 'false', 'CATALOG_STORE': store, 'DATA_FILE': data_file}
+    # 大模型不会被调用，指向一个不存在的地址即可
+    app = AppProcess('http://127.0.0.1:9', workers, 1, env=env)
+    try:
+        start = time.perf_counter()
+        app.start()
+        startup_s = time.perf_counter() - start
+        _warm_up(app.base_url, keyword_pool, requests, seed)
+        time.sleep(1)
+
+        master = process_memory(app.process.pid)
+        worker_reports = [process_memory(pid) for pid in sorted(app.worker_pids())]
+    finally:
+        app.stop()
+
+    return {
+        'preload': preload,
+        'startup_s': startup_s,
+        'master': master,
+        'workers': worker_reports,
+        'worker_rss_mb': sum(report.get('rss_mb', 0) for report in worker_reports) / max(len(worker_reports), 1),
+        'worker_private_dirty_mb': sum(report.get('private_dirty_mb', 0) for report in worker_reports)
+        / max(len(worker_reports), 1),
+        'total_pss_mb': master.get('pss_mb', 0) + sum(report.get('pss_mb', 0) for report in worker_reports)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='gunicorn 普通模式与预加载模式的 worker 内存对比')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker 数')
+    parser.add_argument('--store', default='compact', choices=['dataframe', 'compact'], help='目录的内存形式')
+    parser.add_argument('--rows', type=int, default=0, help='合成目录的行数（0 表示使用真实资料清单）')
+    parser.add_argument('--requests', type=int, default=200, help='预热的检索请求数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='worker_memory.json')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    real = pd.read_csv(config.Config.DATA_FILE, encoding='utf-8').dropna()
+    real.columns = ['ID', '层级路径', '关联文件名称']
+
+    tmp = tempfile.mkdtemp(prefix='circuit-memory-')
+    try:
+        if args.rows:
+            catalog = generate_catalog(CatalogProfile(real), args.rows, args.seed)
+            data_file = os.path.join(tmp, 'catalog.csv')
+            write_catalog(catalog, data_file)
+        else:
+            catalog = real.astype(str).values.tolist()
+            data_file = os.path.abspath(config.Config.DATA_FILE)
+        keyword_pool = _keyword_pool(catalog, rng)
+        del catalog, real
+
+        reports = []
+        for preload in (False, True):
+            report = measure(preload, args.workers, args.store, data_file, keyword_pool, args.requests, args.seed)
+            reports.append(report)
+            print(f"{'预加载' if preload else '普通'}：启动 {report['startup_s']:.1f}s，"
+                  f"worker 平均 RSS {report['worker_rss_mb']:.0f}MB、独有 {report['worker_private_dirty_mb']:.0f}MB，"
+                  f"主进程 + {len(report['workers'])} 个 worker 的 PSS 合计 {report['total_pss_mb']:.0f}MB")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'workers': args.workers, 'store': args.store, 'rows': args.rows, 'reports': reports},
+                  f, ensure_ascii=False, indent=2)
+    print(f'结果已写入 {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,10 @@ class Config:
     DEBUG = False
     
     # 数据文件
-    DATA_FILE = 'data/资料清单.csv'
+    DATA_FILE = os.environ.get('DATA_FILE', 'data/资料清单.csv')
+    
+    # gunicorn 预加载：主进程构建目录和索引后再 fork，worker 按写时复制共享（配合 CATALOG_STORE=compact）
+    PRELOAD_APP = os.environ.get('PRELOAD_APP', 'false').lower() == 'true'
     
     # 大模型配置
     LLM_API_KEY = os.environ.get('LLM_API_KEY')  # 本地开发可以保留
@@ -15,10 +18,88 @@ class Config:
     LLM_MODEL = os.environ.get('LLM_MODEL', 'deepseek-chat')
     LLM_REASONER_MODEL = os.environ.get('LLM_REASONER_MODEL', 'deepseek-reasoner')
     
+    # 大模型网关：每个模型的并发上限、有界等待队列和熔断阈值
+    LLM_REQUEST_TIMEOUT = float(os.environ.get('LLM_REQUEST_TIMEOUT', 60))  # 单次调用超时（秒）
+    LLM_MAX_IN_FLIGHT = int(os.environ.get('LLM_MAX_IN_FLIGHT', 8))
+    LLM_REASONER_MAX_IN_FLIGHT = int(os.environ.get('LLM_REASONER_MAX_IN_FLIGHT', 3))
+    LLM_MAX_QUEUE = int(os.environ.get('LLM_MAX_QUEUE', 16))  # 超出并发上限后最多排队的调用数
+    LLM_QUEUE_TIMEOUT = float(os.environ.get('LLM_QUEUE_TIMEOUT', 10))  # 排队超过该时长（秒）即放弃
+    LLM_BREAKER_WINDOW = 20  # 熔断统计的最近调用数
+    LLM_BREAKER_MIN_CALLS = 5  # 窗口内至少这么多次调用才判断是否熔断
+    LLM_BREAKER_ERROR_RATE = float(os.environ.get('LLM_BREAKER_ERROR_RATE', 0.5))
+    LLM_BREAKER_SLOW_CALL_RATE = float(os.environ.get('LLM_BREAKER_SLOW_CALL_RATE', 0.5))
+    LLM_SLOW_CALL_SECONDS = float(os.environ.get('LLM_SLOW_CALL_SECONDS', 10))
+    LLM_REASONER_SLOW_CALL_SECONDS = float(os.environ.get('LLM_REASONER_SLOW_CALL_SECONDS', 45))
+    # 对话轮次限时时，慢调用阈值不超过单轮可用于大模型的时长（预算减预留）的这一比例，否则被预算截断的调用永远达不到阈值
+    LLM_SLOW_CALL_BUDGET_SHARE = float(os.environ.get('LLM_SLOW_CALL_BUDGET_SHARE', 0.8))
+    LLM_BREAKER_OPEN_SECONDS = float(os.environ.get('LLM_BREAKER_OPEN_SECONDS', 30))  # 熔断后多久放行探测调用
+    
+    # 请求对冲：调用超过该提示类型最近耗时的分位数仍未返回时再发一个相同请求，先返回者胜出
+    LLM_HEDGE_ENABLED = os.environ.get('LLM_HEDGE_ENABLED', 'false').lower() == 'true'
+    LLM_HEDGE_PROMPTS = [p for p in os.environ.get('LLM_HEDGE_PROMPTS', 'intent,keywords').split(',') if p]
+    LLM_HEDGE_QUANTILE = float(os.environ.get('LLM_HEDGE_QUANTILE', 0.9))
+    LLM_HEDGE_MIN_DELAY = 0.05  # 对冲等待的下限（秒）
+    LLM_HEDGE_WINDOW = 200  # 每种提示类型保留的最近耗时样本数
+    LLM_HEDGE_MIN_SAMPLES = 20  # 样本少于该数时不对冲
+    LLM_HEDGE_RATE = float(os.environ.get('LLM_HEDGE_RATE', 0.05))  # 对冲请求占调用数的比例上限
+    LLM_HEDGE_BURST = 5  # 预算令牌上限
+    
+    # 提示微批处理：同类提示在短窗口内合并为一次多条目请求
+    LLM_BATCH_ENABLED = os.environ.get('LLM_BATCH_ENABLED', 'false').lower() == 'true'
+    LLM_BATCH_WINDOW = float(os.environ.get('LLM_BATCH_WINDOW_MS', 10)) / 1000  # 秒
+    LLM_BATCH_MAX_ITEMS = int(os.environ.get('LLM_BATCH_MAX_ITEMS', 8))
+    
+    # 对话轮次的时间预算：各阶段共享，预算不足时改用规则意图、本地关键词和提取选项
+    CHAT_TURN_BUDGET = float(os.environ.get('CHAT_TURN_BUDGET', 3.0))  # 秒，0 表示不限时
+    CHAT_BUDGET_RESERVE = float(os.environ.get('CHAT_BUDGET_RESERVE', 0.5))  # 为检索、筛选和格式化等本地阶段预留的秒数
+    LLM_MIN_CALL_SECONDS = 0.3  # 剩余可用时间少于该值时不再调用大模型
+    
+    # 日志配置：DEBUG 时输出每个关键词、组合和筛选策略的明细
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')  # text 或 json
+    
+    # /api/metrics 的访问令牌（请求头 Authorization: Bearer <令牌>）；为空时只接受本机请求
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    
     # 搜索配置
     MAX_RESULTS_DISPLAY = 5
-    MAX_RESULTS_ANALYSIS = 20
+    RESULTS_PAGE_SIZE = int(os.environ.get('RESULTS_PAGE_SIZE', 100))  # 查看当前结果时每页的条数（前端滚动到底部时加载下一页）
+    RESULTS_PAGE_MAX = 500
+    SUGGEST_LIMIT = int(os.environ.get('SUGGEST_LIMIT', 8))  # 输入联想最多返回的补全数
+    
+    # 目录的内存形式：dataframe 为 pandas DataFrame；compact 为字典编码的紧凑目录（路径段驻留、文件名字节区），
+    # 内存占用小数倍，适合百万行目录和多 worker 部署
+    CATALOG_STORE = os.environ.get('CATALOG_STORE', 'dataframe')
+
+    # 检索后端：pandas 在内存目录中扫描（compact 目录上使用关键词位图）；sqlite 使用 FTS5 trigram 索引（磁盘文件，多个 worker 共享页缓存）；
+    # sharded 把目录切成分片由进程池并行匹配
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'pandas')
+    SEARCH_FTS_PATH = os.environ.get(
+        'SEARCH_FTS_PATH',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'catalog_fts.db')
+    )
+    # sharded 后端的分片数（进程池大小），默认为 CPU 核数
+    SEARCH_SHARDS = int(os.environ.get('SEARCH_SHARDS', os.cpu_count() or 1))
+    QUESTION_PROMPT_TOKEN_BUDGET = int(os.environ.get('QUESTION_PROMPT_TOKEN_BUDGET', 1200))  # 问题设计提示中结果概览的 token 上限
+    
+    # 批量检索（/api/search/batch）：单次请求的查询数上限（由大模型提取关键词时另有更小的上限）、每个查询返回的 ID 数上限、一批查询内共享的关键词探测结果的内存上限
+    BATCH_SEARCH_MAX_QUERIES = int(os.environ.get('BATCH_SEARCH_MAX_QUERIES', 5000))
+    BATCH_SEARCH_MAX_LLM_QUERIES = int(os.environ.get('BATCH_SEARCH_MAX_LLM_QUERIES', 20))  # 由大模型提取关键词时的查询数上限
+    BATCH_SEARCH_MAX_LIMIT = 200
+    # 由大模型提取关键词的批量查询共用的并发上限和排队数（与对话共用同一模型，离线流量最多占用这么多并发名额）
+    BATCH_SEARCH_LLM_MAX_IN_FLIGHT = int(os.environ.get('BATCH_SEARCH_LLM_MAX_IN_FLIGHT', 1))
+    BATCH_SEARCH_LLM_MAX_QUEUE = int(os.environ.get('BATCH_SEARCH_LLM_MAX_QUEUE', 4))
+    # 批量检索的 API 密钥（请求头 X-API-Key），未登录的离线调用方使用；为空时只接受已登录用户
+    BATCH_SEARCH_API_KEY = os.environ.get('BATCH_SEARCH_API_KEY')
+    BATCH_PROBE_CACHE_MB = int(os.environ.get('BATCH_PROBE_CACHE_MB', 256))
+    
+    # 问题设计的分级路由：能按某层路径干净切分时本地出题，歧义较小时用对话模型，其余用推理模型
+    QUESTION_ROUTER_ENABLED = os.environ.get('QUESTION_ROUTER_ENABLED', 'true').lower() == 'true'
+    QUESTION_ROUTER_CHAT_MAX_ENTROPY = float(os.environ.get('QUESTION_ROUTER_CHAT_MAX_ENTROPY', 2.5))  # 比特
+    QUESTION_ROUTER_CHAT_MAX_SEGMENTS = int(os.environ.get('QUESTION_ROUTER_CHAT_MAX_SEGMENTS', 30))
     MAX_OPTIONS_DISPLAY = 6
+    # 本地出题的选项数上限：引导时最多保留 MAX_OPTIONS_DISPLAY - 1 个选项（留一个位置给“其他”）
+    QUESTION_ROUTER_LOCAL_MAX_OPTIONS = MAX_OPTIONS_DISPLAY - 1
     
     # 数据库配置：关键修改点！
     DATABASE_URL = os.environ.get('DATABASE_URL')
@@ -0,0 +1,30 @@
+"""
+gunicorn 配置（在项目根目录启动 gunicorn 时自动读取）
+
+PRELOAD_APP=true 时应用在主进程中加载：目录、各索引和检索器只构建一次，fork 出的 worker 按写时复制共享这些内存页。
+配合 CATALOG_STORE=compact 使用：紧凑目录是少数几块连续的 NumPy / 字节缓冲区，worker 访问时只改动对象头所在的页，
+而 DataFrame 的每个字符串都是独立对象，引用计数一变化所在页就会被复制。
+fork 前把已有对象移入垃圾回收的永久代，避免 worker 中的 GC 遍历改写对象头而复制内存页。
+"""
+import gc
+
+# 本文件中的模块级名字会被当作 gunicorn 配置项（其中就有 config），只导入 Config 类
+from config import Config
+
+preload_app = Config.PRELOAD_APP
+
+
+def when_ready(server):
+    """主进程加载完应用、即将创建 worker"""
+    if preload_app:
+        gc.collect()
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    """worker 进程中，fork 之后立即执行"""
+    if preload_app:
+        # 主进程初始化时建立的数据库连接不能跨进程使用：丢弃继承来的连接池，但不关闭父进程的连接
+        from app import app, db
+        with app.app_context():
+            db.engine.dispose(close=False)
@@ -8,6 +8,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const fuzzyMatchButton = document.getElementById('fuzzyMatchButton');
     const saveConversationBtn = document.getElementById('saveConversationBtn');
     const optionsContainer = document.getElementById('optionsContainer');
+    const suggestContainer = document.getElementById('suggestContainer');
     
     // 用户相关元素
     const loginBtn = document.getElementById('loginBtn');
@@ -47,6 +48,15 @@ document.addEventListener('DOMContentLoaded', function() {
     // 存储当前对话消息
     let conversationMessages = [];
     
+    // 输入联想：停止输入一段时间后才请求，过期的请求被取消
+    const SUGGEST_DEBOUNCE_MS = 150;
+    let suggestTimer = null;
+    let suggestController = null;
+    
+    // 当前结果分页：滚动到接近底部时按游标加载下一页，追加到同一条消息中
+    const RESULTS_LOAD_MARGIN_PX = 200;
+    let resultsPager = null;
+    
     // 初始化
     checkServerStatus();
     checkAuthStatus();
@@ -58,6 +68,7 @@ document.addEventListener('DOMContentLoaded', function() {
             sendMessage();
         }
     });
+    messageInput.addEventListener('input', scheduleSuggest);
     
     // 重置对话 - 发送特殊指令
     resetButton.addEventListener('click', function() {
@@ -75,6 +86,7 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // 查看当前结果
     showResultsButton.addEventListener('click', showCurrentResults);
+    chatHistory.addEventListener('scroll', loadMoreResultsIfNeeded);
     
     // 模糊匹配按钮点击事件
     fuzzyMatchButton.addEventListener('click', function() {
@@ -208,8 +220,9 @@ document.addEventListener('DOMContentLoaded', function() {
         // 清空输入框
         messageInput.value = '';
         
-        // 隐藏选项容器
+        // 隐藏选项容器和输入联想
         hideOptions();
+        hideSuggestions();
         
         // 发送请求
         fetch('/api/chat', {
@@ -248,13 +261,15 @@ document.addEventListener('DOMContentLoaded', function() {
     function showCurrentResults() {
         // 显示加载状态
         showLoading();
+        resultsPager = null;
         
-        // 发送请求
+        // 发送请求（第一页）
         fetch('/api/show_current_results', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
-            }
+            },
+            body: JSON.stringify({})
         })
         .then(response => response.json())
         .then(data => {
@@ -263,14 +278,20 @@ document.addEventListener('DOMContentLoaded', function() {
             
             if (data.success) {
                 // 直接显示结果，不经过大模型
-                addMessage(data.response.content, 'assistant');
+                const textSpan = addMessage(data.response.content, 'assistant');
                 
                 // 记录助手消息
-                conversationMessages.push({
+                const record = {
                     role: 'assistant',
                     content: data.response.content,
                     timestamp: new Date().toISOString()
-                });
+                };
+                conversationMessages.push(record);
+                
+                if (data.response.next_cursor) {
+                    resultsPager = { cursor: data.response.next_cursor, textSpan: textSpan, record: record, loading: false };
+                    loadMoreResultsIfNeeded();
+                }
             } else {
                 addMessage('抱歉，获取当前结果时出现了错误。请先进行搜索。', 'assistant');
             }
@@ -282,6 +303,47 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    function loadMoreResultsIfNeeded() {
+        if (!resultsPager || resultsPager.loading) return;
+        const distance = chatHistory.scrollHeight - chatHistory.scrollTop - chatHistory.clientHeight;
+        if (distance > RESULTS_LOAD_MARGIN_PX) return;
+        
+        const pager = resultsPager;
+        pager.loading = true;
+        fetch('/api/show_current_results', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ cursor: pager.cursor })
+        })
+        .then(response => response.json())
+        .then(data => {
+            // 期间又打开了新的结果列表时丢弃
+            if (resultsPager !== pager) return;
+            if (!data.success) {
+                resultsPager = null;
+                return;
+            }
+            
+            // 追加到同一条消息，不改变滚动位置
+            pager.textSpan.insertAdjacentHTML('beforeend', data.response.content.replace(/\n/g, '<br>'));
+            pager.record.content += data.response.content;
+            
+            if (data.response.next_cursor && !data.response.stale) {
+                pager.cursor = data.response.next_cursor;
+                pager.loading = false;
+                loadMoreResultsIfNeeded();
+            } else {
+                resultsPager = null;
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            pager.loading = false;
+        });
+    }
+    
     function showFuzzyMatchModal(query) {
         // 显示加载状态
         showLoading();
@@ -399,9 +461,11 @@ document.addEventListener('DOMContentLoaded', function() {
         chatHistory.appendChild(messageDiv);
         
         scrollToBottom();
+        return textSpan;
     }
     
     function clearChatHistory() {
+        resultsPager = null;
         chatHistory.innerHTML = '';
     }
     
@@ -451,6 +515,70 @@ document.addEventListener('DOMContentLoaded', function() {
         optionsContainer.innerHTML = '';
     }
     
+    function scheduleSuggest() {
+        clearTimeout(suggestTimer);
+        const query = messageInput.value;
+        if (!query.trim() || query.startsWith('/')) {
+            hideSuggestions();
+            return;
+        }
+        suggestTimer = setTimeout(() => fetchSuggestions(query), SUGGEST_DEBOUNCE_MS);
+    }
+    
+    function fetchSuggestions(query) {
+        if (suggestController) {
+            suggestController.abort();
+        }
+        suggestController = new AbortController();
+        
+        fetch(`/api/suggest?q=${encodeURIComponent(query)}`, { signal: suggestController.signal })
+        .then(response => response.json())
+        .then(data => {
+            // 请求返回前输入已变化时丢弃
+            if (messageInput.value !== query) return;
+            showSuggestions(data.suggestions || []);
+        })
+        .catch(error => {
+            if (error.name !== 'AbortError') {
+                console.error('Error:', error);
+            }
+        });
+    }
+    
+    function showSuggestions(suggestions) {
+        suggestContainer.innerHTML = '';
+        if (suggestions.length === 0) {
+            hideSuggestions();
+            return;
+        }
+        
+        suggestions.forEach(suggestion => {
+            const button = document.createElement('button');
+            button.className = 'suggest-item';
+            button.textContent = suggestion.text;
+            button.title = `${suggestion.count} 份资料`;
+            
+            button.addEventListener('click', function() {
+                messageInput.value = suggestion.query;
+                hideSuggestions();
+                messageInput.focus();
+            });
+            
+            suggestContainer.appendChild(button);
+        });
+        suggestContainer.classList.add('active');
+    }
+    
+    function hideSuggestions() {
+        clearTimeout(suggestTimer);
+        if (suggestController) {
+            suggestController.abort();
+            suggestController = null;
+        }
+        suggestContainer.classList.remove('active');
+        suggestContainer.innerHTML = '';
+    }
+    
     function showLoading() {
         const loadingDiv = document.createElement('div');
         loadingDiv.className = 'message assistant loading';
@@ -633,6 +761,7 @@ document.addEventListener('DOMContentLoaded', function() {
         }
         if (e.key === 'Escape') {
             messageInput.value = '';
+            hideSuggestions();
         }
     });
     
@@ -0,0 +1,4 @@
+import os
+
+# 路由测试使用内存数据库，不在 instance/ 下生成数据库文件；须在导入 config 之前设置
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
@@ -0,0 +1,136 @@
+import json
+
+import pytest
+
+import app as app_module
+from utils.llm_gateway import ModelLimiter
+
+
+@pytest.fixture
+def client():
+    app_module.app.config['TESTING'] = True
+    with app_module.app.test_client() as client:
+        yield client
+
+
+@pytest.fixture
+def user_client(client):
+    response = client.post('/register', json={
+        'username': 'tester', 'email': 'tester@example.com', 'password': 'secret1'})
+    if response.status_code == 400:
+        # 同一进程中已注册过，直接登录
+        response = client.post('/login', json={'username': 'tester', 'password': 'secret1'})
+    assert response.status_code == 200
+    return client
+
+
+def test_explain_requires_login(client):
+    response = client.post('/api/search/explain', json={'keywords': ['三一']})
+    assert response.status_code in (302, 401)
+
+
+@pytest.mark.parametrize('body', [
+    {'query': 5},
+    {'keywords': '三一'},
+    {'keywords': ['三一', 5]},
+    ['三一'],
+])
+def test_explain_rejects_malformed_body(user_client, body):
+    response = user_client.post('/api/search/explain', json=body)
+    assert response.status_code == 400
+
+
+def test_explain_keeps_keywords_whole(user_client):
+    response = user_client.post('/api/search/explain', json={'keywords': ['三一', ' 挖掘机 ']})
+    assert response.status_code == 200
+    payload = response.get_json()
+    assert payload['keywords'] == ['三一', '挖掘机']
+    assert payload['top_results']
+
+
+def test_batch_requires_login_or_api_key(client, monkeypatch):
+    body = {'queries': [['三一', '挖掘机']]}
+    assert client.post('/api/search/batch', json=body).status_code == 401
+
+    monkeypatch.setattr(app_module.config.Config, 'BATCH_SEARCH_API_KEY', 'batch-key')
+    assert client.post('/api/search/batch', json=body, headers={'X-API-Key': 'wrong'}).status_code == 401
+    response = client.post('/api/search/batch', json=body, headers={'X-API-Key': 'batch-key'})
+    assert response.status_code == 200
+
+
+def test_batch_shares_probes_and_matches_search(user_client):
+    queries = [['三一', '挖掘机'], ['三一', '仪表'], ['挖掘机', '仪表', '三一']]
+    response = user_client.post('/api/search/batch', json={'queries': queries, 'limit': 200})
+    payload = response.get_json()
+
+    # 重复的 (字段, 关键词) 只探测一次
+    stats = payload['stats']
+    assert stats['queries'] == 3
+    assert stats['probes_executed'] < stats['probes_requested']
+
+    for keywords, result in zip(queries, payload['results']):
+        expected = app_module.retriever.search(keywords)
+        assert result['keywords'] == keywords
+        assert result['total'] == len(expected)
+        assert set(result['ids']) == set(expected['ID'].astype(str).head(200))
+
+
+@pytest.mark.parametrize('body', [[], 'x', None])
+def test_batch_rejects_non_object_body(user_client, body):
+    response = user_client.post('/api/search/batch', data=json.dumps(body), content_type='application/json')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': '请求体应为 JSON 对象'}
+
+
+def test_batch_stream_ends_with_stats(user_client):
+    queries = [['三一', '挖掘机'], '三一 仪表']
+    response = user_client.post('/api/search/batch', json={'queries': queries, 'limit': 5, 'stream': True})
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    assert len(lines) == len(queries) + 1
+    assert [line['query'] for line in lines[:-1]] == [None, '三一 仪表']
+    assert all(len(line['ids']) <= 5 for line in lines[:-1])
+    assert lines[-1]['stats']['queries'] == len(queries)
+
+
+def test_batch_llm_extraction_uses_offline_limiter(user_client, monkeypatch):
+    # 离线名额已占满且不排队：批量请求不调用大模型，改用本地提取，对话的名额不受影响
+    llm_client = app_module.llm_client
+    monkeypatch.setattr(llm_client, 'offline_limiter', ModelLimiter(1, 0, 0.01))
+    monkeypatch.setattr(llm_client, 'extract_keywords', lambda query: pytest.fail('不应调用大模型'))
+    llm_client.offline_limiter.acquire()
+
+    response = user_client.post('/api/search/batch', json={'queries': ['三一 挖掘机'], 'extractor': 'llm'})
+    result = response.get_json()['results'][0]
+    assert result['keywords'] == app_module.data_loader.keyword_extractor.extract('三一 挖掘机')
+
+
+def test_metrics_requires_token_or_local_request(client, monkeypatch):
+    monkeypatch.setattr(app_module.config.Config, 'METRICS_TOKEN', None)
+    assert client.get('/api/metrics', environ_base={'REMOTE_ADDR': '203.0.113.5'}).status_code == 403
+    assert client.get('/api/metrics', environ_base={'REMOTE_ADDR': '127.0.0.1'}).status_code == 200
+    # 同机反向代理转发的外部请求
+    assert client.get('/api/metrics', headers={'X-Forwarded-For': '203.0.113.5'},
+                      environ_base={'REMOTE_ADDR': '127.0.0.1'}).status_code == 403
+
+    monkeypatch.setattr(app_module.config.Config, 'METRICS_TOKEN', 'scrape-token')
+    assert client.get('/api/metrics', environ_base={'REMOTE_ADDR': '127.0.0.1'}).status_code == 403
+    response = client.get('/api/metrics', headers={'Authorization': 'Bearer scrape-token'},
+                          environ_base={'REMOTE_ADDR': '203.0.113.5'})
+    assert response.status_code == 200
+    assert 'circuit_stage_duration_seconds' in response.get_data(as_text=True)
+
+
+def test_suggest_route_caps_limit(client, monkeypatch):
+    monkeypatch.setattr(app_module.config.Config, 'SUGGEST_LIMIT', 3)
+    payload = client.get('/api/suggest?q=三&limit=50').get_json()
+    assert payload['query'] == '三'
+    assert 0 < len(payload['suggestions']) <= 3
+    assert all(suggestion['text'].lower().startswith('三') for suggestion in payload['suggestions'])
+    counts = [suggestion['count'] for suggestion in payload['suggestions']]
+    assert counts == sorted(counts, reverse=True)
+
+    # 非法的 limit 使用默认值
+    assert len(client.get('/api/suggest?q=三&limit=abc').get_json()['suggestions']) <= 3
+    assert client.get('/api/suggest').get_json()['suggestions'] == []
@@ -0,0 +1,198 @@
+import asyncio
+import json
+from http.cookies import SimpleCookie
+
+import openai
+import pytest
+
+import app as app_module
+import asgi
+import config
+
+
+class Response:
+    def __init__(self, status: int, headers, body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+    def session_cookie(self):
+        """Set-Cookie 中的会话 Cookie（name=value）"""
+        for name, value in self.headers:
+            if name.lower() == b'set-cookie':
+                cookie = SimpleCookie(value.decode('latin-1'))
+                morsel = cookie.get(app_module.app.config['SESSION_COOKIE_NAME'])
+                if morsel is not None:
+                    return f'{morsel.key}={morsel.value}'.encode('latin-1')
+        return None
+
+
+async def call(method: str, path: str, body=None, cookie: bytes = None, query: str = '') -> Response:
+    """直接以 ASGI 协议调用应用（不依赖 HTTP 客户端库）"""
+    messages = [{'type': 'http.request', 'body': b'' if body is None else json.dumps(body).encode(), 'more_body': False}]
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    headers = [(b'host', b'testserver'), (b'content-type', b'application/json')]
+    if cookie:
+        headers.append((b'cookie', cookie))
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+        'method': method, 'path': path, 'raw_path': path.encode(), 'root_path': '',
+        'query_string': query.encode(), 'headers': headers,
+        'client': ('127.0.0.1', 50000), 'server': ('testserver', 80)
+    }
+    await asgi.app(scope, receive, send)
+
+    start = next(message for message in sent if message['type'] == 'http.response.start')
+    payload = b''.join(message.get('body', b'') for message in sent if message['type'] == 'http.response.body')
+    return Response(start['status'], start.get('headers', []), payload)
+
+
+def run(scenario):
+    """在一个事件循环中执行一组请求，结束时关闭应用的 aiohttp 会话"""
+    async def main():
+        try:
+            return await scenario()
+        finally:
+            if asgi.app.http_session is not None:
+                await asgi.app.http_session.close()
+                asgi.app.http_session = None
+    return asyncio.run(main())
+
+
+def asgi_cookie(session_id: str) -> bytes:
+    cookie = SimpleCookie(asgi.session_cookie({'session_id': session_id}).decode('latin-1'))
+    morsel = cookie[app_module.app.config['SESSION_COOKIE_NAME']]
+    return f'{morsel.key}={morsel.value}'.encode('latin-1')
+
+
+@pytest.fixture
+def offline_llm(monkeypatch):
+    """上游不可用且本轮预算不足以调用大模型：两个入口都确定地走本地路径"""
+    def unavailable(*args, **kwargs):
+        raise openai.error.APIConnectionError('测试中不访问上游')
+
+    async def unavailable_async(*args, **kwargs):
+        unavailable()
+
+    monkeypatch.setattr(openai.ChatCompletion, 'create', unavailable)
+    monkeypatch.setattr(openai.ChatCompletion, 'acreate', unavailable_async)
+    monkeypatch.setattr(config.Config, 'CHAT_TURN_BUDGET', 0.6)
+    monkeypatch.setattr(config.Config, 'CHAT_BUDGET_RESERVE', 0.5)
+
+
+@pytest.fixture
+def flask_client():
+    app_module.app.config['TESTING'] = True
+    with app_module.app.test_client() as client:
+        yield client
+
+
+def flask_session(client, session_id: str):
+    with client.session_transaction() as session:
+        session['session_id'] = session_id
+
+
+def without_cursor_handle(payload):
+    """游标含会话结果的随机句柄，比较时只保留起始序号"""
+    cursor = payload['response'].get('next_cursor')
+    if cursor:
+        payload['response']['next_cursor'] = cursor.split('.')[-1]
+    return payload
+
+
+def test_chat_and_current_results_match_flask(flask_client, offline_llm):
+    flask_session(flask_client, 'flask-parity')
+    message = {'message': '三一挖掘机电路图'}
+    flask_chat = flask_client.post('/api/chat', json=message).get_json()
+    flask_pages = [flask_client.post('/api/show_current_results', json={'limit': 5}).get_json()]
+    flask_pages.append(flask_client.post('/api/show_current_results', json={
+        'limit': 5, 'cursor': flask_pages[0]['response']['next_cursor']}).get_json())
+
+    async def scenario():
+        cookie = asgi_cookie('asgi-parity')
+        chat = await call('POST', '/api/chat', message, cookie)
+        first = await call('POST', '/api/show_current_results', {'limit': 5}, cookie)
+        second = await call('POST', '/api/show_current_results', {
+            'limit': 5, 'cursor': first.json()['response']['next_cursor']}, cookie)
+        return chat, [first, second]
+
+    chat, pages = run(scenario)
+
+    assert chat.status == 200
+    assert flask_chat['success'] and flask_chat['response']['degraded_stages'] == ['intent', 'keywords']
+    assert chat.json() == flask_chat
+    assert [page.status for page in pages] == [200, 200]
+    assert [without_cursor_handle(page.json()) for page in pages] == [without_cursor_handle(page) for page in flask_pages]
+
+
+def test_chat_rejects_empty_message_like_flask(flask_client):
+    expected = flask_client.post('/api/chat', json={'message': '  '})
+    response = run(lambda: call('POST', '/api/chat', {'message': '  '}))
+
+    assert response.status == expected.status_code == 400
+    assert response.json() == expected.get_json()
+
+
+def test_current_results_without_session_like_flask(flask_client):
+    expected = flask_client.post('/api/show_current_results', json={})
+    response = run(lambda: call('POST', '/api/show_current_results', {}))
+
+    assert response.status == expected.status_code == 400
+    assert response.json() == expected.get_json()
+
+
+def test_reset_issues_new_session_like_flask(flask_client):
+    flask_session(flask_client, 'flask-reset')
+    expected = flask_client.post('/api/reset')
+    with flask_client.session_transaction() as session:
+        assert session['session_id'] != 'flask-reset'
+
+    response = run(lambda: call('POST', '/api/reset', cookie=asgi_cookie('asgi-reset')))
+
+    assert response.status == expected.status_code == 200
+    assert response.json() == expected.get_json()
+    # 新的会话 Cookie 与 Flask 的签名方式相同，Flask 也能读取
+    flask_client.set_cookie(app_module.app.config['SESSION_COOKIE_NAME'],
+                            response.session_cookie().decode('latin-1').split('=', 1)[1])
+    with flask_client.session_transaction() as session:
+        assert session['session_id'] not in ('asgi-reset', 'flask-reset')
+
+
+def test_status_and_suggest_match_flask(flask_client):
+    async def scenario():
+        return (await call('GET', '/api/status'),
+                await call('GET', '/api/suggest', query='q=%E4%B8%89%E4%B8%80&limit=3'))
+
+    status, suggest = run(scenario)
+    expected_status = flask_client.get('/api/status').get_json()
+    expected_suggest = flask_client.get('/api/suggest?q=三一&limit=3').get_json()
+
+    assert status.status == suggest.status == 200
+    # 内存占用随时变化，不参与比较
+    payload = status.json()
+    payload.pop('memory')
+    expected_status.pop('memory')
+    assert payload == expected_status
+    assert suggest.json() == expected_suggest and expected_suggest['suggestions']
+
+
+def test_other_routes_fall_back_to_flask(flask_client):
+    async def scenario():
+        return await call('GET', '/check_auth'), await call('GET', '/api/no-such-route')
+
+    check_auth, missing = run(scenario)
+
+    assert check_auth.status == 200
+    assert check_auth.json() == flask_client.get('/check_auth').get_json() == {'authenticated': False}
+    assert missing.status == flask_client.get('/api/no-such-route').status_code == 404
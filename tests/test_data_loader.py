@@ -0,0 +1,78 @@
+import warnings
+
+import pytest
+
+import config
+from utils.data_loader import DataLoader
+
+
+@pytest.fixture(scope='module')
+def loader():
+    return DataLoader(config.Config.DATA_FILE, store='dataframe')
+
+
+def test_partial_keyword_filter_on_result_slice(loader):
+    # 结果集的行索引不从 0 开始，掩码必须与之对齐，否则 pandas 按位置重排掩码，选中的行会错
+    frame = loader.data.iloc[100:600]
+    selection = '三一挖掘机 仪表'
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        filtered = loader.filter_by_selection(frame, selection, '关联文件名称', '包含')
+
+    names = frame['关联文件名称']
+    expected = frame[names.str.contains('三一挖掘机', na=False) | names.str.contains('仪表', na=False)]
+    assert not expected.empty
+    assert filtered.index.tolist() == expected.index.tolist()
+
+
+def test_tech_keyword_filter_on_result_slice(loader):
+    frame = loader.data.iloc[100:600]
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        filtered = loader.filter_by_selection(frame, '看看针脚', '关联文件名称', '包含')
+
+    expected = frame[frame['关联文件名称'].str.contains('针脚', na=False)]
+    assert not expected.empty
+    assert filtered.index.tolist() == expected.index.tolist()
+
+
+EDGE_CSV = '''ID,层级路径,关联文件名称
+1,电路图->整车电路图->东风,东风天龙_仪表
+2,电路图->整车电路图->解放,NA
+
+3,电路图->整车电路图->解放,null
+4,电路图->整车电路图->重汽,"   "
+5,,重汽_发动机
+6,电路图->整车电路图->重汽, 重汽_仪表 
+7,电路图->整车电路图->陕汽
+8,电路图->整车电路图->陕汽,陕汽_None
+'''
+
+
+def assert_same_catalog(data_path):
+    frame_loader = DataLoader(data_path, store='dataframe')
+    compact_loader = DataLoader(data_path, store='compact')
+    expected = frame_loader.data
+    actual = compact_loader.frame()
+
+    assert actual.index.tolist() == expected.index.tolist()
+    for field in ('ID', '层级路径', '关联文件名称'):
+        assert actual[field].tolist() == expected[field].tolist()
+    return frame_loader, compact_loader
+
+
+def test_compact_store_matches_dataframe_rows(tmp_path):
+    data_path = tmp_path / 'catalog.csv'
+    data_path.write_text(EDGE_CSV, encoding='utf-8')
+
+    _, compact_loader = assert_same_catalog(str(data_path))
+    # NA / null / 空串 / 缺字段的行被跳过，只含空白的格保留；空行不占行号
+    assert compact_loader.frame()['ID'].tolist() == ['1', '4', '6', '8']
+
+
+def test_compact_store_matches_dataframe_on_catalog():
+    frame_loader, compact_loader = assert_same_catalog(config.Config.DATA_FILE)
+    for field in ('层级路径', '关联文件名称'):
+        for keyword in ('三一', '仪表', 'ecu'):
+            expected = frame_loader.data[field].str.contains(keyword, case=False, na=False).to_numpy()
+            assert (compact_loader.catalog.contains(field, keyword) == expected).all()
@@ -0,0 +1,127 @@
+import asyncio
+import time
+
+import openai
+import pytest
+
+import config
+from utils.data_loader import DataLoader
+from utils.deadline import DeadlineExceeded, current_deadline, deadline_scope, llm_timeout, mark_degraded
+from utils.dialogue_manager import DialogueManager
+from utils.llm_client import DeepSeekClient
+from utils.metrics import LLM_REQUESTS
+from utils.retrieval import CircuitRetriever
+
+
+def test_deadline_scope_sets_and_restores_current_deadline():
+    assert current_deadline() is None
+    with deadline_scope(3.0) as outer:
+        assert current_deadline() is outer
+        with deadline_scope(None) as inner:
+            # 不限时的内层作用域覆盖外层预算
+            assert inner is None and current_deadline() is None
+        assert current_deadline() is outer
+    assert current_deadline() is None
+
+
+def test_llm_timeout_is_capped_by_remaining_budget(monkeypatch):
+    monkeypatch.setattr(config.Config, 'CHAT_BUDGET_RESERVE', 0.5)
+    assert llm_timeout(60) == 60
+
+    with deadline_scope(3.0):
+        assert 2.0 < llm_timeout(60) <= 2.5
+        assert llm_timeout(1.0) == 1.0
+
+
+def test_llm_timeout_raises_when_budget_is_spent(monkeypatch):
+    monkeypatch.setattr(config.Config, 'CHAT_BUDGET_RESERVE', 0.5)
+    with deadline_scope(0.7):
+        # 扣除预留后不足最短调用时长，不再发起调用
+        with pytest.raises(DeadlineExceeded):
+            llm_timeout(60)
+
+
+def test_mark_degraded_records_each_stage_once():
+    mark_degraded('keywords')  # 没有预算时忽略
+
+    with deadline_scope(3.0) as deadline:
+        mark_degraded('keywords')
+        mark_degraded('intent')
+        mark_degraded('keywords')
+    assert deadline.degraded == ['keywords', 'intent']
+
+
+def test_deadline_is_inherited_by_worker_threads():
+    async def main():
+        with deadline_scope(3.0) as deadline:
+            await asyncio.to_thread(mark_degraded, 'keywords')
+        return deadline
+
+    assert asyncio.run(main()).degraded == ['keywords']
+
+
+@pytest.fixture
+def stalled_upstream(monkeypatch):
+    """上游停滞：每次请求都在调用方给定的超时后报 Timeout"""
+    calls = []
+
+    def stalled_create(request_timeout=None, **kwargs):
+        calls.append(request_timeout)
+        raise openai.error.Timeout(f'{request_timeout:.2f}s 内无响应')
+
+    monkeypatch.setattr(openai.ChatCompletion, 'create', stalled_create)
+    return calls
+
+
+def request_count(model: str, prompt: str, status: str) -> float:
+    return LLM_REQUESTS._values.get((model, prompt, status), 0)
+
+
+def test_budget_truncated_call_is_counted_as_timeout(stalled_upstream):
+    client = DeepSeekClient()
+    before = {status: request_count(client.chat_model, 'keywords', status) for status in ('timeout', 'error')}
+
+    with deadline_scope(3.0):
+        with pytest.raises(DeadlineExceeded):
+            client.chat_completion('keywords', client.chat_model, [{'role': 'user', 'content': '三一挖掘机'}])
+
+    assert stalled_upstream and stalled_upstream[0] <= 3.0 - config.Config.CHAT_BUDGET_RESERVE
+    assert request_count(client.chat_model, 'keywords', 'timeout') == before['timeout'] + 1
+    assert request_count(client.chat_model, 'keywords', 'error') == before['error']
+
+
+@pytest.fixture(scope='module')
+def catalog_loader():
+    return DataLoader(config.Config.DATA_FILE, store='dataframe')
+
+
+def test_exhausted_budget_falls_back_to_local_stages(catalog_loader, stalled_upstream, monkeypatch):
+    monkeypatch.setattr(config.Config, 'CHAT_BUDGET_RESERVE', 0.5)
+    manager = DialogueManager(catalog_loader, CircuitRetriever(catalog_loader), DeepSeekClient())
+
+    # 预算扣除预留后不足一次调用，大模型一次都不调用
+    start = time.perf_counter()
+    response = manager.handle_message('budget', '三一挖掘机电路图', budget=0.6)
+
+    assert stalled_upstream == []
+    assert time.perf_counter() - start < 5
+    # 意图改用规则匹配，关键词改用目录词表本地提取
+    assert response['degraded_stages'] == ['intent', 'keywords']
+    session = manager.get_session('budget')
+    assert session.current_results is not None and len(session.current_results) > 0
+    # 结果较多时的追问来自本地提取的选项，而不是推理模型
+    assert response['type'] == 'question'
+    assert session.current_question['route']['tier'] in ('local', 'facets')
+
+
+def test_unlimited_turn_reports_no_degraded_stages(catalog_loader, monkeypatch):
+    manager = DialogueManager(catalog_loader, CircuitRetriever(catalog_loader), DeepSeekClient())
+
+    def unavailable(query):
+        raise DeadlineExceeded('预算不足')
+
+    monkeypatch.setattr(manager.llm_client, 'extract_keywords', unavailable)
+    # 不限时的轮次即使走了本地替代也不附带降级阶段
+    assert manager.extract_keywords('三一挖掘机') == catalog_loader.keyword_extractor.extract('三一挖掘机')
+    response = manager.handle_message('unlimited', '/reset')
+    assert response['degraded_stages'] == []
@@ -0,0 +1,200 @@
+import asyncio
+import threading
+
+import pytest
+
+import config
+from utils.data_loader import DataLoader
+from utils.dialogue_manager import DialogueManager, DialogueState
+from utils.result_facets import ResultFacets
+from utils.retrieval import CircuitRetriever
+
+
+def test_session_created_off_the_event_loop_thread():
+    # Python 3.9 的 asyncio.Lock() 在没有事件循环的线程中创建会报错，会话锁必须延迟到事件循环中创建
+    manager = DialogueManager(None, None, None)
+    errors = []
+
+    def create():
+        try:
+            with manager.session_turn('worker'):
+                pass
+        except BaseException as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=create)
+    thread.start()
+    thread.join(2.0)
+    assert errors == []
+    assert manager.get_session('worker').async_lock is None
+
+    async def turn():
+        async with manager.async_session_turn('worker') as session:
+            return session.async_lock.locked()
+
+    assert asyncio.run(turn())
+
+
+@pytest.fixture(scope='module')
+def catalog_manager():
+    data_loader = DataLoader(config.Config.DATA_FILE, store='dataframe')
+    return DialogueManager(data_loader, CircuitRetriever(data_loader), None)
+
+
+def test_guidance_falls_back_to_facet_question(catalog_manager):
+    manager = catalog_manager
+    session = DialogueState('facets')
+    results = manager.retriever.search(['三一', '挖掘机'])
+    assert len(results) > config.Config.MAX_RESULTS_DISPLAY
+    question_data = {'options': ['不会命中的选项'], 'filter_field': '层级路径', 'filter_logic': '包含',
+                     'route': {'tier': 'chat'}}
+
+    response = manager._guidance_response(session, results, question_data)
+
+    assert response['type'] == 'question'
+    assert session.current_question['route']['tier'] == 'facets'
+    options = [option for option in response['options'] if not option.startswith('其他')]
+    assert len(options) >= 2
+    for option in options:
+        matched = manager._option_matches(results, option, session.current_question)
+        assert 0 < len(matched) < len(results)
+    assert session.conversation_history[-1]['content'] == response['content']
+
+
+def test_option_masks_match_selection_filter(catalog_manager, monkeypatch):
+    manager = catalog_manager
+    results = manager.retriever.search(['三一', '挖掘机'])
+    facets = ResultFacets(manager.retriever.result_view(results))
+    candidates = [value for counter in facets.path_levels for value, _ in counter.most_common(6)]
+    candidates += [token for token, _ in facets.filename_tokens.most_common(6)]
+    # 含括号（会被清理）、正则字符和匹配不到的选项退回实际筛选
+    candidates += ['仪表（文件名称通常含仪表）', 'SY.*', '不会命中的选项']
+
+    for field in ('层级路径', '关联文件名称'):
+        question = {'filter_field': field, 'filter_logic': '包含'}
+        for option in candidates:
+            expected = manager._option_matches(results, option, question)
+            options, counts, covered = manager._narrowing_options(results, [option], question)
+            if 0 < len(expected) < len(results):
+                assert options == [option] and counts == [len(expected)] and covered == len(expected)
+            else:
+                assert options == []
+
+    # 命中同一组结果的选项只保留第一个；整个过程不再逐个选项调用 pandas 筛选
+    question = {'filter_field': '层级路径', 'filter_logic': '包含'}
+    value = facets.path_levels[0].most_common(1)[0][0]
+    monkeypatch.setattr(manager.data_loader, 'filter_by_selection', None)
+    options, counts, _ = manager._narrowing_options(results, [value, value.upper()], question)
+    assert options == [value]
+
+
+def test_guidance_without_split_points_to_results_view(catalog_manager):
+    manager = catalog_manager
+    session = DialogueState('no_split')
+    results = manager.retriever.search(['三一', '挖掘机']).head(1)
+
+    response = manager._guidance_response(session, results, {'options': ['不会命中的选项']})
+
+    assert response['type'] == 'message'
+    assert '查看结果' in response['content']
+    assert 'next_cursor' not in response
+    assert session.current_results is not None and len(session.current_results) == 1
+    assert session.conversation_history[-1]['content'] == response['content']
+
+
+def contains_filter(results, keywords):
+    """原来的线索筛选：逐个关键词在两个字段中按 str.contains（正则、不区分大小写）取交集"""
+    for keyword in keywords:
+        mask = (results['关联文件名称'].str.contains(keyword, case=False, na=False)
+                | results['层级路径'].str.contains(keyword, case=False, na=False))
+        results = results[mask]
+    return results
+
+
+def clue_session(manager, keywords):
+    session = DialogueState('clues')
+    session.all_search_results = manager.retriever.search(keywords)
+    session.current_results = session.all_search_results
+    return session
+
+
+def apply_clue(manager, session, *keywords):
+    session.save_state()
+    manager._apply_clues(session, ' '.join(keywords), {'additional_info': {'clue_keywords': list(keywords)}})
+
+
+@pytest.mark.parametrize('clues', [
+    ['挖掘机'],
+    ['sy', '针脚'],
+    ['SY1[35]5'],
+    ['直喷|国三', 'C9'],
+    ['SY.*C9', '仪表'],
+])
+def test_clue_bitmaps_match_contains_filter(catalog_manager, clues):
+    manager = catalog_manager
+    session = clue_session(manager, ['三一'])
+    for clue in clues:
+        apply_clue(manager, session, clue)
+
+    expected = contains_filter(session.all_search_results, clues)
+    assert not expected.empty
+    assert session.current_results.index.tolist() == expected.index.tolist()
+
+
+def test_clue_cache_is_reused_after_back(catalog_manager, monkeypatch):
+    manager = catalog_manager
+    session = clue_session(manager, ['三一'])
+    apply_clue(manager, session, '挖掘机')
+    apply_clue(manager, session, '针脚')
+    assert manager._restore_previous_step(session) is None
+    assert session.clue_keywords == ['挖掘机']
+
+    computed = []
+    match_any = manager.data_loader.index.match_any
+    monkeypatch.setattr(manager.data_loader.index, 'match_any',
+                        lambda keyword, *args: computed.append(keyword) or match_any(keyword, *args))
+    apply_clue(manager, session, '仪表')
+
+    # 回退后保留的前缀位图直接复用，只为新线索计算一次
+    assert computed == ['仪表']
+    expected = contains_filter(session.all_search_results, ['挖掘机', '仪表'])
+    assert session.current_results.index.tolist() == expected.index.tolist()
+
+
+def test_result_pages_concatenate_to_the_full_list(catalog_manager):
+    manager = catalog_manager
+    session = DialogueState('pages')
+    session.current_query = '三一'
+    session.current_results = manager.retriever.search(['三一'])
+    total = len(session.current_results)
+    assert total > 20
+
+    pages = [manager.current_results_message(session, None, 7)]
+    while pages[-1].get('next_cursor'):
+        pages.append(manager.current_results_message(session, pages[-1]['next_cursor'], 7))
+
+    assert len(pages) == -(-total // 7)
+    assert pages[0]['content'].startswith(f'📊 **当前搜索结果（共 {total} 条）**')
+    assert not any('当前搜索结果' in page['content'] for page in pages[1:])
+    assert '🔍 **搜索关键词**：三一' in pages[-1]['content']
+    content = ''.join(page['content'] for page in pages)
+    for n, row_id in enumerate(session.current_results['ID'], 1):
+        assert f'**{n}.** `{row_id}`' in content
+
+
+def test_stale_and_malformed_cursors(catalog_manager):
+    manager = catalog_manager
+    session = DialogueState('stale')
+    session.current_results = manager.retriever.search(['三一'])
+    cursor = manager.current_results_message(session, None, 5)['next_cursor']
+    handle = cursor.split('.')[0]
+
+    assert manager.current_results_message(session, cursor, 5).get('stale') is None
+    for bad in (f'{handle}.abc', f'{handle}.{len(session.current_results)}', 'garbage'):
+        assert manager.current_results_message(session, bad, 5)['stale'] is True
+
+    # 结果被替换后旧游标失效
+    session.current_results = session.current_results.head(12)
+    response = manager.current_results_message(session, cursor, 5)
+    assert response['stale'] is True
+    assert 'next_cursor' not in response
@@ -0,0 +1,43 @@
+import pytest
+
+import config
+from utils.data_loader import DataLoader
+from utils.fts_backend import SqliteFtsBackend
+from utils.retrieval import CircuitRetriever
+
+KEYWORDS = [['三一', '挖掘机', '仪表'], ['ECU', '针脚定义'], ['不存在的词', '三一']]
+
+
+@pytest.fixture(scope='module')
+def retrievers(tmp_path_factory):
+    data_loader = DataLoader(config.Config.DATA_FILE, store='dataframe')
+    backend = SqliteFtsBackend(data_loader, str(tmp_path_factory.mktemp('fts') / 'catalog_fts.db'))
+    return CircuitRetriever(data_loader), CircuitRetriever(data_loader, backend)
+
+
+@pytest.mark.parametrize('keywords', KEYWORDS)
+def test_explain_matches_plain_search_and_pandas_stats(retrievers, keywords):
+    pandas_retriever, sqlite_retriever = retrievers
+    plain = sqlite_retriever.search(keywords)
+    explained, info = sqlite_retriever.search(keywords, explain=True)
+    _, pandas_info = pandas_retriever.search(keywords, explain=True)
+
+    assert explained.index.tolist() == plain.index.tolist()
+    assert info['union_size'] == len(plain)
+    for field in ('层级路径', '关联文件名称'):
+        for key in ('keyword_hits', 'dropped_keywords', 'pairs', 'union_size'):
+            assert info['fields'][field][key] == pandas_info['fields'][field][key]
+
+
+def test_explain_scans_each_keyword_once(retrievers):
+    _, sqlite_retriever = retrievers
+    connection = sqlite_retriever.backend.connection
+    statements = []
+    connection.set_trace_callback(statements.append)
+    try:
+        sqlite_retriever.search(['三一', '挖掘机', '仪表'], explain=True)
+    finally:
+        connection.set_trace_callback(None)
+
+    # 只有一条语句执行关键词匹配，之后只按主键取回结果行
+    assert sum('LIKE' in statement for statement in statements) == 1
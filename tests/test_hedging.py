@@ -0,0 +1,162 @@
+import asyncio
+import threading
+
+import pytest
+
+import config
+from utils.hedging import HedgeBudget, Hedger
+
+
+@pytest.fixture
+def hedger(monkeypatch):
+    # 一个样本即可给出阈值，每次调用都积累足够的预算
+    monkeypatch.setattr(config.Config, 'LLM_HEDGE_ENABLED', True)
+    monkeypatch.setattr(config.Config, 'LLM_HEDGE_PROMPTS', ['intent'])
+    monkeypatch.setattr(config.Config, 'LLM_HEDGE_MIN_DELAY', 0.01)
+    monkeypatch.setattr(config.Config, 'LLM_HEDGE_MIN_SAMPLES', 1)
+    monkeypatch.setattr(config.Config, 'LLM_HEDGE_RATE', 1.0)
+    hedger = Hedger()
+    hedger.observe('intent', 0.01)
+    return hedger
+
+
+class Attempts:
+    """第一次请求阻塞到 release，之后的请求立即返回"""
+
+    def __init__(self, first_error=None, later_error=None):
+        self.release = threading.Event()
+        self.timeouts = []
+        self.first_error = first_error
+        self.later_error = later_error
+        self._lock = threading.Lock()
+
+    def __call__(self, timeout):
+        with self._lock:
+            index = len(self.timeouts)
+            self.timeouts.append(timeout)
+        if index == 0:
+            self.release.wait(2.0)
+            if self.first_error is not None:
+                raise self.first_error
+            return 'primary'
+        if self.later_error is not None:
+            raise self.later_error
+        return 'hedge'
+
+
+def test_budget_caps_hedges():
+    budget = HedgeBudget(rate=0.5, burst=1.0)
+    budget.earn()
+    assert not budget.try_spend()
+    budget.earn()
+    budget.earn()
+    assert budget.tokens == 1.0
+    assert budget.try_spend()
+    assert not budget.try_spend()
+
+
+def test_no_hedge_without_samples_or_for_other_prompts(hedger):
+    assert hedger.delay('keywords', 5.0) is None
+    hedger.tracker = type(hedger.tracker)(window=10, min_samples=5)
+    assert hedger.delay('intent', 5.0) is None
+
+
+def test_no_hedge_when_delay_exceeds_timeout(hedger):
+    assert hedger.delay('intent', 0.005) is None
+
+
+def test_fast_primary_is_not_hedged(hedger):
+    attempts = Attempts()
+    attempts.release.set()
+    assert hedger.call('intent', attempts, 1.0) == 'primary'
+    assert len(attempts.timeouts) == 1
+
+
+def test_hedge_wins_over_slow_primary(hedger):
+    attempts = Attempts()
+    try:
+        assert hedger.call('intent', attempts, 1.0) == 'hedge'
+        # 对冲请求只使用剩余的超时
+        assert len(attempts.timeouts) == 2 and attempts.timeouts[1] < 1.0
+    finally:
+        attempts.release.set()
+
+
+def test_primary_still_wins_when_hedge_fails(hedger):
+    attempts = Attempts(later_error=RuntimeError('对冲失败'))
+    threading.Timer(0.05, attempts.release.set).start()
+    assert hedger.call('intent', attempts, 1.0) == 'primary'
+
+
+def test_primary_error_is_raised_when_both_fail(hedger):
+    primary_error = RuntimeError('原请求失败')
+    attempts = Attempts(first_error=primary_error, later_error=RuntimeError('对冲失败'))
+    threading.Timer(0.05, attempts.release.set).start()
+    with pytest.raises(RuntimeError) as raised:
+        hedger.call('intent', attempts, 1.0)
+    assert raised.value is primary_error
+
+
+def test_no_hedge_when_budget_is_spent(hedger):
+    hedger.budget.tokens = 1.0
+    hedger.budget.rate = 0.0
+    assert hedger.budget.try_spend()
+    attempts = Attempts()
+    threading.Timer(0.05, attempts.release.set).start()
+    assert hedger.call('intent', attempts, 1.0) == 'primary'
+    assert len(attempts.timeouts) == 1
+
+
+def test_async_hedge_wins_and_primary_is_cancelled(hedger):
+    cancelled = []
+    calls = []
+
+    async def attempt(timeout):
+        calls.append(timeout)
+        if len(calls) > 1:
+            return 'hedge'
+        try:
+            await asyncio.sleep(2.0)
+        except asyncio.CancelledError:
+            cancelled.append('primary')
+            raise
+        return 'primary'
+
+    async def main():
+        result = await hedger.call_async('intent', attempt, 1.0)
+        # 让被取消的请求处理 CancelledError
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == 'hedge'
+    assert cancelled == ['primary']
+
+
+def test_async_primary_wins_and_hedge_is_cancelled(hedger):
+    release = None
+    cancelled = []
+    calls = []
+
+    async def attempt(timeout):
+        calls.append(timeout)
+        if len(calls) == 1:
+            await release.wait()
+            return 'primary'
+        try:
+            await asyncio.sleep(2.0)
+        except asyncio.CancelledError:
+            cancelled.append('hedge')
+            raise
+        return 'hedge'
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        asyncio.get_running_loop().call_later(0.05, release.set)
+        result = await hedger.call_async('intent', attempt, 1.0)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == 'primary'
+    assert len(calls) == 2
+    assert cancelled == ['hedge']
@@ -0,0 +1,297 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import config
+from utils.llm_gateway import CircuitBreaker, LLMGateway, LLMUnavailable, ModelLimiter, slow_call_seconds
+
+
+def wait_until(predicate, timeout: float = 2.0):
+    end = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < end, '等待条件超时'
+        time.sleep(0.001)
+
+
+def make_breaker(open_seconds: float = 0.05) -> CircuitBreaker:
+    # 窗口 4 次，至少 2 次调用后错误率达到 50% 即熔断；1 秒以上为慢调用
+    return CircuitBreaker(window=4, min_calls=2, error_rate=0.5,
+                          slow_call_seconds=1.0, slow_call_rate=1.0, open_seconds=open_seconds)
+
+
+def test_limiter_hands_slot_to_waiter():
+    limiter = ModelLimiter(max_in_flight=1, max_queue=1, queue_timeout=2.0)
+    limiter.acquire()
+    acquired = threading.Event()
+    waiter = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+    waiter.start()
+    wait_until(lambda: limiter.queued == 1)
+
+    limiter.release()
+    waiter.join(2.0)
+    assert acquired.is_set()
+    # 名额直接转交，不会被新到的调用者抢走
+    assert limiter.in_flight == 1 and limiter.queued == 0
+    limiter.release()
+    assert limiter.in_flight == 0
+
+
+def test_limiter_rejects_when_queue_full():
+    limiter = ModelLimiter(max_in_flight=1, max_queue=1, queue_timeout=2.0)
+    limiter.acquire()
+    waiter = threading.Thread(target=limiter.acquire)
+    waiter.start()
+    wait_until(lambda: limiter.queued == 1)
+
+    with pytest.raises(LLMUnavailable):
+        limiter.acquire()
+    limiter.release()
+    waiter.join(2.0)
+    limiter.release()
+    assert limiter.in_flight == 0
+
+
+def test_limiter_queue_timeout_leaves_queue():
+    limiter = ModelLimiter(max_in_flight=1, max_queue=4, queue_timeout=0.02)
+    limiter.acquire()
+    with pytest.raises(LLMUnavailable):
+        limiter.acquire()
+    assert limiter.queued == 0
+    limiter.release()
+    assert limiter.in_flight == 0
+
+
+def test_async_waiter_gets_slot_released_by_thread():
+    limiter = ModelLimiter(max_in_flight=1, max_queue=1, queue_timeout=2.0)
+    limiter.acquire()
+
+    async def main():
+        waiting = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0)
+        assert limiter.queued == 1
+        threading.Thread(target=limiter.release).start()
+        await asyncio.wait_for(waiting, 2.0)
+
+    asyncio.run(main())
+    assert limiter.in_flight == 1 and limiter.queued == 0
+
+
+def test_cancelled_async_waiter_returns_slot():
+    limiter = ModelLimiter(max_in_flight=1, max_queue=1, queue_timeout=2.0)
+    limiter.acquire()
+
+    async def main():
+        waiting = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+    asyncio.run(main())
+    assert limiter.queued == 0
+    limiter.release()
+    assert limiter.in_flight == 0
+
+
+def test_breaker_opens_on_error_rate():
+    breaker = make_breaker()
+    breaker.record(True, 0.01)
+    breaker.record(False, 0.01)
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+
+def test_breaker_opens_on_slow_calls():
+    breaker = make_breaker()
+    breaker.record(True, 1.5)
+    breaker.record(True, 1.5)
+    assert breaker.state == 'open'
+
+
+def test_breaker_half_open_allows_one_probe_and_closes_on_success():
+    breaker = make_breaker(open_seconds=0.02)
+    breaker.record(False, 0.01)
+    breaker.record(False, 0.01)
+    time.sleep(0.03)
+
+    assert breaker.allow()
+    assert breaker.state == 'half_open'
+    assert not breaker.allow()
+    breaker.record(True, 0.01)
+    assert breaker.state == 'closed'
+    assert breaker.snapshot()['recent_calls'] == 0
+    assert breaker.allow()
+
+
+def test_breaker_half_open_reopens_on_failure_or_slow_probe():
+    breaker = make_breaker(open_seconds=0.02)
+    breaker.record(False, 0.01)
+    breaker.record(False, 0.01)
+    for success, latency in ((False, 0.01), (True, 1.5)):
+        time.sleep(0.03)
+        assert breaker.allow()
+        breaker.record(success, latency)
+        assert breaker.state == 'open'
+        assert not breaker.allow()
+
+
+def test_breaker_released_probe_can_be_retried():
+    breaker = make_breaker(open_seconds=0.02)
+    breaker.record(False, 0.01)
+    breaker.record(False, 0.01)
+    time.sleep(0.03)
+    assert breaker.allow()
+    breaker.release_probe()
+    assert breaker.allow()
+
+
+def test_slow_call_threshold_fits_turn_budget(monkeypatch):
+    monkeypatch.setattr(config.Config, 'CHAT_TURN_BUDGET', 3.0)
+    monkeypatch.setattr(config.Config, 'CHAT_BUDGET_RESERVE', 0.5)
+    monkeypatch.setattr(config.Config, 'LLM_SLOW_CALL_BUDGET_SHARE', 0.8)
+    # 单轮最多等 2.5s，配置的 10s / 45s 永远达不到，按可用时长的 80% 截断
+    assert slow_call_seconds() == pytest.approx(2.0)
+    assert slow_call_seconds(reasoner=True) == pytest.approx(2.0)
+
+    monkeypatch.setattr(config.Config, 'LLM_SLOW_CALL_SECONDS', 1.0)
+    assert slow_call_seconds() == 1.0
+
+    monkeypatch.setattr(config.Config, 'CHAT_TURN_BUDGET', 0)
+    assert slow_call_seconds(reasoner=True) == config.Config.LLM_REASONER_SLOW_CALL_SECONDS
+
+
+def test_turn_budget_without_room_for_llm_is_rejected(monkeypatch):
+    monkeypatch.setattr(config.Config, 'CHAT_TURN_BUDGET', 0.6)
+    monkeypatch.setattr(config.Config, 'CHAT_BUDGET_RESERVE', 0.5)
+    with pytest.raises(ValueError):
+        LLMGateway(['model'])
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    monkeypatch.setattr(config.Config, 'LLM_MAX_IN_FLIGHT', 1)
+    monkeypatch.setattr(config.Config, 'LLM_MAX_QUEUE', 1)
+    monkeypatch.setattr(config.Config, 'LLM_QUEUE_TIMEOUT', 2.0)
+    monkeypatch.setattr(config.Config, 'LLM_BREAKER_MIN_CALLS', 2)
+    monkeypatch.setattr(config.Config, 'LLM_BREAKER_OPEN_SECONDS', 0.02)
+    return LLMGateway(['model'])
+
+
+def test_gateway_slot_opens_breaker_after_errors(gateway):
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            with gateway.slot('model'):
+                raise RuntimeError('上游错误')
+
+    with pytest.raises(LLMUnavailable):
+        with gateway.slot('model'):
+            pass
+    status = gateway.status()['model']
+    assert status['state'] == 'open' and status['in_flight'] == 0
+
+
+def test_gateway_slot_ignores_abandoned_calls(gateway):
+    """块内因调用方自身预算放弃（LLMUnavailable）的调用不计入熔断统计"""
+    for _ in range(3):
+        with pytest.raises(LLMUnavailable):
+            with gateway.slot('model'):
+                raise LLMUnavailable('预算不足')
+    status = gateway.status()['model']
+    assert status['state'] == 'closed' and status['recent_calls'] == 0
+
+
+def test_gateway_half_open_probe_closes_breaker(gateway):
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            with gateway.slot('model'):
+                raise RuntimeError('上游错误')
+    time.sleep(0.03)
+
+    async def probe():
+        async with gateway.slot_async('model'):
+            pass
+
+    asyncio.run(probe())
+    assert gateway.status()['model']['state'] == 'closed'
+
+
+def test_gateway_cancelled_async_probe_releases_probe(gateway):
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            with gateway.slot('model'):
+                raise RuntimeError('上游错误')
+    time.sleep(0.03)
+
+    async def main():
+        async def probe():
+            async with gateway.slot_async('model'):
+                await asyncio.sleep(10)
+
+        task = asyncio.ensure_future(probe())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    # 被取消的探测不计入统计，下一个调用仍可作为探测发出
+    status = gateway.status()['model']
+    assert status['state'] == 'half_open' and status['in_flight'] == 0
+    with gateway.slot('model'):
+        pass
+    assert gateway.status()['model']['state'] == 'closed'
+
+
+@pytest.fixture
+def stalled_client(gateway, monkeypatch):
+    """上游停滞：每次请求都在调用方给定的超时后报 Timeout"""
+    import openai
+    from utils.llm_client import DeepSeekClient
+
+    def stalled_create(request_timeout=None, **kwargs):
+        raise openai.error.Timeout(f'{request_timeout:.2f}s 内无响应')
+
+    monkeypatch.setattr(openai.ChatCompletion, 'create', stalled_create)
+    return DeepSeekClient()
+
+
+def call_under_budget(client, budget: float = 3.0):
+    from utils.deadline import DeadlineExceeded, deadline_scope
+    with deadline_scope(budget):
+        with pytest.raises(DeadlineExceeded):
+            client.chat_completion('keywords', client.chat_model, [{'role': 'user', 'content': '东风'}])
+
+
+def test_budget_timeouts_open_the_breaker(stalled_client):
+    client = stalled_client
+    for _ in range(2):
+        call_under_budget(client)
+
+    status = client.gateway.status()[client.chat_model]
+    assert status['state'] == 'open' and status['recent_calls'] == 2
+
+
+def test_budget_timeout_on_half_open_probe_reopens(stalled_client):
+    client = stalled_client
+    for _ in range(2):
+        call_under_budget(client)
+    time.sleep(0.03)
+    assert client.gateway.status()[client.chat_model]['state'] == 'open'
+
+    # 冷却后放行的探测调用再次被预算截断，熔断重新打开
+    call_under_budget(client)
+    assert client.gateway.status()[client.chat_model]['state'] == 'open'
+    with pytest.raises(LLMUnavailable):
+        with client.gateway.slot(client.chat_model):
+            pass
+
+
+def test_calls_not_sent_for_lack_of_budget_are_not_recorded(stalled_client):
+    from utils.deadline import DeadlineExceeded, deadline_scope
+    client = stalled_client
+    with deadline_scope(0.1):
+        with pytest.raises(DeadlineExceeded):
+            client.chat_completion('keywords', client.chat_model, [{'role': 'user', 'content': '东风'}])
+    assert client.gateway.status()[client.chat_model]['recent_calls'] == 0
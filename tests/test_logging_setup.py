@@ -0,0 +1,51 @@
+import io
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+
+from utils.logging_setup import JsonFormatter, SnapshotQueueHandler
+
+
+class ThreadRecordingHandler(logging.StreamHandler):
+    """记录实际格式化日志的线程"""
+
+    def __init__(self, stream):
+        super().__init__(stream)
+        self.format_threads = []
+
+    def format(self, record):
+        self.format_threads.append(threading.current_thread())
+        return super().format(record)
+
+
+def test_listener_thread_formats_records():
+    stream = io.StringIO()
+    handler = ThreadRecordingHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    logger = logging.getLogger('test_logging_setup')
+    logger.propagate = False
+    logger.addHandler(SnapshotQueueHandler(log_queue))
+    listener.start()
+    try:
+        args = ['三一']
+        logger.warning('关键词: %s', args)
+        # 入队时已合并参数，之后改动参数对象不影响日志内容
+        args.append('挖掘机')
+        try:
+            raise ValueError('上游错误')
+        except ValueError:
+            logger.exception('调用失败')
+    finally:
+        listener.stop()
+        logger.handlers.clear()
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert lines[0]['message'] == "关键词: ['三一']"
+    # 异常堆栈在写出线程中格式化，JSON 日志中是单独的字段
+    assert lines[1]['message'] == '调用失败'
+    assert 'ValueError: 上游错误' in lines[1]['exc_info']
+    assert handler.format_threads and threading.main_thread() not in handler.format_threads
@@ -0,0 +1,167 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import config
+from utils.deadline import DeadlineExceeded, deadline_scope
+from utils.llm_gateway import LLMUnavailable
+from utils.micro_batch import AsyncMicroBatcher, MicroBatcher
+
+
+@pytest.fixture(autouse=True)
+def batching(monkeypatch):
+    # 窗口足够长，批次只在攒满时发出，测试结果不依赖线程调度
+    monkeypatch.setattr(config.Config, 'LLM_BATCH_ENABLED', True)
+    monkeypatch.setattr(config.Config, 'LLM_BATCH_WINDOW', 2.0)
+    monkeypatch.setattr(config.Config, 'LLM_BATCH_MAX_ITEMS', 3)
+
+
+class Calls:
+    """记录 single 和 combined 的调用"""
+
+    def __init__(self, combined_error=None, combined_results=None):
+        self.single_items = []
+        self.batches = []
+        self.combined_error = combined_error
+        self.combined_results = combined_results
+        self._lock = threading.Lock()
+
+    def single(self, item):
+        with self._lock:
+            self.single_items.append(item)
+        return f'single:{item}'
+
+    def combined(self, items):
+        with self._lock:
+            self.batches.append(list(items))
+        if self.combined_error is not None:
+            raise self.combined_error
+        if self.combined_results is not None:
+            return self.combined_results
+        return [f'batch:{item}' for item in items]
+
+
+def run_threads(batcher, calls, items, budget=None):
+    """每个条目一个线程调用 batcher.run，返回按条目排列的结果，异常作为结果返回"""
+    outcomes = {}
+
+    def run(item):
+        with deadline_scope(budget):
+            try:
+                outcomes[item] = batcher.run('prompt', item, calls.single, calls.combined)
+            except Exception as e:
+                outcomes[item] = e
+
+    threads = [threading.Thread(target=run, args=(item,)) for item in items]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5.0)
+    return [outcomes[item] for item in items]
+
+
+def test_disabled_batcher_calls_single(monkeypatch):
+    monkeypatch.setattr(config.Config, 'LLM_BATCH_ENABLED', False)
+    calls = Calls()
+    assert MicroBatcher().run('prompt', 'a', calls.single, calls.combined) == 'single:a'
+    assert not calls.batches
+
+
+def test_items_are_batched_and_distributed_in_order():
+    calls = Calls()
+    assert run_threads(MicroBatcher(), calls, ['a', 'b', 'c']) == ['batch:a', 'batch:b', 'batch:c']
+    assert len(calls.batches) == 1 and sorted(calls.batches[0]) == ['a', 'b', 'c']
+    assert not calls.single_items
+
+
+def test_lone_item_after_window_is_sent_alone(monkeypatch):
+    monkeypatch.setattr(config.Config, 'LLM_BATCH_WINDOW', 0.01)
+    calls = Calls()
+    assert MicroBatcher().run('prompt', 'a', calls.single, calls.combined) == 'single:a'
+    assert not calls.batches
+
+
+@pytest.mark.parametrize('calls', [
+    Calls(combined_error=ValueError('无法解析')),
+    Calls(combined_results=['只有一条'])
+])
+def test_failed_batch_falls_back_to_single_calls(calls):
+    assert run_threads(MicroBatcher(), calls, ['a', 'b', 'c']) == ['single:a', 'single:b', 'single:c']
+    assert sorted(calls.single_items) == ['a', 'b', 'c']
+
+
+def test_gateway_rejection_is_shared():
+    error = LLMUnavailable('已熔断')
+    calls = Calls(combined_error=error)
+    assert run_threads(MicroBatcher(), calls, ['a', 'b', 'c']) == [error, error, error]
+    assert not calls.single_items
+
+
+def test_leader_deadline_is_not_shared():
+    """合并请求因领头者的预算用完而失败时，只有领头者失败，其他调用者各自单独请求"""
+    calls = Calls(combined_error=DeadlineExceeded('领头者预算用完'))
+    outcomes = run_threads(MicroBatcher(), calls, ['a', 'b', 'c'])
+    failed = [item for item, outcome in zip('abc', outcomes) if isinstance(outcome, DeadlineExceeded)]
+    assert len(failed) == 1
+    assert sorted(calls.single_items) == sorted(set('abc') - set(failed))
+
+
+def test_follower_gives_up_when_its_budget_runs_out(monkeypatch):
+    monkeypatch.setattr(config.Config, 'LLM_BATCH_MAX_ITEMS', 2)
+    release = threading.Event()
+    calls = Calls()
+    combined = calls.combined
+
+    def slow_combined(items):
+        release.wait(5.0)
+        return combined(items)
+
+    calls.combined = slow_combined
+    batcher = MicroBatcher()
+    leader = threading.Thread(target=lambda: batcher.run('prompt', 'a', calls.single, calls.combined))
+    leader.start()
+    deadline = time.monotonic() + 2.0
+    while 'prompt' not in batcher._open:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    # 第二个调用者攒满批次，合并请求发出后迟迟不返回，而它的预算只有 50 毫秒
+    outcomes = run_threads(batcher, calls, ['b'], budget=0.05)
+    assert isinstance(outcomes[0], DeadlineExceeded)
+    release.set()
+    leader.join(5.0)
+
+
+def run_async(items, calls):
+    async def single(item):
+        return calls.single(item)
+
+    async def combined(items):
+        await asyncio.sleep(0)
+        return calls.combined(items)
+
+    async def main():
+        batcher = AsyncMicroBatcher()
+        return await asyncio.gather(
+            *(batcher.run('prompt', item, single, combined) for item in items), return_exceptions=True)
+
+    return asyncio.run(main())
+
+
+def test_async_items_are_batched():
+    calls = Calls()
+    assert run_async(['a', 'b', 'c'], calls) == ['batch:a', 'batch:b', 'batch:c']
+    assert calls.batches == [['a', 'b', 'c']]
+
+
+def test_async_failed_batch_falls_back_to_single_calls():
+    calls = Calls(combined_error=ValueError('无法解析'))
+    assert run_async(['a', 'b', 'c'], calls) == ['single:a', 'single:b', 'single:c']
+
+
+def test_async_leader_deadline_is_not_shared():
+    calls = Calls(combined_error=DeadlineExceeded('领头者预算用完'))
+    leader, *followers = run_async(['a', 'b', 'c'], calls)
+    assert isinstance(leader, DeadlineExceeded)
+    assert followers == ['single:b', 'single:c']
@@ -0,0 +1,44 @@
+import config
+from utils.llm_client import DeepSeekClient
+from utils.model_router import ModelRouter
+from utils.result_facets import ResultFacets
+from utils.result_view import ResultView
+
+
+def view(paths):
+    return ResultView(list(range(len(paths))), paths, [f'文件{i}' for i in range(len(paths))])
+
+
+def branch_paths(branches, per_branch=3):
+    return [f'电路图->整车电路图->{branch}->{branch}型号{i}' for branch in branches for i in range(per_branch)]
+
+
+def test_local_question_is_returned_unchanged():
+    # 本地出题的选项是干净切分结果的路径段，不经过大模型选项的清理和截断
+    branches = ['底盘电气', '车身电气', '发动机电气', '仪表系统', '空调系统']
+    client = DeepSeekClient()
+    question = client.design_question_from_results('查询', view(branch_paths(branches)))
+
+    assert question['route']['tier'] == 'local'
+    assert sorted(question['options']) == sorted(branches)
+    assert '已优化选项' not in question['analysis']
+
+
+def test_local_cap_matches_guidance_option_limit():
+    router = ModelRouter()
+    assert router.local_max_options == config.Config.MAX_OPTIONS_DISPLAY - 1
+
+    too_many = [f'分组{chr(ord("甲") + i)}系统' for i in range(config.Config.MAX_OPTIONS_DISPLAY)]
+    assert router.route(ResultFacets(view(branch_paths(too_many)))).tier != 'local'
+
+
+def test_values_rewritten_by_selection_cleanup_are_not_local():
+    # “相关”会在筛选前被清理掉，选择后的筛选不再只命中自己一组
+    branches = ['相关线路', '主线路']
+    assert ModelRouter().route(ResultFacets(view(branch_paths(branches)))).tier != 'local'
+
+
+def test_case_variants_are_not_a_clean_split():
+    # 筛选不区分大小写，EDC17 与 edc17 会互相串组
+    branches = ['EDC17', 'edc17', 'ME7']
+    assert ModelRouter().route(ResultFacets(view(branch_paths(branches)))).tier != 'local'
@@ -0,0 +1,72 @@
+from utils.prompt_compactor import PromptCompactor, estimate_tokens
+from utils.result_view import ResultView
+
+
+def view(paths, filenames):
+    return ResultView(list(range(len(paths))), paths, filenames)
+
+
+def test_shared_paths_render_as_tree():
+    results = view(
+        ['三一->挖掘机->SY215C', '三一->挖掘机->SY215C', '三一->挖掘机->SY365H', '三一->起重机'],
+        ['SY215C_仪表电路图【高清】.pdf', 'SY215C_仪表电路图【带针脚】.pdf', '整车电路图.pdf', '起重机_ECU针脚定义.pdf']
+    )
+
+    # 与路径重复的词元和扩展名被省略，主干相同的文件合并为一行并合并标签
+    assert PromptCompactor(1000).compact(results) == '\n'.join([
+        '三一 (4)',
+        '  挖掘机 (3)',
+        '    SY215C (2)',
+        '      · 仪表电路图【高清|带针脚】 ×2',
+        '    SY365H (1)',
+        '      · 整车电路图',
+        '  起重机 (1)',
+        '    · ECU针脚定义',
+    ])
+
+
+def test_single_branch_paths_are_joined():
+    results = view(['东风->天龙->KL->仪表'] * 3, ['仪表电路图.pdf', '仪表针脚定义.pdf', '仪表电路图.pdf'])
+
+    assert PromptCompactor(1000).compact(results) == '\n'.join([
+        '东风->天龙->KL->仪表 (3)',
+        '  · 仪表电路图 ×2',
+        '  · 仪表针脚定义',
+    ])
+
+
+def test_falls_back_to_flat_list_when_tree_is_not_shorter():
+    # 路径没有共享前缀，归并只会多出数量和缩进
+    results = view(['东风->天龙', '解放->J6', '重汽->豪沃'], ['仪表.pdf', 'ECU.pdf', '整车电路图.pdf'])
+
+    assert PromptCompactor(1000).compact(results) == '东风->天龙 · 仪表\n解放->J6 · ECU\n重汽->豪沃 · 整车电路图'
+
+
+def large_results():
+    paths, filenames = [], []
+    for brand in range(12):
+        for series in range(10):
+            for n in range(5):
+                paths.append(f'品牌{brand}->系列{series}->型号{n}')
+                filenames.append(f'型号{n}_整车电路图_{brand}{series}{n}.pdf')
+    return view(paths, filenames)
+
+
+def test_output_stays_within_token_budget():
+    results = large_results()
+    full = PromptCompactor(100000).compact(results)
+
+    for budget in (2000, 400, 120):
+        text = PromptCompactor(budget).compact(results)
+        assert estimate_tokens(text) <= budget
+        assert len(text) < len(full)
+        # 减少列出的内容时注明省略了多少
+        assert '…另有' in text
+    assert text.startswith('品牌0 (50)')
+
+
+def test_overview_is_truncated_when_even_summary_exceeds_budget():
+    text = PromptCompactor(10).compact(large_results())
+
+    assert estimate_tokens(text) <= 10
+    assert text.endswith('…')
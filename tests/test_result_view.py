@@ -0,0 +1,124 @@
+import pandas as pd
+import pytest
+
+import config
+from utils.data_loader import DataLoader
+from utils.dialogue_manager import CURRENT_RESULT_TEMPLATE
+from utils.llm_client import DeepSeekClient
+from utils.result_view import ResultView
+from utils.retrieval import CircuitRetriever
+
+
+# 以下两个函数为改用结果视图之前（b51f0ae）逐行拼接的实现，作为期望输出
+
+def baseline_format_results_for_display(results: pd.DataFrame, max_results: int = None):
+    if results.empty:
+        return []
+    if max_results:
+        results = results.head(max_results)
+    formatted = []
+    for _, row in results.iterrows():
+        formatted.append({
+            'ID': row['ID'],
+            '层级路径': row['层级路径'],
+            '关联文件名称': row['关联文件名称']
+        })
+    return formatted
+
+
+def baseline_format_final_results(results, query):
+    if not results:
+        return "抱歉，没有找到相关的电路图。请尝试更换关键词重新搜索。"
+
+    if len(results) == 1:
+        result = results[0]
+        return (
+            f"✅ **已为您找到精确匹配的电路图**\n\n"
+            f"📄 **文档标题**：{result['关联文件名称']}\n"
+            f"🔢 **文档ID**：{result['ID']}\n"
+            f"📁 **分类**：{result['层级路径']}"
+        )
+    else:
+        formatted = f"✅ **为您找到 {len(results)} 个相关结果**\n\n"
+
+        for i, result in enumerate(results, 1):
+            formatted += f"**结果 {i}：**\n"
+            formatted += f"📄 **文档标题**：{result['关联文件名称']}\n"
+            formatted += f"🔢 **文档ID**：{result['ID']}\n"
+            formatted += f"📁 **分类**：{result['层级路径']}\n"
+
+            if i < len(results):
+                formatted += f"────────────────────\n\n"
+            else:
+                formatted += "\n"
+
+        return formatted
+
+
+def baseline_current_results_lines(formatted_results):
+    message = ''
+    for i, result in enumerate(formatted_results, 1):
+        message += f"**{i}.** `{result['ID']}` - {result['关联文件名称']}\n"
+    return message
+
+
+@pytest.fixture(scope='module', params=['dataframe', 'compact'])
+def retriever(request):
+    return CircuitRetriever(DataLoader(config.Config.DATA_FILE, store=request.param))
+
+
+@pytest.fixture(scope='module')
+def client():
+    return DeepSeekClient()
+
+
+@pytest.fixture(scope='module')
+def results(retriever):
+    results = retriever.search(['三一', '挖掘机'])
+    assert len(results) > 5
+    return results
+
+
+@pytest.mark.parametrize('count', [0, 1, 2, 5])
+def test_final_results_match_baseline(retriever, client, results, count):
+    subset = results.head(count)
+    expected = baseline_format_final_results(baseline_format_results_for_display(subset), '三一挖掘机')
+
+    view = retriever.result_view(subset)
+    assert view.records() == baseline_format_results_for_display(subset)
+    assert client.format_final_results(view, '三一挖掘机') == expected
+    # 也接受记录列表
+    assert client.format_final_results(view.records(), '三一挖掘机') == expected
+
+
+def test_truncated_view_matches_baseline(retriever, client, results):
+    view = retriever.result_view(results, max_results=5)
+    expected = baseline_format_results_for_display(results, 5)
+
+    assert len(view) == 5
+    assert view.records() == expected
+    assert client.format_final_results(view, '三一挖掘机') == baseline_format_final_results(expected, '三一挖掘机')
+
+
+def test_current_results_lines_match_baseline(retriever, results):
+    expected = baseline_current_results_lines(baseline_format_results_for_display(results))
+    assert retriever.result_view(results).render(CURRENT_RESULT_TEMPLATE) == expected
+
+    # 分页渲染的各页依次拼接后与整页相同
+    pages = [
+        retriever.result_view(results.iloc[offset:offset + 4]).render(CURRENT_RESULT_TEMPLATE, start=offset + 1)
+        for offset in range(0, len(results), 4)
+    ]
+    assert ''.join(pages) == expected
+
+
+def test_values_with_braces_are_not_reformatted(client):
+    records = [
+        {'ID': 7, '层级路径': '东风->{型号}', '关联文件名称': '仪表_{n}%s.pdf'},
+        {'ID': 'A-8', '层级路径': '解放->J6', '关联文件名称': 'ECU【{id}】.pdf'},
+    ]
+    view = ResultView.from_records(records)
+
+    assert client.format_final_results(view, '') == baseline_format_final_results(records, '')
+    assert client.format_final_results(view.records()[:1], '') == baseline_format_final_results(records[:1], '')
+    assert view.render(CURRENT_RESULT_TEMPLATE) == baseline_current_results_lines(records)
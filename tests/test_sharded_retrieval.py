@@ -0,0 +1,79 @@
+import os
+
+import pytest
+
+import config
+from utils.data_loader import DataLoader
+from utils.retrieval import CircuitRetriever, PandasSearchBackend
+from utils.sharded_retrieval import ShardedSearchBackend
+
+KEYWORDS = [
+    ['三一', '挖掘机', '仪表'],
+    ['ECU', '针脚定义'],
+    ['不存在的词', '三一'],
+    ['挖掘机'],
+    # 含正则元字符的关键词按正则匹配，与 str.contains 一致
+    ['ECU|ABS', '电路图'],
+    ['三一.*挖掘机', '(仪表)'],
+]
+
+
+@pytest.fixture(scope='module')
+def data_loader():
+    return DataLoader(config.Config.DATA_FILE, store='dataframe')
+
+
+@pytest.fixture(scope='module')
+def retrievers(data_loader):
+    backend = ShardedSearchBackend(data_loader, shards=3)
+    yield CircuitRetriever(data_loader, PandasSearchBackend(data_loader)), CircuitRetriever(data_loader, backend)
+    backend.close()
+
+
+def match_scores(results, keywords):
+    """每行两个字段中字面包含的关键词数之和（CircuitRetriever 的排序分数）"""
+    def count(text):
+        return sum(keyword.lower() in str(text).lower() for keyword in keywords)
+    return [count(path) + count(name) for path, name in zip(results['层级路径'], results['关联文件名称'])]
+
+
+@pytest.mark.parametrize('keywords', KEYWORDS)
+def test_sharded_search_matches_pandas(retrievers, keywords):
+    pandas_retriever, sharded_retriever = retrievers
+    expected = pandas_retriever.search(keywords)
+    results = sharded_retriever.search(keywords)
+
+    assert sorted(results.index) == sorted(expected.index)
+    if results.empty:
+        return
+    # 分数从高到低；pandas 后端的同分行顺序不固定，分片检索按目录顺序
+    scores = match_scores(results, keywords)
+    assert scores == match_scores(expected, keywords)
+    for score in set(scores):
+        rows = [index for index, row_score in zip(results.index, scores) if row_score == score]
+        assert rows == sorted(rows)
+
+
+@pytest.mark.parametrize('keywords', KEYWORDS[:2] + KEYWORDS[4:])
+def test_sharded_explain_matches_pandas_stats(retrievers, keywords):
+    pandas_retriever, sharded_retriever = retrievers
+    _, expected = pandas_retriever.search(keywords, explain=True)
+    _, info = sharded_retriever.search(keywords, explain=True)
+
+    for field in ('层级路径', '关联文件名称'):
+        for key in ('keyword_hits', 'dropped_keywords', 'pairs', 'union_size'):
+            assert info['fields'][field][key] == expected['fields'][field][key]
+
+
+def test_close_removes_shared_files(data_loader):
+    backend = ShardedSearchBackend(data_loader, shards=2)
+    directory = backend.directory
+    assert os.listdir(directory)
+    if os.path.isdir('/dev/shm'):
+        assert directory.startswith('/dev/shm/')
+
+    assert not backend.match(['三一', '挖掘机']).empty
+    backend.close()
+
+    assert not os.path.exists(directory)
+    assert backend._pool is None
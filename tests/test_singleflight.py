@@ -0,0 +1,228 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from utils.deadline import DeadlineExceeded
+from utils.metrics import COALESCED_REQUESTS
+from utils.singleflight import AsyncSingleFlight, SingleFlight
+
+
+def wait_until(predicate, timeout: float = 2.0):
+    end = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < end, '等待条件超时'
+        time.sleep(0.001)
+
+
+def coalesced(scope: str) -> float:
+    return COALESCED_REQUESTS._values.get((scope,), 0)
+
+
+class Outcome:
+    """在线程中执行调用，记录结果或异常"""
+
+    def __init__(self, target):
+        self.result = None
+        self.error = None
+        self.thread = threading.Thread(target=self._run, args=(target,))
+        self.thread.start()
+
+    def _run(self, target):
+        try:
+            self.result = target()
+        except BaseException as e:
+            self.error = e
+
+    def join(self):
+        self.thread.join(2.0)
+        assert not self.thread.is_alive()
+        return self
+
+
+def blocking(release: threading.Event, started: threading.Event, value=None, error=None):
+    """领头者的函数：等待 release 后返回 value 或抛出 error"""
+    def func():
+        started.set()
+        release.wait(2.0)
+        if error is not None:
+            raise error
+        return value
+    return func
+
+
+def start_leader_and_follower(flight, scope, leader_func, follower_func, follower_timeout=None):
+    started = threading.Event()
+    leader = Outcome(lambda: flight.do('key', lambda: leader_func(started)))
+    started.wait(2.0)
+    before = coalesced(scope)
+    follower = Outcome(lambda: flight.do('key', follower_func, follower_timeout))
+    wait_until(lambda: coalesced(scope) > before)
+    return leader, follower
+
+
+def test_follower_shares_leader_result():
+    release = threading.Event()
+    calls = []
+    flight = SingleFlight('test_shared_result')
+
+    def leader_func(started):
+        calls.append('leader')
+        return blocking(release, started, value='ok')()
+
+    leader, follower = start_leader_and_follower(
+        flight, 'test_shared_result', leader_func, lambda: calls.append('follower'))
+    release.set()
+
+    assert leader.join().result == 'ok'
+    assert follower.join().result == 'ok'
+    assert calls == ['leader']
+    assert not flight._calls
+
+
+def test_follower_shares_leader_error():
+    release = threading.Event()
+    flight = SingleFlight('test_shared_error')
+    error = ValueError('上游错误')
+
+    leader, follower = start_leader_and_follower(
+        flight, 'test_shared_error',
+        lambda started: blocking(release, started, error=error)(), lambda: 'unused')
+    release.set()
+
+    assert leader.join().error is error
+    assert follower.join().error is error
+
+
+def test_follower_timeout_does_not_affect_leader():
+    release = threading.Event()
+    flight = SingleFlight('test_follower_timeout')
+
+    leader, follower = start_leader_and_follower(
+        flight, 'test_follower_timeout',
+        lambda started: blocking(release, started, value='ok')(), lambda: 'unused', follower_timeout=0.05)
+
+    assert isinstance(follower.join().error, TimeoutError)
+    release.set()
+    assert leader.join().result == 'ok'
+
+
+def test_leader_deadline_is_not_shared():
+    """领头者自己的预算用完时，跟随者在自己的预算内重新执行"""
+    release = threading.Event()
+    flight = SingleFlight('test_leader_deadline')
+
+    leader, follower = start_leader_and_follower(
+        flight, 'test_leader_deadline',
+        lambda started: blocking(release, started, error=DeadlineExceeded('领头者预算用完'))(),
+        lambda: 'follower', follower_timeout=1.0)
+    release.set()
+
+    assert isinstance(leader.join().error, DeadlineExceeded)
+    assert follower.join().result == 'follower'
+
+
+def test_key_is_removed_after_call():
+    flight = SingleFlight('test_key_removed')
+    assert flight.do('key', lambda: 1) == 1
+    assert flight.do('key', lambda: 2) == 2
+
+
+def run_async_pair(leader_func, follower_func, follower_timeout=None):
+    """领头者开始执行后再发起跟随者，返回 (领头者结果, 跟随者结果)，异常作为结果返回"""
+    async def main():
+        flight = AsyncSingleFlight('test_async')
+        release = asyncio.Event()
+        leader = asyncio.ensure_future(flight.do('key', lambda: leader_func(release)))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do('key', follower_func, follower_timeout))
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(leader, follower, return_exceptions=True)
+    return asyncio.run(main())
+
+
+def test_async_follower_shares_leader_result():
+    calls = []
+
+    async def leader_func(release):
+        calls.append('leader')
+        await release.wait()
+        return 'ok'
+
+    async def follower_func():
+        calls.append('follower')
+
+    assert run_async_pair(leader_func, follower_func) == ['ok', 'ok']
+    assert calls == ['leader']
+
+
+def test_async_follower_shares_leader_error():
+    error = ValueError('上游错误')
+
+    async def leader_func(release):
+        await release.wait()
+        raise error
+
+    leader, follower = run_async_pair(leader_func, None)
+    assert leader is error and follower is error
+
+
+def test_async_leader_deadline_is_not_shared():
+    async def leader_func(release):
+        await release.wait()
+        raise DeadlineExceeded('领头者预算用完')
+
+    async def follower_func():
+        return 'follower'
+
+    leader, follower = run_async_pair(leader_func, follower_func, 1.0)
+    assert isinstance(leader, DeadlineExceeded)
+    assert follower == 'follower'
+
+
+def test_async_follower_timeout_does_not_cancel_leader():
+    async def main():
+        flight = AsyncSingleFlight('test_async_timeout')
+        release = asyncio.Event()
+
+        async def leader_func():
+            await release.wait()
+            return 'ok'
+
+        leader = asyncio.ensure_future(flight.do('key', leader_func))
+        await asyncio.sleep(0)
+        with pytest.raises(TimeoutError):
+            await flight.do('key', leader_func, 0.01)
+        release.set()
+        return await leader
+
+    assert asyncio.run(main()) == 'ok'
+
+
+def test_async_leader_cancel_is_not_shared():
+    async def main():
+        flight = AsyncSingleFlight('test_async_cancel')
+        calls = []
+
+        async def leader_func():
+            calls.append('leader')
+            await asyncio.sleep(10)
+
+        async def follower_func():
+            calls.append('follower')
+            return 'follower'
+
+        leader = asyncio.ensure_future(flight.do('key', leader_func))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do('key', follower_func, 1.0))
+        await asyncio.sleep(0)
+        leader.cancel()
+        results = await asyncio.gather(leader, follower, return_exceptions=True)
+        return results, calls
+
+    (leader, follower), calls = asyncio.run(main())
+    assert isinstance(leader, asyncio.CancelledError)
+    assert follower == 'follower'
+    assert calls == ['leader', 'follower']
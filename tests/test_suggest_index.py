@@ -0,0 +1,65 @@
+from utils.suggest_index import SuggestIndex
+
+PATHS = [
+    '电路图->整车电路图->东风->天龙',
+    '电路图->整车电路图->东风->天龙',
+    '电路图->整车电路图->东风->天锦',
+    '电路图->整车电路图->东风->天锦',
+    '电路图->整车电路图->东风->天锦',
+    '电路图->ECU电路图->博世',
+]
+FILENAMES = [
+    '东风天龙_仪表针脚定义.pdf',
+    '东风天龙_EDC17C81发动机',
+    '东风天锦_仪表总成',
+    '东风天锦_edc17c63发动机',
+    '东风天锦_车身控制',
+    '博世_EDC17C81针脚',
+]
+
+
+def index() -> SuggestIndex:
+    return SuggestIndex(PATHS, FILENAMES)
+
+
+def texts(suggestions):
+    return [suggestion['text'] for suggestion in suggestions]
+
+
+def test_prefix_completions_ordered_by_row_count():
+    suggestions = index().suggest('天', 8)
+    # 天锦 出现在 3 行，天龙 在 2 行
+    assert texts(suggestions)[:2] == ['天锦', '天龙']
+    assert [suggestion['count'] for suggestion in suggestions[:2]] == [3, 2]
+    assert suggestions[0]['kind'] == 'path'
+
+
+def test_codes_complete_case_insensitively():
+    suggestions = index().suggest('edc17', 8)
+    assert sorted(texts(suggestions)) == ['EDC17C81', 'edc17c63']
+    assert all(suggestion['kind'] == 'code' for suggestion in suggestions)
+    assert suggestions[0]['text'] == 'EDC17C81'  # 2 行
+
+
+def test_only_last_word_is_completed():
+    suggestions = index().suggest('东风 天', 8)
+    assert suggestions[0]['query'] == '东风 天锦'
+
+
+def test_falls_back_to_shorter_suffix():
+    # “天龙仪”不是任何词的前缀，依次缩短到“仪”
+    suggestions = index().suggest('天龙仪', 8)
+    assert '仪表总成' in texts(suggestions)
+    assert all(suggestion['query'] == '天龙' + suggestion['text'] for suggestion in suggestions)
+
+
+def test_complete_words_and_stop_words_get_no_suggestions():
+    idx = index()
+    assert idx.suggest('博世', 8) == []
+    assert idx.suggest('东风 ', 8) == []
+    assert idx.suggest('电路图', 8) == []
+    assert '电路图' not in idx
+
+
+def test_limit_is_respected():
+    assert len(index().suggest('东', 1)) == 1
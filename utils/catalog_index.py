@@ -0,0 +1,136 @@
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict, defaultdict
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+if TYPE_CHECKING:
+    # 紧凑目录模块引用本模块的 REGEX_META，运行时不导入以免循环
+    from utils.compact_catalog import CompactCatalog
+
+# 参与检索的字段
+SEARCH_FIELDS = ['层级路径', '关联文件名称']
+
+# 正则元字符：关键词中出现这些字符时退回 pandas 的正则匹配，保持与 str.contains 一致
+REGEX_META = set('.^$*+?{}[]\\|()')
+
+
+class CatalogIndex:
+    """
+    资料清单的内存倒排索引
+    - 每个字段按字符二元组建立倒排表（行位置的有序 int32 数组）
+    - 关键词匹配先用倒排表求候选行，再做子串校验，结果以布尔位图返回
+    - 位图按 (字段, 关键词) 做 LRU 缓存，重复关键词不再扫描
+    传入紧凑目录（CompactCatalog）时不建立倒排表和小写文本副本，位图由紧凑目录的子串匹配计算，
+    行索引取自紧凑目录
+    倒排表建好后只读，可在多线程间共享；缓存的读写由锁保护
+    """
+
+    def __init__(self, data: Optional[pd.DataFrame], fields: List[str] = None, cache_size: int = 1024,
+                 catalog: Optional['CompactCatalog'] = None):
+        self.data = data
+        self.catalog = catalog
+        self.size = len(catalog) if catalog is not None else len(data)
+        self.fields = fields or SEARCH_FIELDS
+        self.cache_size = cache_size
+
+        self._texts: Dict[str, List[str]] = {}
+        self._postings: Dict[str, Dict[str, np.ndarray]] = {}
+        self._mask_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+        if catalog is None:
+            for field in self.fields:
+                self._build_field(field)
+
+    def _build_field(self, field: str):
+        """为单个字段建立二元组倒排表"""
+        texts = [str(value).lower() for value in self.data[field].tolist()]
+        postings = defaultdict(list)
+
+        for position, text in enumerate(texts):
+            for gram in {text[i:i + 2] for i in range(len(text) - 1)}:
+                postings[gram].append(position)
+
+        self._texts[field] = texts
+        self._postings[field] = {
+            gram: np.asarray(positions, dtype=np.int32)
+            for gram, positions in postings.items()
+        }
+
+    def keyword_mask(self, field: str, keyword: str, cache: bool = True) -> np.ndarray:
+        """返回关键词在字段中的匹配位图（长度等于目录行数，只读）；cache 为假时不读写缓存（批量检索自行缓存）"""
+        if not cache:
+            return self._compute_mask(field, keyword)
+        key = (field, keyword.lower())
+        with self._cache_lock:
+            mask = self._mask_cache.get(key)
+            if mask is not None:
+                self._mask_cache.move_to_end(key)
+                return mask
+
+        # 计算在锁外进行，并发未命中时可能重复计算，但结果相同
+        mask = self._compute_mask(field, keyword)
+        mask.flags.writeable = False
+
+        with self._cache_lock:
+            self._mask_cache[key] = mask
+            if len(self._mask_cache) > self.cache_size:
+                self._mask_cache.popitem(last=False)
+
+        return mask
+
+    def match_any(self, keyword: str, fields: List[str] = None) -> np.ndarray:
+        """关键词在任一字段中匹配的位图"""
+        fields = fields or self.fields
+        mask = self.keyword_mask(fields[0], keyword)
+        for field in fields[1:]:
+            mask = mask | self.keyword_mask(field, keyword)
+        return mask
+
+    def positions_of(self, results: pd.DataFrame) -> np.ndarray:
+        """将结果子集（保留原始行索引）映射为目录中的行位置"""
+        if results is None or results.empty:
+            return np.empty(0, dtype=np.int64)
+        labels = self.catalog.label_index if self.catalog is not None else self.data.index
+        return labels.get_indexer(results.index)
+
+    def _compute_mask(self, field: str, keyword: str) -> np.ndarray:
+        """通过倒排表计算匹配位图"""
+        if self.catalog is not None:
+            return self.catalog.contains(field, keyword)
+
+        if any(char in REGEX_META for char in keyword):
+            # 含正则字符的关键词沿用原有的正则匹配语义
+            matched = self.data[field].str.contains(keyword, case=False, na=False)
+            return matched.to_numpy(dtype=bool)
+
+        keyword = keyword.lower()
+        texts = self._texts[field]
+        mask = np.zeros(self.size, dtype=bool)
+
+        if len(keyword) < 2:
+            # 单字关键词无法利用二元组，直接扫描
+            mask[:] = [keyword in text for text in texts]
+            return mask
+
+        postings = self._postings[field]
+        gram_lists = []
+        for gram in {keyword[i:i + 2] for i in range(len(keyword) - 1)}:
+            positions = postings.get(gram)
+            if positions is None:
+                return mask
+            gram_lists.append(positions)
+
+        # 从最短的倒排表开始求交，缩小候选集
+        gram_lists.sort(key=len)
+        candidates = gram_lists[0]
+        for positions in gram_lists[1:]:
+            candidates = np.intersect1d(candidates, positions, assume_unique=True)
+            if candidates.size == 0:
+                return mask
+
+        # 二元组全部命中不代表子串命中，逐行校验
+        matched = [position for position in candidates.tolist() if keyword in texts[position]]
+        mask[matched] = True
+        return mask
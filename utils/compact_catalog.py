@@ -0,0 +1,253 @@
+import csv
+import os
+import re
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils.catalog_index import REGEX_META
+
+# read_csv 默认识别为缺失值的字符串，与 pandas 的默认 na_values 一致；整行读入时据此跳过缺失的行
+_NA_VALUES = frozenset({
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+})
+
+# 文件名字节区中的行分隔符，关键词不会跨行匹配
+_SEPARATOR = b'\n'
+
+
+def find_entries(arena, offsets: np.ndarray, needle: bytes, first: int = 0, last: int = None) -> np.ndarray:
+    """
+    在以换行分隔的字节区（bytes 或 mmap）中查找子串，返回命中的条目序号，只查找第 first 到 last - 1 条；
+    offsets[i] 为第 i 条的起点，最后一个元素为字节区末尾
+    """
+    last = len(offsets) - 1 if last is None else last
+    if first >= last:
+        return np.empty(0, dtype=np.int64)
+    if not needle:
+        return np.arange(first, last)
+    if _SEPARATOR in needle:
+        return np.empty(0, dtype=np.int64)
+
+    start, end = int(offsets[first]), int(offsets[last])
+    hits = []
+    position = arena.find(needle, start, end)
+    while position != -1:
+        hits.append(position)
+        position = arena.find(needle, position + len(needle), end)
+    if not hits:
+        return np.empty(0, dtype=np.int64)
+    # 同一条目中多次命中时去重
+    return np.unique(np.searchsorted(offsets, np.asarray(hits, dtype=np.int64), side='right') - 1)
+
+
+class CompactCatalog:
+    """
+    字典编码的紧凑目录，代替由 Python str 组成的 DataFrame
+    - ID：按原样（字符串，保留前导零等）以换行分隔拼接在一个字节区中，id_offsets 记录每行的起点
+    - 层级路径：路径段驻留为整数字典（segments），每种不同的路径存为一段段号（path_segment_ids 按 path_offsets 切分），
+      每行只存路径号（path_ids，int32），取值时由路径段拼回
+    - 关联文件名称：全部文件名按 UTF-8 编码以换行分隔拼接在一个字节区中，filename_offsets 记录每行的起点
+    - labels：每行在 CSV 中的行号，与 DataFrame 模式下的行索引一致，结果子集仍按行索引与目录对应
+    子串匹配（不区分大小写）在小写的字节区中查找，按偏移换算成行号：文件名每行一条，
+    路径每种不同的路径一条（命中后按路径号展开到各行）；建好后只读，可在多线程间共享
+    """
+
+    def __init__(self, rows: Iterable[Tuple[int, object, str, str]]):
+        segment_ids: Dict[str, int] = {}
+        path_ids: Dict[str, int] = {}
+        path_segment_ids = array('i')
+        path_offsets = array('q', [0])
+        path_arena = bytearray()
+        path_arena_offsets = array('q')
+        row_path_ids = array('i')
+        id_arena = bytearray()
+        id_offsets = array('q')
+        labels = array('q')
+        arena = bytearray()
+        offsets = array('q')
+        lower_arena = bytearray()
+        lower_offsets = array('q')
+
+        for label, row_id, path, filename in rows:
+            path_id = path_ids.get(path)
+            if path_id is None:
+                path_id = path_ids[path] = len(path_ids)
+                for segment in path.split('->'):
+                    path_segment_ids.append(segment_ids.setdefault(segment, len(segment_ids)))
+                path_offsets.append(len(path_segment_ids))
+                path_arena_offsets.append(len(path_arena))
+                path_arena += path.lower().encode('utf-8') + _SEPARATOR
+            row_path_ids.append(path_id)
+            id_offsets.append(len(id_arena))
+            id_arena += str(row_id).encode('utf-8') + _SEPARATOR
+            labels.append(label)
+
+            offsets.append(len(arena))
+            arena += filename.encode('utf-8') + _SEPARATOR
+            lower_offsets.append(len(lower_arena))
+            lower_arena += filename.lower().encode('utf-8') + _SEPARATOR
+
+        id_offsets.append(len(id_arena))
+        offsets.append(len(arena))
+        lower_offsets.append(len(lower_arena))
+        path_arena_offsets.append(len(path_arena))
+        self.path_count = len(path_ids)
+        del path_ids
+
+        self.segments: List[str] = list(segment_ids)
+        self.path_segment_ids = np.frombuffer(path_segment_ids, dtype=np.int32)
+        self.path_offsets = np.frombuffer(path_offsets, dtype=np.int64)
+        self.path_ids = np.frombuffer(row_path_ids, dtype=np.int32)
+        self.id_arena = bytes(id_arena)
+        self.id_offsets = np.frombuffer(id_offsets, dtype=np.int64)
+        self.labels = np.frombuffer(labels, dtype=np.int64)
+        self.filename_arena = bytes(arena)
+        self.filename_offsets = np.frombuffer(offsets, dtype=np.int64)
+        if lower_arena == arena:
+            # 没有需要转小写的字符时共用同一个字节区
+            self._lower_arena, self._lower_offsets = self.filename_arena, self.filename_offsets
+        else:
+            self._lower_arena = bytes(lower_arena)
+            self._lower_offsets = np.frombuffer(lower_offsets, dtype=np.int64)
+        self._path_arena = bytes(path_arena)
+        self._path_arena_offsets = np.frombuffer(path_arena_offsets, dtype=np.int64)
+        self.label_index = pd.Index(self.labels)
+
+    @classmethod
+    def from_csv(cls, path: str) -> 'CompactCatalog':
+        """
+        逐行读取资料清单（ID, 层级路径, 关联文件名称），不经过 DataFrame；
+        行的取舍和行号与 DataFrame 模式（read_csv 后 dropna）一致：空行不占行号，
+        字段缺失或整格为 read_csv 默认缺失值（空串、NA、null 等，不去除空白）的行跳过，只含空白的格照常保留
+        """
+        def rows():
+            with open(path, encoding='utf-8', newline='') as f:
+                reader = csv.reader(f)
+                next(reader, None)
+                label = 0
+                for row in reader:
+                    if not row:
+                        continue
+                    if len(row) >= 3 and not any(value in _NA_VALUES for value in row[:3]):
+                        yield label, row[0], row[1], row[2]
+                    label += 1
+        return cls(rows())
+
+    @classmethod
+    def from_frame(cls, data: pd.DataFrame) -> 'CompactCatalog':
+        return cls(zip(
+            (int(label) for label in data.index),
+            data['ID'].tolist(),
+            data['层级路径'].astype(str).tolist(),
+            data['关联文件名称'].astype(str).tolist()
+        ))
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def id_at(self, position: int) -> str:
+        start, end = self.id_offsets[position], self.id_offsets[position + 1] - 1
+        return self.id_arena[start:end].decode('utf-8')
+
+    def filename_at(self, position: int) -> str:
+        start, end = self.filename_offsets[position], self.filename_offsets[position + 1] - 1
+        return self.filename_arena[start:end].decode('utf-8')
+
+    def path_segments(self, path_id: int) -> List[str]:
+        """某种路径的各段"""
+        start, end = self.path_offsets[path_id], self.path_offsets[path_id + 1]
+        return [self.segments[segment_id] for segment_id in self.path_segment_ids[start:end].tolist()]
+
+    def path(self, path_id: int) -> str:
+        return '->'.join(self.path_segments(path_id))
+
+    def path_at(self, position: int) -> str:
+        return self.path(self.path_ids[position])
+
+    def unique_paths(self) -> List[str]:
+        """全部不同的路径（按首次出现的顺序）"""
+        return [self.path(path_id) for path_id in range(self.path_count)]
+
+    def column(self, field: str, positions: Optional[np.ndarray] = None) -> List[str]:
+        """按行位置取出某个字段的字符串（未指定时取全部行）"""
+        positions = self._positions(positions)
+        if field == 'ID':
+            return [self.id_at(position) for position in positions.tolist()]
+        if field == '层级路径':
+            # 同一种路径只拼接一次，各行共享同一个字符串
+            paths: Dict[int, str] = {}
+            column = []
+            for path_id in self.path_ids[positions].tolist():
+                path = paths.get(path_id)
+                if path is None:
+                    path = paths[path_id] = self.path(path_id)
+                column.append(path)
+            return column
+        if field == '关联文件名称':
+            return [self.filename_at(position) for position in positions.tolist()]
+        raise KeyError(field)
+
+    def frame(self, positions: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """把若干行物化为 DataFrame（行索引为目录中的行号），用于结果子集"""
+        positions = self._positions(positions)
+        return pd.DataFrame(
+            {field: self.column(field, positions) for field in ('ID', '层级路径', '关联文件名称')},
+            index=self.label_index[positions]
+        )
+
+    def contains(self, field: str, keyword: str) -> np.ndarray:
+        """关键词在字段中的匹配位图（不区分大小写；含正则字符时按正则匹配）"""
+        if any(char in keyword for char in REGEX_META):
+            pattern = re.compile(keyword, re.IGNORECASE)
+            if field == '层级路径':
+                matched = np.fromiter((bool(pattern.search(path)) for path in self.unique_paths()), bool, self.path_count)
+                return matched[self.path_ids]
+            return np.fromiter((bool(pattern.search(text)) for text in self.column(field)), bool, len(self))
+
+        needle = keyword.lower()
+        if field == '层级路径':
+            matched = self._arena_contains(self._path_arena, self._path_arena_offsets, needle.encode('utf-8'))
+            return matched[self.path_ids]
+        if field == '关联文件名称':
+            return self._arena_contains(self._lower_arena, self._lower_offsets, needle.encode('utf-8'))
+        return np.fromiter((needle in text for text in self.column(field)), bool, len(self))
+
+    @staticmethod
+    def _arena_contains(arena: bytes, offsets: np.ndarray, needle: bytes) -> np.ndarray:
+        """在以换行分隔的字节区中查找子串，返回各条目是否命中"""
+        mask = np.zeros(len(offsets) - 1, dtype=bool)
+        mask[find_entries(arena, offsets, needle)] = True
+        return mask
+
+    def write_shared(self, directory: str):
+        """
+        把检索用的小写字节区、偏移和每行的路径号写入目录（通常在 /dev/shm 下），
+        供其他进程以 mmap 只读映射（见 utils/sharded_retrieval.py）
+        """
+        with open(os.path.join(directory, 'filenames.bin'), 'wb') as f:
+            f.write(self._lower_arena)
+        with open(os.path.join(directory, 'paths.bin'), 'wb') as f:
+            f.write(self._path_arena)
+        np.save(os.path.join(directory, 'filename_offsets.npy'), self._lower_offsets)
+        np.save(os.path.join(directory, 'path_offsets.npy'), self._path_arena_offsets)
+        np.save(os.path.join(directory, 'path_ids.npy'), self.path_ids)
+
+    def _positions(self, positions: Optional[np.ndarray]) -> np.ndarray:
+        if positions is None:
+            return np.arange(len(self))
+        return np.asarray(positions, dtype=np.int64)
+
+    def nbytes(self) -> Dict[str, int]:
+        """各部分占用的字节数（不含 Python 对象头等固定开销）"""
+        return {
+            'ids': len(self.id_arena) + self.id_offsets.nbytes + self.labels.nbytes,
+            'paths': self.path_ids.nbytes + self.path_segment_ids.nbytes + self.path_offsets.nbytes
+            + len(self._path_arena) + self._path_arena_offsets.nbytes
+            + sum(len(segment.encode('utf-8')) for segment in self.segments),
+            'filenames': len(self.filename_arena) + self.filename_offsets.nbytes
+            + (len(self._lower_arena) + self._lower_offsets.nbytes if self._lower_arena is not self.filename_arena else 0)
+        }
@@ -1,98 +1,111 @@
+import numpy as np
 import pandas as pd
-from typing import List, Dict
+from typing import List, Dict, Iterable
 import re
+import logging
+import threading
+import config
+from utils.catalog_index import CatalogIndex
+from utils.compact_catalog import CompactCatalog
+from utils.keyword_extractor import CatalogKeywordExtractor
+from utils.selection_text import clean_selection_text
+from utils.suggest_index import SuggestIndex
+
+logger = logging.getLogger(__name__)
 
 class DataLoader:
-    def __init__(self, data_path: str):
+    def __init__(self, data_path: str, store: str = None):
         self.data_path = data_path
-        self.data = None
-        self._load_data()
+        self.store = store or config.Config.CATALOG_STORE
+        self._data = None
+        self.catalog = None
+        self.index = None
+        self.suggest_index = None
+        self._keyword_extractor = None
+        self._extractor_lock = threading.Lock()
+        if self.store == 'compact':
+            self._load_catalog()
+        elif self.store == 'dataframe':
+            self._load_data()
+        else:
+            raise ValueError(f'未知的目录存储方式: {self.store}')
+        # 建立倒排索引，供线索筛选等场景复用
+        self.index = CatalogIndex(self._data, catalog=self.catalog)
+        # 输入联想的前缀索引
+        self.suggest_index = SuggestIndex(self._column('层级路径'), self._column('关联文件名称'))
+    
+    @property
+    def data(self) -> pd.DataFrame:
+        """
+        常驻内存的目录 DataFrame；compact 模式下没有常驻的 DataFrame，访问时抛出 RuntimeError，
+        避免逐关键词扫描等代码在每次访问时悄悄物化整个目录（一次性用途改用 frame()）
+        """
+        if self.catalog is not None:
+            raise RuntimeError('compact 模式下没有常驻的目录 DataFrame，请使用 frame() 或紧凑目录的接口')
+        return self._data
+    
+    def frame(self) -> pd.DataFrame:
+        """整个目录的 DataFrame；compact 模式下临时物化，只供建索引、生成基准查询等一次性用途"""
+        if self.catalog is not None:
+            return self.catalog.frame()
+        return self._data
+    
+    def __len__(self) -> int:
+        return len(self.catalog) if self.catalog is not None else len(self._data)
+    
+    def ids_at(self, positions: np.ndarray) -> List[str]:
+        """目录中若干行位置的 ID"""
+        if self.catalog is not None:
+            return self.catalog.column('ID', positions)
+        return self._data['ID'].iloc[positions].tolist()
+    
+    def _column(self, field: str) -> Iterable[str]:
+        if self.catalog is not None:
+            return self.catalog.column(field)
+        return self._data[field].astype(str).tolist()
+    
+    @property
+    def keyword_extractor(self) -> CatalogKeywordExtractor:
+        """目录词表关键词提取器，只在大模型不可用时需要，首次使用时构建"""
+        if self._keyword_extractor is None:
+            with self._extractor_lock:
+                if self._keyword_extractor is None:
+                    # 词表只看出现过的词，compact 模式下每种路径只需给一次
+                    paths = self.catalog.unique_paths() if self.catalog is not None else self._column('层级路径')
+                    self._keyword_extractor = CatalogKeywordExtractor(
+                        [*paths, *self._column('关联文件名称')])
+        return self._keyword_extractor
     
     def _load_data(self):
         """加载数据，不做任何处理"""
         try:
-            self.data = pd.read_csv(self.data_path, encoding='utf-8')
-            print(f"成功加载数据，共 {len(self.data)} 行")
+            data = pd.read_csv(self.data_path, encoding='utf-8')
+            logger.info("成功加载数据，共 %d 行", len(data))
             
             # 确保列名正确
-            self.data.columns = ['ID', '层级路径', '关联文件名称']
+            data.columns = ['ID', '层级路径', '关联文件名称']
             
             # 清理数据
-            self.data = self.data.dropna()
-            self.data['ID'] = self.data['ID'].astype(str)
+            data = data.dropna()
+            data['ID'] = data['ID'].astype(str)
+            self._data = data
             
-            print("数据加载完成")
+            logger.info("数据加载完成")
             
         except Exception as e:
-            print(f"数据加载失败: {e}")
+            logger.error("数据加载失败: %s", e)
             raise
     
-    def search_keywords_separately(self, field: str, keywords: List[str]) -> pd.DataFrame:
-        """
-        分别对每个关键词匹配，删除匹配数为0的关键词，再取交集
-        """
-        if not keywords:
-            return pd.DataFrame()
-        
-        # 存储每个关键词的匹配结果
-        keyword_matches = []
-        valid_keywords = []
-        
-        print(f"在字段 '{field}' 中搜索关键词: {keywords}")
-        
-        for keyword in keywords:
-            # 单个关键词匹配
-            mask = self.data[field].str.contains(keyword, case=False, na=False)
-            match_df = self.data[mask].copy()
-            
-            print(f"  关键词 '{keyword}' 匹配到 {len(match_df)} 行")
-            
-            if not match_df.empty:
-                keyword_matches.append(match_df)
-                valid_keywords.append(keyword)
-            else:
-                print(f"  关键词 '{keyword}' 匹配结果为0，将被忽略")
-        
-        print(f"在字段 '{field}' 中，有效关键词: {valid_keywords}")
-        
-        if not keyword_matches:
-            return pd.DataFrame()
-        
-        # 取交集：需要所有有效关键词都匹配的行
-        # 方法：通过ID取交集
-        common_ids = set(keyword_matches[0]['ID'].tolist())
-        
-        for i in range(1, len(keyword_matches)):
-            current_ids = set(keyword_matches[i]['ID'].tolist())
-            common_ids = common_ids & current_ids
-        
-        # 返回交集结果
-        if common_ids:
-            result = self.data[self.data['ID'].isin(common_ids)].copy()
-            print(f"在字段 '{field}' 中，取交集后结果: {len(result)} 行")
-            return result
-        else:
-            print(f"在字段 '{field}' 中，有效关键词没有共同匹配的行")
-            return pd.DataFrame()
-    
-    def search_in_field(self, field: str, keywords: List[str]) -> pd.DataFrame:
-        """
-        在指定字段中搜索关键词
-        返回所有关键词都匹配的行（交集）
-        """
-        if not keywords:
-            return pd.DataFrame()
-        
-        # 初始化为全部为True的掩码
-        mask = pd.Series([True] * len(self.data))
-        
-        for keyword in keywords:
-            if keyword:  # 确保关键词非空
-                # 在该字段中搜索关键词（不区分大小写）
-                keyword_mask = self.data[field].str.contains(keyword, case=False, na=False)
-                mask = mask & keyword_mask
-        
-        return self.data[mask].copy()
+    def _load_catalog(self):
+        """逐行读入紧凑目录（字典编码，不经过 DataFrame）"""
+        try:
+            self.catalog = CompactCatalog.from_csv(self.data_path)
+            logger.info("紧凑目录加载完成，共 %d 行，%d 种路径，%.1f MB",
+                        len(self.catalog), self.catalog.path_count,
+                        sum(self.catalog.nbytes().values()) / 1024 / 1024)
+        except Exception as e:
+            logger.error("数据加载失败: %s", e)
+            raise
     
     def filter_by_selection(self, 
                            current_results: pd.DataFrame, 
@@ -104,37 +117,15 @@ class DataLoader:
             return current_results
         
         # 清理选择文本
-        cleaned_selection = self._clean_selection_text(selection)
+        cleaned_selection = clean_selection_text(selection)
         
-        print(f"筛选条件：字段={filter_field}, 逻辑={filter_logic}, 值='{selection}' (清理后='{cleaned_selection}')")
+        logger.debug("筛选条件：字段=%s, 逻辑=%s, 值='%s' (清理后='%s')", filter_field, filter_logic, selection, cleaned_selection)
         
         # 尝试不同的匹配策略
         results = self._try_filter_strategies(current_results, cleaned_selection, filter_field, filter_logic)
         
         return results
     
-    def _clean_selection_text(self, selection: str) -> str:
-        """清理选择文本，移除描述性内容"""
-        # 移除括号及括号内的内容
-        cleaned = re.sub(r'（[^）]*）', '', selection)  # 中文括号
-        cleaned = re.sub(r'\([^)]*\)', '', cleaned)  # 英文括号
-        cleaned = re.sub(r'\[[^\]]*\]', '', cleaned)  # 方括号
-        cleaned = re.sub(r'【[^】]*】', '', cleaned)  # 方括号
-        
-        # 移除常见的描述性短语
-        descriptive_phrases = [
-            '完整的', '特定的', '相关', '文档', '文件', '图纸',
-            '通常含', '包含', '如', '例如', '比如', '不确定', '都需要看看',
-            '仪表电路图（文件名称通常含', '针脚定义文档'
-        ]
-        for phrase in descriptive_phrases:
-            cleaned = cleaned.replace(phrase, '')
-        
-        # 清理空格和标点
-        cleaned = cleaned.strip(' ，、。,.')
-        
-        return cleaned if cleaned else selection
-    
     def _try_filter_strategies(self, current_results: pd.DataFrame, selection: str, filter_field: str, filter_logic: str) -> pd.DataFrame:
         """尝试不同的筛选策略"""
         strategies = [
@@ -158,13 +149,13 @@ class DataLoader:
                     filtered = current_results[mask].copy()
                     
                     if not filtered.empty:
-                        print(f"  筛选成功，匹配到 {len(filtered)} 行")
+                        logger.debug("  筛选成功，匹配到 %d 行", len(filtered))
                         return filtered
             except Exception as e:
-                print(f"  筛选策略失败: {e}")
+                logger.debug("  筛选策略失败: %s", e)
                 continue
         
-        print(f"  所有筛选策略都未匹配到结果")
+        logger.debug("  所有筛选策略都未匹配到结果")
         return pd.DataFrame()
     
     def _partial_keyword_match(self, df: pd.DataFrame, selection: str, field: str) -> pd.Series:
@@ -174,13 +165,13 @@ class DataLoader:
             # 提取中文关键词
             keywords = re.findall(r'[\u4e00-\u9fff]{2,}', selection)
             if keywords:
-                mask = pd.Series([False] * len(df))
+                mask = pd.Series(False, index=df.index)
                 for keyword in keywords:
                     mask = mask | df[field].str.contains(keyword, case=False, na=False)
                 return mask
         
         # 默认返回全False
-        return pd.Series([False] * len(df))
+        return pd.Series(False, index=df.index)
     
     def _extract_keywords_match(self, df: pd.DataFrame, selection: str, field: str) -> pd.Series:
         """提取关键词匹配"""
@@ -190,7 +181,7 @@ class DataLoader:
             '发动机', '底盘', '电气', 'ECU', 'BCM', 'VECU', '保险丝', '继电器'
         ]
         
-        mask = pd.Series([False] * len(df))
+        mask = pd.Series(False, index=df.index)
         
         # 检查选择文本中是否包含技术关键词
         for keyword in tech_keywords:
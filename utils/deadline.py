@@ -0,0 +1,68 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+import config
+from utils.llm_gateway import LLMUnavailable
+
+
+class DeadlineExceeded(LLMUnavailable):
+    """本轮剩余的时间预算不足以（继续）等待大模型，调用方应改走本地路径"""
+
+
+class Deadline:
+    """一轮请求的时间预算，并记录哪些阶段因此改用了本地替代"""
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+        self.degraded: List[str] = []
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def mark_degraded(self, stage: str):
+        if stage not in self.degraded:
+            self.degraded.append(stage)
+
+
+# 通过上下文变量传递到各阶段；线程池（asyncio.to_thread）和协程会继承
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar('circuit_deadline', default=None)
+
+
+@contextmanager
+def deadline_scope(budget: Optional[float]):
+    """在 with 块内生效的时间预算；budget 为空或 0 表示不限时"""
+    deadline = Deadline(budget) if budget else None
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+def mark_degraded(stage: str):
+    """记录某个阶段改用了本地替代（没有预算时忽略）"""
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.mark_degraded(stage)
+
+
+def llm_timeout(default: float) -> float:
+    """
+    本次大模型调用最多可等待的秒数：单次调用超时与剩余预算（扣除本地收尾的预留）取小；
+    剩余时间不足最短调用时长时直接抛出 DeadlineExceeded，不再发起调用
+    """
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return default
+
+    available = deadline.remaining() - config.Config.CHAT_BUDGET_RESERVE
+    if available < config.Config.LLM_MIN_CALL_SECONDS:
+        raise DeadlineExceeded(f'剩余预算 {deadline.remaining():.2f}s 不足')
+    return min(default, available)
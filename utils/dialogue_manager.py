@@ -1,10 +1,72 @@
 from typing import Dict, List, Any, Optional
 import uuid
+import asyncio
+import functools
+import threading
+from contextlib import contextmanager, asynccontextmanager
+import numpy as np
 import pandas as pd
 import re
 import json
 import config
 import random
+import logging
+from utils.catalog_index import REGEX_META
+from utils.metrics import span
+from utils.llm_client import batch_prompt, parse_batch_results, parse_json_content
+from utils.llm_gateway import LLMUnavailable
+from utils.model_router import ModelRouter
+from utils.result_facets import ResultFacets
+from utils.selection_text import clean_selection_text
+from utils.deadline import deadline_scope, mark_degraded
+from utils.singleflight import SingleFlight, AsyncSingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+INTENT_SYSTEM_PROMPT = "你是一个意图识别专家，请准确分析用户的意图。"
+
+INTENT_GUIDE = """## 意图分类（只识别与电路图搜索相关的意图）
+1. **新搜索请求 (new_search)** - 用户提出了一个全新的电路图搜索需求
+2. **提供线索 (provide_clue)** - 用户在现有搜索基础上提供了额外信息来缩小范围
+3. **其他 (other)** - 与电路图搜索无关的输入，包括问候、闲聊等
+
+**注意**：选项选择、返回上一步、重置对话只能通过按钮触发，不在此识别
+
+## 分析要点
+- 如果用户描述了一个全新的电路图需求，可能是新搜索意图
+- 如果用户在现有搜索基础上提供信息，可能是提供线索
+- **如果用户输入与电路图搜索完全无关，返回"other"**
+
+## 电路图搜索相关关键词参考
+- 电路图、电路、图纸、接线图、原理图、针脚、线路图
+- 车型品牌：东风、三一、徐工、红岩、解放、重汽
+- 系统部件：仪表、发动机、底盘、电气、ECU、BCM、保险丝、继电器
+- 查询动词：找、需要、查、搜索、定位
+"""
+
+INTENT_OUTPUT_FORMAT = """{
+    "intent": "意图类型",
+    "confidence": "high/medium/low",
+    "reasoning": "判断理由",
+    "additional_info": {  // 根据意图的附加信息
+        "clue_keywords": [],  // 如果是提供线索，提取的关键词
+        "new_query": ""       // 如果是新搜索，提取的查询内容
+    }
+}"""
+
+# 查看当前结果时每条结果的文本模板（字段见 ResultView.render）
+CURRENT_RESULT_TEMPLATE = "**{n}.** `{id}` - {filename}\n"
+
+
+def _serialized_turn(method):
+    """同一会话的轮次串行执行：被装饰方法的第一个参数为 DialogueState"""
+    @functools.wraps(method)
+    def wrapper(self, session, *args, **kwargs):
+        with session.lock:
+            return method(self, session, *args, **kwargs)
+    return wrapper
+
 
 class DialogueState:
     def __init__(self, session_id: str):
@@ -20,8 +82,49 @@ class DialogueState:
         self.filters_applied = []  # 已应用的筛选条件
         self.retry_count = 0  # 问题设计重试次数
         self.state_stack = []  # 用于支持回退的状态栈
-        self.analysis_start_index = 0  # 当前分析结果的起始索引
         self.in_guidance_process = False  # 是否在引导过程中
+        self.clue_keywords = []  # 在初始搜索结果上累计应用的线索关键词
+        self.base_positions = None  # 初始搜索结果在目录中的行位置
+        self.clue_mask_cache = {}  # 线索前缀 -> 初始搜索结果上的位图
+        self.lock = threading.RLock()  # 串行化同一会话的并发请求
+        # 异步入口使用的会话锁（不可重入），在事件循环中首次使用时创建：
+        # Python 3.9 的 asyncio.Lock() 创建时绑定当前线程的事件循环，工作线程中没有事件循环会直接报错
+        self.async_lock = None
+        
+    def __getstate__(self):
+        # 锁不能序列化，其余状态原样保留
+        state = self.__dict__.copy()
+        state.pop('lock', None)
+        state.pop('async_lock', None)
+        return state
+        
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+        self.async_lock = None
+
+    def get_async_lock(self) -> asyncio.Lock:
+        """在事件循环中取得（必要时创建）异步会话锁；检查与创建之间没有 await，同一事件循环内不会重复创建"""
+        if self.async_lock is None:
+            self.async_lock = asyncio.Lock()
+        return self.async_lock
+        
+    @property
+    def current_results(self) -> Optional[pd.DataFrame]:
+        return self._current_results
+    
+    @current_results.setter
+    def current_results(self, results: Optional[pd.DataFrame]):
+        # 每次替换结果都换一个新的结果句柄，旧句柄上的分页游标随之失效
+        self._current_results = results
+        self.results_handle = uuid.uuid4().hex[:12]
+        
+    def set_base_results(self, results: Optional[pd.DataFrame]):
+        """设置初始搜索结果，并清空基于它的线索缓存"""
+        self.all_search_results = results.copy() if results is not None else None
+        self.clue_keywords = []
+        self.base_positions = None
+        self.clue_mask_cache = {}
         
     def add_question(self, question_data: Dict, user_choice: str = None):
         """记录问题和用户选择"""
@@ -53,8 +156,10 @@ class DialogueState:
             'filters_applied': self.filters_applied.copy(),
             'current_question': self.current_question.copy() if self.current_question else None,
             'available_options': self.available_options.copy(),
-            'analysis_start_index': self.analysis_start_index,
             'in_guidance_process': self.in_guidance_process,
+            'clue_keywords': self.clue_keywords.copy(),
+            'base_positions': self.base_positions,
+            'clue_mask_cache': self.clue_mask_cache.copy(),  # 位图只读，浅拷贝即可
             'conversation_history': self.conversation_history.copy()  # 保存对话历史
         }
         self.state_stack.append(state_snapshot)
@@ -74,8 +179,10 @@ class DialogueState:
             self.filters_applied = last_state['filters_applied']
             self.current_question = last_state['current_question']
             self.available_options = last_state['available_options']
-            self.analysis_start_index = last_state['analysis_start_index']
             self.in_guidance_process = last_state['in_guidance_process']
+            self.clue_keywords = last_state['clue_keywords']
+            self.base_positions = last_state['base_positions']
+            self.clue_mask_cache = last_state['clue_mask_cache']
             self.conversation_history = last_state['conversation_history']  # 恢复对话历史
             return True
         return False
@@ -92,8 +199,10 @@ class DialogueState:
         self.filters_applied = []
         self.retry_count = 0
         self.state_stack = []
-        self.analysis_start_index = 0
         self.in_guidance_process = False
+        self.clue_keywords = []
+        self.base_positions = None
+        self.clue_mask_cache = {}
         # 保留欢迎消息的历史
         if self.conversation_history:
             self.conversation_history = [self.conversation_history[0]] if self.conversation_history[0].get('role') == 'assistant' else []
@@ -104,21 +213,97 @@ class DialogueManager:
         self.retriever = retriever
         self.llm_client = llm_client
         self.sessions = {}
+        self._sessions_lock = threading.Lock()
+        # 同一会话中与进行中轮次相同的消息只处理一次
+        self._turn_flight = SingleFlight('chat')
+        self._async_turn_flight = AsyncSingleFlight('chat')
     
     def get_session(self, session_id: str) -> DialogueState:
-        if session_id not in self.sessions:
-            self.sessions[session_id] = DialogueState(session_id)
-        return self.sessions[session_id]
+        session = self.sessions.get(session_id)
+        if session is None:
+            with self._sessions_lock:
+                # 加锁后再检查一次，避免并发请求各自创建会话
+                session = self.sessions.get(session_id)
+                if session is None:
+                    session = self.sessions[session_id] = DialogueState(session_id)
+        return session
+    
+    @contextmanager
+    def session_turn(self, session_id: str):
+        """持有会话锁处理一轮请求，同一会话的请求依次执行"""
+        session = self.get_session(session_id)
+        with session.lock:
+            yield session
+    
+    @asynccontextmanager
+    async def async_session_turn(self, session_id: str):
+        """session_turn 的异步版本：等待会话锁时不阻塞事件循环"""
+        session = self.get_session(session_id)
+        async with session.get_async_lock():
+            yield session
     
     def reset_session(self, session_id: str):
-        if session_id in self.sessions:
+        session = self.sessions.get(session_id)
+        if session is not None:
             # 清空会话状态
-            self.sessions[session_id].clear()
+            with session.lock:
+                session.clear()
+
+    async def reset_session_async(self, session_id: str):
+        """reset_session 的异步版本：等待进行中的异步轮次结束后清空"""
+        session = self.sessions.get(session_id)
+        if session is not None:
+            async with session.get_async_lock():
+                session.clear()
+
+    def handle_message(self, session_id: str, user_message: str, budget: Optional[float] = None) -> Dict:
+        """
+        处理一条聊天消息（点击选项或输入文字）
+        重复点击或重复提交时，与该会话进行中轮次相同的消息不会再执行一遍，
+        而是等待并共享那一轮的响应，避免重复保存状态和重复调用大模型
+        budget: 本轮的时间预算（秒），从收到消息起算，包括等待会话锁的时间；
+        预算不足的阶段改用本地替代，响应的 degraded_stages 列出这些阶段
+        """
+        return self._turn_flight.do(
+            (session_id, user_message), lambda: self._handle_message(session_id, user_message, budget))
+    
+    def _handle_message(self, session_id: str, user_message: str, budget: Optional[float]) -> Dict:
+        with deadline_scope(budget) as deadline:
+            # 持有会话锁：同一会话的请求依次处理，选项判断和处理之间状态不会被其他请求改动
+            with self.session_turn(session_id) as session:
+                # 检查是否是选项选择（只能通过点击选项触发）
+                if user_message in session.available_options:
+                    response = self._handle_option_selection(session, user_message)
+                else:
+                    response = self.process_query(session_id, user_message)
+        
+        response['degraded_stages'] = list(deadline.degraded) if deadline else []
+        return response
+    
+    async def handle_message_async(self, session_id: str, user_message: str, budget: Optional[float] = None) -> Dict:
+        """handle_message 的异步版本"""
+        return await self._async_turn_flight.do(
+            (session_id, user_message), lambda: self._handle_message_async(session_id, user_message, budget))
+    
+    async def _handle_message_async(self, session_id: str, user_message: str, budget: Optional[float]) -> Dict:
+        with deadline_scope(budget) as deadline:
+            async with self.async_session_turn(session_id) as session:
+                if user_message in session.available_options:
+                    response = await self._handle_option_selection_async(session, user_message)
+                else:
+                    response = await self._process_turn_async(session, session_id, user_message)
+        
+        response['degraded_stages'] = list(deadline.degraded) if deadline else []
+        return response
     
     def process_query(self, session_id: str, user_input: str) -> Dict:
         """处理用户查询 - 主入口点"""
         session = self.get_session(session_id)
-        
+        return self._process_turn(session, session_id, user_input)
+    
+    @_serialized_turn
+    def _process_turn(self, session: DialogueState, session_id: str, user_input: str) -> Dict:
+        """在会话锁内处理一轮用户输入"""
         # 检查特殊指令
         if user_input == "/back":
             return self._handle_back_intent(session)
@@ -135,8 +320,8 @@ class DialogueManager:
         intent_result = self._recognize_intent_for_search(session, user_input)
         intent = intent_result.get('intent', 'unknown')
         
-        print(f"🔍 意图识别结果: {intent}")
-        print(f"意图详情: {intent_result}")
+        logger.info("🔍 意图识别结果: %s", intent)
+        logger.debug("意图详情: %s", intent_result)
         
         # 根据意图处理
         if intent == 'new_search':
@@ -155,6 +340,39 @@ class DialogueManager:
             # 未知意图，按其他处理
             return self._handle_other_intent(session, user_input)
     
+    async def process_query_async(self, session_id: str, user_input: str) -> Dict:
+        """process_query 的异步版本：大模型调用以 await 等待，检索和筛选放到线程池执行"""
+        async with self.async_session_turn(session_id) as session:
+            return await self._process_turn_async(session, session_id, user_input)
+    
+    async def _process_turn_async(self, session: DialogueState, session_id: str, user_input: str) -> Dict:
+        """_process_turn 的异步版本，调用方需持有会话的异步锁"""
+        if user_input == "/back":
+            response = self._restore_previous_step(session)
+            if response is None:
+                return await self._handle_search_results_async(session, session.current_query, session.current_results)
+            return response
+        elif user_input == "/reset":
+            return self._handle_reset_intent(session, session_id)
+        
+        session.conversation_history.append({
+            'role': 'user',
+            'content': user_input
+        })
+        
+        intent_result = await self._recognize_intent_with_llm_async(session, user_input)
+        intent = intent_result.get('intent', 'unknown')
+        
+        logger.info("🔍 意图识别结果: %s", intent)
+        logger.debug("意图详情: %s", intent_result)
+        
+        if intent == 'new_search':
+            return await self._handle_new_search_intent_async(session, session_id, user_input, intent_result)
+        elif intent == 'provide_clue':
+            return await self._handle_clue_intent_async(session, user_input, intent_result)
+        else:
+            return self._handle_other_intent(session, user_input)
+    
     def _recognize_intent_for_search(self, session: DialogueState, user_input: str) -> Dict:
         """
         识别用户意图 - 只识别搜索相关意图
@@ -164,10 +382,70 @@ class DialogueManager:
         return self._recognize_intent_with_llm(session, user_input)
     
     def _recognize_intent_with_llm(self, session: DialogueState, user_input: str) -> Dict:
-        """使用大模型识别意图 - 只识别搜索相关意图"""
-        
-        # 准备上下文信息
-        context = {
+        """
+        使用大模型识别意图 - 只识别搜索相关意图
+        开启微批处理时，同一时刻多个会话的意图识别合并为一次请求
+        """
+        try:
+            with span('intent_llm'):
+                return self.llm_client.batcher.run(
+                    'intent', self._intent_context(session, user_input), self._classify_intent, self._classify_intents)
+            
+        except Exception as e:
+            logger.warning("意图识别失败: %s", e)
+            # 降级到规则匹配
+            mark_degraded('intent')
+            return self._fallback_intent_recognition(session, user_input)
+    
+    async def _recognize_intent_with_llm_async(self, session: DialogueState, user_input: str) -> Dict:
+        """_recognize_intent_with_llm 的异步版本"""
+        try:
+            with span('intent_llm'):
+                return await self.llm_client.async_batcher.run(
+                    'intent', self._intent_context(session, user_input),
+                    self._classify_intent_async, self._classify_intents_async)
+            
+        except Exception as e:
+            logger.warning("意图识别失败: %s", e)
+            mark_degraded('intent')
+            return self._fallback_intent_recognition(session, user_input)
+    
+    def _classify_intent(self, context: Dict) -> Dict:
+        response = self.llm_client.chat_completion(
+            'intent', config.Config.LLM_MODEL, self._intent_messages(context),
+            temperature=0.1,
+            max_tokens=800
+        )
+        return parse_json_content(response.choices[0].message.content)
+    
+    async def _classify_intent_async(self, context: Dict) -> Dict:
+        response = await self.llm_client.chat_completion_async(
+            'intent', config.Config.LLM_MODEL, self._intent_messages(context),
+            temperature=0.1,
+            max_tokens=800
+        )
+        return parse_json_content(response.choices[0].message.content)
+    
+    def _classify_intents(self, contexts: List[Dict]) -> List[Dict]:
+        response = self.llm_client.chat_completion(
+            'intent_batch', config.Config.LLM_MODEL, self._intent_batch_messages(contexts),
+            temperature=0.1,
+            max_tokens=800 * len(contexts)
+        )
+        return parse_batch_results(response, len(contexts))
+    
+    async def _classify_intents_async(self, contexts: List[Dict]) -> List[Dict]:
+        response = await self.llm_client.chat_completion_async(
+            'intent_batch', config.Config.LLM_MODEL, self._intent_batch_messages(contexts),
+            temperature=0.1,
+            max_tokens=800 * len(contexts)
+        )
+        return parse_batch_results(response, len(contexts))
+    
+    def _intent_context(self, session: DialogueState, user_input: str) -> Dict:
+        """意图识别需要的会话上下文（在持有会话锁时取快照）"""
+        return {
+            'user_input': user_input,
             'current_query': session.current_query,
             'has_current_question': bool(session.current_question),
             'current_question': session.current_question.get('question', '') if session.current_question else '',
@@ -175,82 +453,49 @@ class DialogueManager:
             'previous_questions_count': len(session.previous_questions),
             'filters_applied_count': len(session.filters_applied)
         }
-        
-        prompt = f"""
-# 电路图搜索助手意图识别
-
-## 用户输入
-"{user_input}"
+    
+    @staticmethod
+    def _intent_input_block(context: Dict, heading: str = '##') -> str:
+        """用户输入和对话上下文；批量提示中作为编号条目的下一级标题"""
+        return f"""{heading} 用户输入
+"{context['user_input']}"
 
-## 当前对话上下文
+{heading} 当前对话上下文
 - 当前搜索主题: {context['current_query']}
 - 是否有进行中的问题: {'是' if context['has_current_question'] else '否'}
 {'- 当前问题: ' + context['current_question'] if context['current_question'] else ''}
 {'- 当前选项: ' + ', '.join(context['available_options']) if context['available_options'] else ''}
 - 已进行的问题轮数: {context['previous_questions_count']}
-- 已应用的筛选条件: {context['filters_applied_count']}
-
-## 意图分类（只识别与电路图搜索相关的意图）
-1. **新搜索请求 (new_search)** - 用户提出了一个全新的电路图搜索需求
-2. **提供线索 (provide_clue)** - 用户在现有搜索基础上提供了额外信息来缩小范围
-3. **其他 (other)** - 与电路图搜索无关的输入，包括问候、闲聊等
-
-**注意**：选项选择、返回上一步、重置对话只能通过按钮触发，不在此识别
-
-## 分析要点
-- 如果用户描述了一个全新的电路图需求，可能是新搜索意图
-- 如果用户在现有搜索基础上提供信息，可能是提供线索
-- **如果用户输入与电路图搜索完全无关，返回"other"**
+- 已应用的筛选条件: {context['filters_applied_count']}"""
+    
+    def _intent_messages(self, context: Dict) -> List[Dict]:
+        """构建意图识别的提示"""
+        prompt = f"""
+# 电路图搜索助手意图识别
 
-## 电路图搜索相关关键词参考
-- 电路图、电路、图纸、接线图、原理图、针脚、线路图
-- 车型品牌：东风、三一、徐工、红岩、解放、重汽
-- 系统部件：仪表、发动机、底盘、电气、ECU、BCM、保险丝、继电器
-- 查询动词：找、需要、查、搜索、定位
+{self._intent_input_block(context)}
 
+{INTENT_GUIDE}
 ## 输出格式
 请返回JSON格式：
-{{
-    "intent": "意图类型",
-    "confidence": "high/medium/low",
-    "reasoning": "判断理由",
-    "additional_info": {{  // 根据意图的附加信息
-        "clue_keywords": [],  // 如果是提供线索，提取的关键词
-        "new_query": ""       // 如果是新搜索，提取的查询内容
-    }}
-}}
+{INTENT_OUTPUT_FORMAT}
 
 现在请分析用户输入并返回意图识别结果：
 """
         
-        try:
-            import openai
-            
-            response = openai.ChatCompletion.create(
-                model=config.Config.LLM_MODEL,
-                messages=[
-                    {"role": "system", "content": "你是一个意图识别专家，请准确分析用户的意图。"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
-                max_tokens=800
-            )
-            
-            content = response.choices[0].message.content.strip()
-            
-            # 清理JSON
-            if content.startswith('```json'):
-                content = content[7:-3]
-            elif content.startswith('```'):
-                content = content[3:-3]
-            
-            result = json.loads(content)
-            return result
-            
-        except Exception as e:
-            print(f"意图识别失败: {e}")
-            # 降级到规则匹配
-            return self._fallback_intent_recognition(session, user_input)
+        return [
+            {"role": "system", "content": INTENT_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _intent_batch_messages(self, contexts: List[Dict]) -> List[Dict]:
+        """构建多个会话合并的意图识别提示，分类说明只发送一次"""
+        blocks = [self._intent_input_block(context, '####') for context in contexts]
+        return [
+            {"role": "system", "content": INTENT_SYSTEM_PROMPT},
+            {"role": "user", "content": batch_prompt(
+                f'# 电路图搜索助手意图识别\n\n{INTENT_GUIDE}', blocks, INTENT_OUTPUT_FORMAT)}
+        ]
     
     def _fallback_intent_recognition(self, session: DialogueState, user_input: str) -> Dict:
         """降级意图识别：基于规则"""
@@ -356,8 +601,17 @@ class DialogueManager:
     
     def _handle_back_intent(self, session: DialogueState) -> Dict:
         """处理返回上一步意图"""
+        response = self._restore_previous_step(session)
+        if response is None:
+            # 返回到结果状态，重新处理结果
+            return self._handle_search_results(session, session.current_query, session.current_results)
+        return response
+    
+    def _restore_previous_step(self, session: DialogueState) -> Optional[Dict]:
+        """恢复上一步的状态；需要重新处理结果时返回 None"""
         if session.restore_state():
-            # 成功恢复状态
+            # 成功恢复状态；回到的问题记为需要返回上一步，用于评估问题设计的路由
+            ModelRouter.record_outcome(session.current_question, 'back')
             if session.current_question:
                 # 返回到问题状态
                 response = {
@@ -369,8 +623,7 @@ class DialogueManager:
                     'has_results': False
                 }
             elif session.current_results is not None and not session.current_results.empty:
-                # 返回到结果状态，重新处理结果
-                return self._handle_search_results(session, session.current_query, session.current_results)
+                return None
             else:
                 response = {
                     'type': 'message',
@@ -387,22 +640,60 @@ class DialogueManager:
     
     def _handle_new_search_intent(self, session: DialogueState, session_id: str, user_input: str, intent_result: Dict) -> Dict:
         """处理新搜索意图"""
+        new_query = self._begin_new_search(session, user_input, intent_result)
+        keywords = self.extract_keywords(new_query)
+        self._run_search(session, keywords)
+        
+        # 处理搜索结果
+        return self._handle_search_results(session, new_query, session.current_results)
+    
+    async def _handle_new_search_intent_async(self, session: DialogueState, session_id: str, user_input: str, intent_result: Dict) -> Dict:
+        """_handle_new_search_intent 的异步版本"""
+        new_query = self._begin_new_search(session, user_input, intent_result)
+        keywords = await self.extract_keywords_async(new_query)
+        await asyncio.to_thread(self._run_search, session, keywords)
+        
+        return await self._handle_search_results_async(session, new_query, session.current_results)
+    
+    def extract_keywords(self, query: str, offline: bool = False) -> List[str]:
+        """
+        大模型提取关键词；网关拒绝（熔断或排队已满）时改用目录词表本地提取
+        offline：批量检索等离线调用，走离线专用的并发名额
+        """
+        try:
+            if offline:
+                return self.llm_client.extract_keywords_offline(query)
+            return self.llm_client.extract_keywords(query)
+        except LLMUnavailable as e:
+            logger.warning("大模型不可用（%s），使用本地关键词提取", e)
+            mark_degraded('keywords')
+            return self.data_loader.keyword_extractor.extract(query)
+    
+    async def extract_keywords_async(self, query: str) -> List[str]:
+        """extract_keywords 的异步版本"""
+        try:
+            return await self.llm_client.extract_keywords_async(query)
+        except LLMUnavailable as e:
+            logger.warning("大模型不可用（%s），使用本地关键词提取", e)
+            mark_degraded('keywords')
+            return self.data_loader.keyword_extractor.extract(query)
+    
+    def _begin_new_search(self, session: DialogueState, user_input: str, intent_result: Dict) -> str:
+        """保存当前状态并切换到新查询，返回新查询内容"""
         # 获取新查询内容
         new_query = intent_result.get('additional_info', {}).get('new_query', user_input)
         
         # 保存当前状态以便回退
         session.save_state()
         
-        # 执行新搜索
         session.current_query = new_query
-        session.keywords = self.llm_client.extract_keywords(new_query)
-        
-        # 执行搜索
+        return new_query
+    
+    def _run_search(self, session: DialogueState, keywords: List[str]):
+        """用关键词检索，结果作为本次搜索的初始结果"""
+        session.keywords = keywords
         session.current_results = self.retriever.search(session.keywords)
-        session.all_search_results = session.current_results.copy() if session.current_results is not None else None
-        
-        # 处理搜索结果
-        return self._handle_search_results(session, new_query, session.current_results)
+        session.set_base_results(session.current_results)
     
     def _handle_clue_intent(self, session: DialogueState, user_input: str, intent_result: Dict) -> Dict:
         """处理提供线索意图"""
@@ -412,35 +703,89 @@ class DialogueManager:
         # 如果没有初始搜索结果，先进行搜索
         if session.all_search_results is None or session.all_search_results.empty:
             # 将线索作为新查询
-            combined_query = user_input
-            session.current_query = combined_query
-            session.keywords = self.llm_client.extract_keywords(combined_query)
-            session.current_results = self.retriever.search(session.keywords)
-            session.all_search_results = session.current_results.copy() if session.current_results is not None else None
+            session.current_query = user_input
+            self._run_search(session, self.extract_keywords(user_input))
         else:
-            # 在初始搜索结果中应用线索
-            clue_keywords = intent_result.get('additional_info', {}).get('clue_keywords', [user_input])
-            
-            # 在初始搜索结果中应用线索筛选
-            filtered_results = session.all_search_results.copy()
-            for keyword in clue_keywords:
-                if keyword:
-                    # 同时在两个字段中搜索
-                    filename_mask = filtered_results['关联文件名称'].str.contains(keyword, case=False, na=False)
-                    path_mask = filtered_results['层级路径'].str.contains(keyword, case=False, na=False)
-                    combined_mask = filename_mask | path_mask
-                    filtered_results = filtered_results[combined_mask]
-            
-            session.current_results = filtered_results
-            session.current_query = f"{session.current_query} {user_input}".strip()
+            self._apply_clues(session, user_input, intent_result)
         
         # 处理搜索结果
         return self._handle_search_results(session, session.current_query, session.current_results)
     
+    async def _handle_clue_intent_async(self, session: DialogueState, user_input: str, intent_result: Dict) -> Dict:
+        """_handle_clue_intent 的异步版本"""
+        session.save_state()
+        
+        if session.all_search_results is None or session.all_search_results.empty:
+            session.current_query = user_input
+            keywords = await self.extract_keywords_async(user_input)
+            await asyncio.to_thread(self._run_search, session, keywords)
+        else:
+            await asyncio.to_thread(self._apply_clues, session, user_input, intent_result)
+        
+        return await self._handle_search_results_async(session, session.current_query, session.current_results)
+    
+    def _apply_clues(self, session: DialogueState, user_input: str, intent_result: Dict):
+        """在初始搜索结果中应用线索"""
+        clue_keywords = intent_result.get('additional_info', {}).get('clue_keywords', [user_input])
+        
+        # 线索在本次搜索内累计生效，与之前的线索取交集
+        session.clue_keywords.extend(keyword for keyword in clue_keywords if keyword)
+        with span('clue_filter'):
+            clue_mask = self._get_clue_mask(session)
+        
+        session.current_results = session.all_search_results[clue_mask]
+        session.current_query = f"{session.current_query} {user_input}".strip()
+    
+    def _get_clue_mask(self, session: DialogueState) -> np.ndarray:
+        """
+        计算线索在初始搜索结果上的位图
+        使用目录倒排索引的关键词位图，与初始结果的行位置对齐后逐个取交集；
+        每个线索前缀的位图都缓存在会话中，追加线索时只需计算新增的一次交集
+        """
+        index = self.data_loader.index
+        if session.base_positions is None:
+            session.base_positions = index.positions_of(session.all_search_results)
+        
+        clues = tuple(session.clue_keywords)
+        cache = session.clue_mask_cache
+        
+        # 找到已缓存的最长前缀
+        cached_len = len(clues)
+        while cached_len > 0 and clues[:cached_len] not in cache:
+            cached_len -= 1
+        
+        if cached_len > 0:
+            mask = cache[clues[:cached_len]]
+        else:
+            mask = np.ones(len(session.base_positions), dtype=bool)
+        
+        for i in range(cached_len, len(clues)):
+            keyword_mask = index.match_any(clues[i])[session.base_positions]
+            mask = mask & keyword_mask
+            cache[clues[:i + 1]] = mask
+        
+        return mask
+    
     def _handle_search_results(self, session: DialogueState, query: str, results: pd.DataFrame) -> Dict:
         """处理搜索结果"""
         # 注意：这里不再保存状态，由调用者负责保存状态
-        
+        response = self._respond_without_guidance(session, query, results)
+        if response is None:
+            return self._start_guidance_process(session, query, results)
+        return response
+    
+    async def _handle_search_results_async(self, session: DialogueState, query: str, results: pd.DataFrame) -> Dict:
+        """_handle_search_results 的异步版本"""
+        response = self._respond_without_guidance(session, query, results)
+        if response is None:
+            return await self._start_guidance_process_async(session, query, results)
+        return response
+    
+    def _respond_without_guidance(self, session: DialogueState, query: str, results: pd.DataFrame) -> Optional[Dict]:
+        """
+        无结果或结果足够少时直接构造回复并记入对话历史；
+        结果太多需要引导时初始化引导状态并返回 None
+        """
         if results is None or results.empty:
             response = {
                 'type': 'message',
@@ -449,31 +794,23 @@ class DialogueManager:
         else:
             total_results = len(results)
             
-            # 告诉用户总结果数和前5个结果
-            top5_results = self.retriever.format_results_for_display(results.head(5))
-            message = f"🔍 为您找到 {total_results} 个相关结果。以下是前 5 个结果：\n\n"
-            
-            for i, result in enumerate(top5_results, 1):
-                message += f"{i}. **ID:** {result['ID']} - **文件名称:** {result['关联文件名称']}\n"
-            
             # 根据结果数量决定下一步
             if total_results <= config.Config.MAX_RESULTS_DISPLAY:
-                # 直接显示所有结果
-                formatted_results = self.retriever.format_results_for_display(results)
-                response_text = self.llm_client.format_final_results(formatted_results, query)
+                # 直接显示所有结果：本轮的回复文本和结果列表共用同一个结果视图
+                view = self.retriever.result_view(results)
+                response_text = self.llm_client.format_final_results(view, query)
                 
                 response = {
                     'type': 'results',
                     'content': response_text,
-                    'results': formatted_results,
+                    'results': view.records(),
                     'has_results': True,
-                    'results_count': len(formatted_results)
+                    'results_count': len(view)
                 }
             else:
                 # 结果太多，开始引导过程
                 session.in_guidance_process = True
-                session.analysis_start_index = 0
-                return self._start_guidance_process(session, query, results)
+                return None
         
         session.conversation_history.append({
             'role': 'assistant',
@@ -483,35 +820,158 @@ class DialogueManager:
         return response
     
     def _start_guidance_process(self, session: DialogueState, query: str, results: pd.DataFrame) -> Dict:
-        """开始引导过程"""
-        total_results = len(results)
-        start_index = session.analysis_start_index
-        end_index = min(start_index + config.Config.MAX_RESULTS_ANALYSIS, total_results)
+        """开始引导过程：基于全部结果的统计设计问题"""
+        # 使用大模型设计问题
+        with span('question_design'):
+            question_data = self.llm_client.design_question_from_results(
+                query,
+                self.retriever.result_view(results),
+                session.previous_questions
+            )
         
-        # 获取当前批次的结果
-        current_batch = results.iloc[start_index:end_index]
-        remaining_count = total_results - end_index
+        return self._guidance_response(session, results, question_data)
+    
+    async def _start_guidance_process_async(self, session: DialogueState, query: str, results: pd.DataFrame) -> Dict:
+        """_start_guidance_process 的异步版本：取列、统计和按选项筛选都在线程中执行，不阻塞事件循环"""
+        with span('question_design'):
+            view = await asyncio.to_thread(self.retriever.result_view, results)
+            question_data = await self.llm_client.design_question_from_results_async(
+                query,
+                view,
+                session.previous_questions
+            )
         
-        # 格式化当前批次结果
-        formatted_batch = self.retriever.format_results_for_display(current_batch)
+        return await asyncio.to_thread(self._guidance_response, session, results, question_data)
+    
+    def _option_matches(self, results: pd.DataFrame, option: str, question_data: Dict) -> pd.Index:
+        """某个选项命中的结果，与用户选择该选项时的筛选一致"""
+        with span('filter'):
+            matched = self.data_loader.filter_by_selection(
+                results,
+                option,
+                question_data.get('filter_field', '层级路径'),
+                question_data.get('filter_logic', '包含')
+            )
+        return matched.index
+    
+    def _remaining_results(self, results: pd.DataFrame, question_data: Dict) -> pd.DataFrame:
+        """不被问题中任何选项命中的结果，即“其他”选项对应的结果"""
+        covered = pd.Index([])
+        for option in question_data.get('options', []):
+            covered = covered.union(self._option_matches(results, option, question_data))
+        return results[~results.index.isin(covered)]
+    
+    def _option_mask(self, results: pd.DataFrame, positions: np.ndarray, values: Optional[set],
+                     option: str, question_data: Dict) -> np.ndarray:
+        """
+        某个选项在结果上的命中位图，与用户选择该选项时的筛选一致：
+        清理后的选项按“包含”匹配时直接取目录倒排索引的关键词位图（已缓存）再按结果的行位置取出；
+        整值相等（筛选优先完全匹配）、含正则字符或按包含匹配不到（筛选改用部分关键词）时退回实际筛选
+        """
+        field = question_data.get('filter_field', '层级路径')
+        selection = clean_selection_text(option)
+        if values is not None and selection not in values and not any(char in REGEX_META for char in selection):
+            mask = self.data_loader.index.keyword_mask(field, selection)[positions]
+            if mask.any():
+                return mask
+        return results.index.isin(self._option_matches(results, option, question_data))
+    
+    def _narrowing_options(self, results: pd.DataFrame, candidates: List[str], question_data: Dict):
+        """
+        按实际筛选保留能缩小范围的候选选项（给“其他”留一个位置），与已保留选项命中同一组结果的候选也去掉
+        各选项的命中以结果上的位图表示，按位图判断是否重复
+        返回 (选项, 各选项的结果数, 被选项命中的结果数)
+        """
+        options = []
+        option_counts = []
+        covered = np.zeros(len(results), dtype=bool)
+        seen = set()
         
-        # 使用大模型设计问题
-        question_data = self.llm_client.design_question_from_results(
-            query,
-            formatted_batch,
-            session.previous_questions
-        )
+        field = question_data.get('filter_field', '层级路径')
+        index = self.data_loader.index
+        positions = index.positions_of(results)
+        # 字段不在倒排索引中时全部按实际筛选计算
+        values = set(self.retriever.result_columns(results, [field])[field]) if field in index.fields else None
+        
+        for option in candidates:
+            if len(options) >= config.Config.MAX_OPTIONS_DISPLAY - 1:
+                break
+            mask = self._option_mask(results, positions, values, option, question_data)
+            count = int(np.count_nonzero(mask))
+            if not 0 < count < len(results):
+                continue
+            key = np.packbits(mask).tobytes()
+            if key not in seen:
+                seen.add(key)
+                options.append(option)
+                option_counts.append(count)
+                covered |= mask
+        return options, option_counts, int(np.count_nonzero(covered))
+    
+    def _facet_question(self, results: pd.DataFrame):
+        """
+        设计好的问题无法缩小范围时，按结果统计本地出题：依次用公共前缀之下的每一层路径段，再用文件名高频词和型号代码，
+        取能缩小范围的值作为选项，返回 (问题, 各选项的结果数, 被选项命中的结果数)；都凑不出两个选项时返回 None
+        """
+        facets = ResultFacets(self.retriever.result_view(results))
+        limit = config.Config.MAX_OPTIONS_DISPLAY * 2
+        candidates = [('层级路径', '路径', [value for value, _ in counter.most_common(limit)])
+                      for counter in facets.path_levels]
+        candidates.append(
+            ('关联文件名称', '文件名', [token for token, _ in (facets.filename_tokens + facets.model_codes).most_common(limit)]))
+        for field, label, values in candidates:
+            question = {'filter_field': field, 'filter_logic': '包含'}
+            options, option_counts, covered = self._narrowing_options(results, values, question)
+            if len(options) >= 2:
+                question.update(
+                    analysis=f'当前 {facets.total} 个结果可以按{label}进一步区分。',
+                    question=f'请选择{label}中包含的内容：',
+                    options=options,
+                    design_reasoning=f'原问题的选项都无法缩小范围，按结果的{label}统计本地出题'
+                )
+                return question, option_counts, covered
+        return None
+    
+    def _guidance_response(self, session: DialogueState, results: pd.DataFrame, question_data: Dict) -> Dict:
+        """
+        根据设计好的问题更新会话状态并构建响应
+        选项按实际筛选统计结果数，无法缩小范围的选项被去掉，不被任何选项命中的结果归入“其他”；
+        所有选项都无法缩小范围时改用结果统计本地出题，仍然不行才请用户分页查看全部结果
+        """
+        total_results = len(results)
+        
+        options, option_counts, covered = self._narrowing_options(results, question_data.get('options', []), question_data)
         
-        # 准备选项
-        options = question_data.get('options', [])
+        if not options:
+            facet_design = self._facet_question(results)
+            if facet_design is None:
+                # 无法再细分：不在对话里塞入结果列表，请用户用“查看结果”分页浏览
+                logger.info("%d 个结果无法再按路径或文件名细分，请用户分页查看", total_results)
+                session.current_results = results
+                response = {
+                    'type': 'message',
+                    'content': f'📋 当前 {total_results} 个结果无法再按路径或文件名进一步区分，请点击「查看结果」逐页浏览全部结果。'
+                }
+                session.conversation_history.append({
+                    'role': 'assistant',
+                    'content': response['content']
+                })
+                return response
+            
+            logger.info("问题的选项都无法缩小 %d 个结果的范围，改用结果统计本地出题", total_results)
+            facet_question, option_counts, covered = facet_design
+            if question_data.get('route'):
+                facet_question['route'] = dict(question_data['route'], tier='facets')
+            question_data = facet_question
+            options = list(question_data['options'])
         
-        # 如果有剩余结果，添加"其他"选项
+        question_data['options'] = list(options)
+        
+        # 如果有未被选项命中的结果，添加"其他"选项
+        remaining_count = total_results - covered
         if remaining_count > 0:
             options.append(f"其他（还有{remaining_count}个结果）")
         
-        # 限制选项数量
-        options = options[:config.Config.MAX_OPTIONS_DISPLAY]
-        
         # 更新会话状态
         session.current_question = question_data
         session.available_options = options
@@ -520,10 +980,11 @@ class DialogueManager:
         analysis = question_data.get('analysis', '')
         question = question_data.get('question', '')
         
-        # 添加当前批次信息
-        batch_info = f"\n\n📊 **当前分析批次信息**\n- 正在分析第 {start_index+1}-{end_index} 个结果（共 {total_results} 个）"
+        # 添加结果分布信息
+        distribution = ''.join(f"\n- {option}：{count} 个" for option, count in zip(options, option_counts))
+        batch_info = f"\n\n📊 **结果分布**（共 {total_results} 个）{distribution}"
         if remaining_count > 0:
-            batch_info += f"\n- 后续还有 {remaining_count} 个结果待分析"
+            batch_info += f"\n- 其他：{remaining_count} 个"
         
         response_content = f"{analysis}{batch_info}\n\n{question}"
         
@@ -543,71 +1004,164 @@ class DialogueManager:
         
         return response
     
+    @_serialized_turn
     def _handle_option_selection(self, session: DialogueState, selection: str) -> Dict:
         """处理用户选择的选项 - 只能通过点击选项触发"""
+        response = self._apply_option_selection(session, selection)
+        if response is not None:
+            return response
+        
+        # 继续处理结果
+        return self._handle_search_results(session, session.current_query, session.current_results)
+    
+    async def _handle_option_selection_async(self, session: DialogueState, selection: str) -> Dict:
+        """_handle_option_selection 的异步版本，调用方需持有会话的异步锁（async_session_turn）"""
+        response = await asyncio.to_thread(self._apply_option_selection, session, selection)
+        if response is not None:
+            return response
+        
+        return await self._handle_search_results_async(session, session.current_query, session.current_results)
+    
+    def _apply_option_selection(self, session: DialogueState, selection: str) -> Optional[Dict]:
+        """
+        应用用户选择：按选项筛选当前结果，“其他”保留不被其余选项命中的结果
+        需要继续引导或处理结果时返回 None，否则返回直接回复
+        """
         if not session.current_question:
             return {'type': 'message', 'content': '请先提出搜索需求。'}
         
         # 保存状态以便回退
         session.save_state()
         
-        # 检查是否是"其他"选项
-        if "其他" in selection:
-            # 更新分析起始索引
-            session.analysis_start_index += config.Config.MAX_RESULTS_ANALYSIS
-            
-            # 检查是否还有结果
-            if session.analysis_start_index < len(session.current_results):
-                # 继续引导过程
-                return self._start_guidance_process(session, session.current_query, session.current_results)
-            else:
+        # 检查是否是"其他"选项（选项本身含“其他”二字时仍是普通选项）
+        is_other = "其他" in selection and selection not in session.current_question.get('options', [])
+        ModelRouter.record_outcome(session.current_question, 'other' if is_other else 'selected')
+        
+        # 记录原始结果数量
+        original_count = len(session.current_results)
+        
+        if is_other:
+            filtered_results = self._remaining_results(session.current_results, session.current_question)
+        else:
+            # 应用筛选
+            with span('filter'):
+                filtered_results = self.data_loader.filter_by_selection(
+                    session.current_results,
+                    selection,
+                    session.current_question.get('filter_field', '层级路径'),
+                    session.current_question.get('filter_logic', '包含')
+                )
+        
+        logger.debug("筛选结果：%d -> %d 行", original_count, len(filtered_results))
+        
+        # 更新当前结果
+        session.current_results = filtered_results
+        
+        # 记录问题和选择
+        session.add_question(session.current_question, selection)
+        
+        # 重置问题状态
+        session.current_question = None
+        session.available_options = []
+        
+        # 检查结果数量
+        if session.current_results.empty:
+            if is_other:
                 # 没有更多结果了
                 response = {
                     'type': 'message',
                     'content': '❌ 已经没有更多结果了，请尝试其他搜索条件。'
                 }
-        else:
-            # 应用筛选
-            filter_field = session.current_question.get('filter_field', '层级路径')
-            filter_logic = session.current_question.get('filter_logic', '包含')
-            
-            # 记录原始结果数量
-            original_count = len(session.current_results)
-            
-            # 筛选结果
-            filtered_results = self.data_loader.filter_by_selection(
-                session.current_results,
-                selection,
-                filter_field,
-                filter_logic
-            )
-            
-            print(f"筛选结果：{original_count} -> {len(filtered_results)} 行")
-            
-            # 更新当前结果
-            session.current_results = filtered_results
-            
-            # 记录问题和选择
-            session.add_question(session.current_question, selection)
-            
-            # 重置问题状态
-            session.current_question = None
-            session.available_options = []
-            
-            # 检查结果数量
-            if session.current_results.empty:
+            else:
                 # 提供更详细的错误信息
                 response = {
                     'type': 'message',
                     'content': f'❌ 根据您选择的"{selection}"，没有找到相关电路图。\n\n可能的原因：\n1. 选项文本与实际数据不匹配\n2. 数据中可能使用不同的表述\n\n建议：\n1. 尝试更简洁的表述（如"仪表电路图"而不是"完整的仪表电路图"）\n2. 使用"返回上一步"选择其他选项\n3. 重新描述您的具体需求'
                 }
-            else:
-                # 继续处理结果
-                return self._handle_search_results(session, session.current_query, session.current_results)
+        else:
+            return None
         
         session.conversation_history.append({
             'role': 'assistant',
             'content': response.get('content', '')
         })
         
-        return response
\ No newline at end of file
+        return response
+    
+    def current_results_message(self, session: DialogueState, cursor: str = None, limit: Any = None) -> Dict:
+        """
+        分页列出会话当前的结果（不经过大模型）：每页 limit 条，next_cursor 为下一页的游标（最后一页为 None）
+        游标由结果句柄和起始序号组成，会话结果被替换后旧游标失效，返回 stale；
+        各页内容依次拼接即为完整列表，标题在第一页，统计信息在最后一页
+        """
+        results = session.current_results
+        if results is None or results.empty:
+            return {
+                'type': 'message',
+                'content': '📊 **当前没有搜索结果**\n\n请先进行搜索。'
+            }
+        
+        offset = self._cursor_offset(session, cursor)
+        if offset is None:
+            return {
+                'type': 'message',
+                'content': '\n⚠️ 结果已更新，请重新查看当前结果。\n',
+                'stale': True
+            }
+        
+        total_count = len(results)
+        limit = self._page_size(limit)
+        end = min(offset + limit, total_count)
+        
+        # 只取本页的结果，按列渲染
+        lines = self.retriever.result_view(results.iloc[offset:end]).render(CURRENT_RESULT_TEMPLATE, start=offset + 1)
+        message = f"📊 **当前搜索结果（共 {total_count} 条）**\n\n{lines}" if offset == 0 else lines
+        
+        if end < total_count:
+            return {
+                'type': 'message',
+                'content': message,
+                'total': total_count,
+                'offset': offset,
+                'next_cursor': f"{session.results_handle}.{end}"
+            }
+        
+        # 添加统计信息
+        if session.current_query:
+            message += f"\n🔍 **搜索关键词**：{session.current_query}"
+        
+        if session.keywords:
+            message += f"\n📝 **提取关键词**：{', '.join(session.keywords)}"
+        
+        if session.previous_questions:
+            message += f"\n🔧 **已筛选条件**：{len(session.previous_questions)} 个"
+            for j, q in enumerate(session.previous_questions, 1):
+                choice = q.get('user_choice', '未选择')
+                message += f"\n    {j}. {choice}"
+        
+        return {
+            'type': 'message',
+            'content': message,
+            'total': total_count,
+            'offset': offset,
+            'next_cursor': None
+        }
+    
+    @staticmethod
+    def _cursor_offset(session: DialogueState, cursor: Optional[str]) -> Optional[int]:
+        """游标对应的起始序号；游标格式错误、已越界或不属于当前结果时返回 None"""
+        if not cursor:
+            return 0
+        handle, _, offset = str(cursor).partition('.')
+        if handle != session.results_handle or not offset.isdigit():
+            return None
+        offset = int(offset)
+        return offset if offset < len(session.current_results) else None
+    
+    @staticmethod
+    def _page_size(limit: Any) -> int:
+        try:
+            limit = int(limit) if limit else config.Config.RESULTS_PAGE_SIZE
+        except (TypeError, ValueError):
+            limit = config.Config.RESULTS_PAGE_SIZE
+        return min(max(limit, 1), config.Config.RESULTS_PAGE_MAX)
@@ -0,0 +1,230 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from itertools import combinations
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+from utils.metrics import span
+from utils.retrieval import SearchBackend
+
+logger = logging.getLogger(__name__)
+
+# DataFrame 字段 -> FTS 表的列名
+FIELD_COLUMNS = {'层级路径': 'path', '关联文件名称': 'filename'}
+
+# 表结构变化时递增，旧的索引文件会被重建
+SCHEMA_VERSION = 1
+
+# trigram 索引只能处理至少 3 个字符的子串
+_MIN_INDEXED_LENGTH = 3
+
+
+def _keyword_select(position: int, column: str, keyword: str) -> Tuple[str, str]:
+    """选出命中关键词的行：(关键词序号, 行号)；返回 SQL 和 LIKE 参数，匹配不区分大小写"""
+    if len(keyword) >= _MIN_INDEXED_LENGTH and not any(char in keyword for char in '%_\\'):
+        return f'SELECT {position} AS k, rowid FROM catalog WHERE {column} LIKE ?', f'%{keyword}%'
+    # 不足 3 个字符或需要转义时 trigram 索引用不上（SQLite 的部分版本还会给出错误的空结果），直接扫描普通表
+    escaped = keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"SELECT {position} AS k, rowid FROM rows WHERE {column} LIKE ? ESCAPE '\\'", f'%{escaped}%'
+
+
+class SqliteFtsBackend(SearchBackend):
+    """
+    SQLite FTS5 检索后端：目录存入普通表 rows，并建立 trigram 分词的外部内容 FTS5 索引 catalog，
+    至少 3 个字符的关键词（含中文）由索引完成子串匹配，更短的关键词扫描 rows
+    - 一个字段中“各关键词两两交集的并集”等价于“命中至少两个有效关键词的行”（只有一个有效关键词时为命中它的行），
+      用 UNION ALL + GROUP BY rowid HAVING COUNT(*) >= min(2, 有命中的关键词数) 表达；
+      两个字段的结果再 UNION，一条 SQL 取回按目录顺序排列的匹配行
+    - 索引文件与数据源的路径、修改时间、大小和行数对应，不一致时重建（先写临时文件再替换，多个 worker 同时启动也安全）
+    - 每个线程使用自己的只读连接；索引在磁盘上，多个 worker 通过页缓存共享
+    关键词按字面子串匹配，不支持 pandas 后端对含正则字符关键词的正则语义；
+    SQLite 的 LIKE 只对 ASCII 字母不区分大小写（如 ecu 能匹配 ECU），其他字母（如全角、希腊字母）区分大小写，
+    而 pandas 后端的 case=False 对所有 Unicode 字母都不区分大小写
+    """
+    name = 'sqlite'
+
+    def __init__(self, data_loader, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+
+        signature = self._signature(len(data_loader), data_loader.data_path)
+        if self._stored_signature() != signature:
+            # 只在重建时取整个目录（compact 模式下临时物化）
+            self._build(data_loader.frame(), signature)
+
+    @staticmethod
+    def _signature(rows: int, source_path: str) -> str:
+        stat = os.stat(source_path)
+        return f'{SCHEMA_VERSION}:{os.path.abspath(source_path)}:{stat.st_mtime_ns}:{stat.st_size}:{rows}'
+
+    def _stored_signature(self) -> str:
+        if not os.path.exists(self.db_path):
+            return ''
+        try:
+            connection = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True)
+            try:
+                row = connection.execute("SELECT value FROM meta WHERE key = 'signature'").fetchone()
+            finally:
+                connection.close()
+        except sqlite3.Error:
+            return ''
+        return row[0] if row else ''
+
+    def _build(self, data: pd.DataFrame, signature: str):
+        """把目录写入新的索引文件；行号（rowid）即 DataFrame 的行索引"""
+        start = time.perf_counter()
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        temp_path = f'{self.db_path}.{os.getpid()}.tmp'
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+        connection = sqlite3.connect(temp_path)
+        try:
+            connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            connection.execute("CREATE TABLE rows (rowid INTEGER PRIMARY KEY, id TEXT, path TEXT, filename TEXT)")
+            connection.execute(
+                "CREATE VIRTUAL TABLE catalog USING fts5("
+                "path, filename, content='rows', content_rowid='rowid', tokenize='trigram')"
+            )
+            connection.executemany(
+                "INSERT INTO rows (rowid, id, path, filename) VALUES (?, ?, ?, ?)",
+                zip(
+                    (int(label) for label in data.index),
+                    data['ID'].astype(str).tolist(),
+                    data['层级路径'].astype(str).tolist(),
+                    data['关联文件名称'].astype(str).tolist()
+                )
+            )
+            connection.execute("INSERT INTO catalog (catalog) VALUES ('rebuild')")
+            connection.execute("INSERT INTO catalog (catalog) VALUES ('optimize')")
+            connection.execute("INSERT INTO meta (key, value) VALUES ('signature', ?)", (signature,))
+            connection.commit()
+        finally:
+            connection.close()
+
+        os.replace(temp_path, self.db_path)
+        logger.info("FTS5 检索索引已重建: %s，%d 行，%.1f MB，用时 %.2f 秒",
+                    self.db_path, len(data), os.path.getsize(self.db_path) / 1024 / 1024,
+                    time.perf_counter() - start)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True)
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _field_hits(column: str, keywords: List[str]) -> Tuple[str, List[str]]:
+        """字段中各关键词的命中：(关键词序号, 行号) 的 UNION ALL"""
+        selects = [_keyword_select(position, column, keyword) for position, keyword in enumerate(keywords)]
+        return ' UNION ALL '.join(sql for sql, _ in selects), [pattern for _, pattern in selects]
+
+    def _hit_ctes(self, keywords: List[str]) -> Tuple[List[str], List[str]]:
+        """每个字段一个 {列名}_hits(k, rowid) CTE，列出各关键词命中的行"""
+        ctes = []
+        params = []
+        for column in FIELD_COLUMNS.values():
+            hits, hit_params = self._field_hits(column, keywords)
+            ctes.append(f'{column}_hits(k, rowid) AS ({hits})')
+            params.extend(hit_params)
+        return ctes, params
+
+    def match(self, keywords: List[str], explain: Dict = None) -> pd.DataFrame:
+        if not keywords:
+            return pd.DataFrame()
+
+        ctes, params = self._hit_ctes(keywords)
+        if explain is not None:
+            return self._match_explained(keywords, ctes, params, explain)
+
+        unions = []
+        for column in FIELD_COLUMNS.values():
+            name = f'{column}_hits'
+            # 两两交集的并集：命中至少两个有效关键词（有命中的关键词）的行
+            unions.append(
+                f'SELECT rowid FROM {name} GROUP BY rowid '
+                f'HAVING COUNT(*) >= (SELECT MIN(2, COUNT(DISTINCT k)) FROM {name})'
+            )
+
+        with span('retrieval_sqlite'):
+            rows = self.connection.execute(
+                f"WITH {', '.join(ctes)} "
+                f"SELECT rowid, id, path, filename FROM rows "
+                f"WHERE rowid IN ({' UNION '.join(unions)}) ORDER BY rowid",
+                params
+            ).fetchall()
+        return self._frame(rows)
+
+    def _match_explained(self, keywords: List[str], ctes: List[str], params: List[str], explain: Dict) -> pd.DataFrame:
+        """
+        explain 模式：同一组 *_hits CTE 直接取回 (字段, 关键词序号, 行号)，
+        命中数、被忽略的关键词、两两交集和并集都由这份命中列表统计，结果行按行号主键取回，不再另外扫描
+        """
+        timings = explain['timings_ms']
+        with span('retrieval_sqlite', timings):
+            hits = self.connection.execute(
+                f"WITH {', '.join(ctes)} "
+                + ' UNION ALL '.join(f"SELECT '{column}', k, rowid FROM {column}_hits" for column in FIELD_COLUMNS.values()),
+                params
+            ).fetchall()
+
+        with span('retrieval_explain', timings):
+            matched = {column: [set() for _ in keywords] for column in FIELD_COLUMNS.values()}
+            for column, position, rowid in hits:
+                matched[column][position].add(rowid)
+            rowids = set()
+            for field, column in FIELD_COLUMNS.items():
+                rowids |= self._explain_field(keywords, matched[column], self._field_info(explain, field))
+
+        rows = []
+        ordered = sorted(rowids)
+        with span('retrieval_sqlite_fetch', timings):
+            # 按主键分批取回结果行（每批参数数低于 SQLite 的上限）
+            for start in range(0, len(ordered), 500):
+                chunk = ordered[start:start + 500]
+                rows.extend(self.connection.execute(
+                    f"SELECT rowid, id, path, filename FROM rows WHERE rowid IN ({', '.join('?' * len(chunk))}) ORDER BY rowid",
+                    chunk
+                ).fetchall())
+        return self._frame(rows)
+
+    @staticmethod
+    def _frame(rows: List[Tuple]) -> pd.DataFrame:
+        logger.debug("并集结果: %d 行", len(rows))
+        if not rows:
+            return pd.DataFrame()
+        labels, ids, paths, filenames = zip(*rows)
+        return pd.DataFrame(
+            {'ID': ids, '层级路径': paths, '关联文件名称': filenames},
+            index=pd.Index(labels, dtype='int64')
+        )
+
+    @staticmethod
+    def _explain_field(keywords: List[str], matched: List[set], field_info: Dict) -> set:
+        """由一个字段各关键词命中的行号统计命中数、被忽略的关键词、两两交集和并集大小，返回该字段的结果行号"""
+        valid = [position for position in range(len(keywords)) if matched[position]]
+        for position, keyword in enumerate(keywords):
+            field_info['keyword_hits'][keyword] = len(matched[position])
+            if not matched[position]:
+                field_info['dropped_keywords'].append(keyword)
+
+        if len(valid) == 1:
+            field_info['union_size'] = len(matched[valid[0]])
+            return set(matched[valid[0]])
+        union = set()
+        for first, second in combinations(valid, 2):
+            intersection = matched[first] & matched[second]
+            field_info['pairs'].append({
+                'keywords': [keywords[first], keywords[second]],
+                'size': len(intersection)
+            })
+            union |= intersection
+        if valid:
+            field_info['union_size'] = len(union)
+        return union
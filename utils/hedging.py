@@ -0,0 +1,193 @@
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import config
+from utils.metrics import LLM_HEDGES
+
+
+class HedgeBudget:
+    """
+    对冲请求的速率预算（令牌桶）：每个可对冲的调用积累 rate 个令牌，上限 burst，
+    每发出一个对冲请求消耗一个令牌，对冲带来的额外调用不超过 rate × 调用数 + burst
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = 0.0
+        self._lock = threading.Lock()
+
+    def earn(self):
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + self.rate)
+
+    def available(self) -> bool:
+        return self.tokens >= 1.0
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self.tokens < 1.0:
+                return False
+            self.tokens -= 1.0
+            return True
+
+
+class LatencyTracker:
+    """按提示类型记录最近若干次成功调用的耗时，样本足够时给出分位数"""
+
+    def __init__(self, window: int, min_samples: int):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, prompt_type: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(prompt_type, deque(maxlen=self.window)).append(seconds)
+
+    def quantile(self, prompt_type: str, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(prompt_type, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return {prompt_type: len(samples) for prompt_type, samples in self._samples.items()}
+
+
+class Hedger:
+    """
+    大模型请求对冲：调用超过该提示类型最近耗时的分位数（默认 p90）仍未返回时，
+    再发出一个相同的请求，先成功返回的结果胜出，另一个被取消（同步版本无法中断，结果被丢弃）
+    只对配置的提示类型生效；样本不足、预算用尽或剩余超时不够时不对冲
+    """
+
+    def __init__(self):
+        self.enabled = config.Config.LLM_HEDGE_ENABLED
+        self.prompts = set(config.Config.LLM_HEDGE_PROMPTS)
+        self.quantile = config.Config.LLM_HEDGE_QUANTILE
+        self.min_delay = config.Config.LLM_HEDGE_MIN_DELAY
+        self.tracker = LatencyTracker(config.Config.LLM_HEDGE_WINDOW, config.Config.LLM_HEDGE_MIN_SAMPLES)
+        self.budget = HedgeBudget(config.Config.LLM_HEDGE_RATE, config.Config.LLM_HEDGE_BURST)
+
+    def observe(self, prompt_type: str, seconds: float):
+        """记录一次成功调用的耗时（含对冲请求）"""
+        self.tracker.observe(prompt_type, seconds)
+
+    def delay(self, prompt_type: str, timeout: float) -> Optional[float]:
+        """本次调用等待多久后发出对冲请求；None 表示不对冲"""
+        if not self.enabled or prompt_type not in self.prompts:
+            return None
+        self.budget.earn()
+        threshold = self.tracker.quantile(prompt_type, self.quantile)
+        if threshold is None or not self.budget.available():
+            return None
+        delay = max(threshold, self.min_delay)
+        return delay if delay < timeout else None
+
+    def call(self, prompt_type: str, attempt: Callable[[float], Any], timeout: float) -> Any:
+        """attempt(timeout) 发出一次请求；对冲时两次请求各在一个线程中执行"""
+        delay = self.delay(prompt_type, timeout)
+        if delay is None:
+            return attempt(timeout)
+
+        start = time.monotonic()
+        results = queue.Queue()
+        self._spawn(attempt, timeout, results, hedge=False)
+        try:
+            return self._unwrap(results.get(timeout=delay))
+        except queue.Empty:
+            pass
+
+        remaining = timeout - (time.monotonic() - start)
+        if not self.budget.try_spend():
+            LLM_HEDGES.inc(prompt=prompt_type, outcome='skipped')
+            return self._unwrap(results.get())
+
+        LLM_HEDGES.inc(prompt=prompt_type, outcome='issued')
+        self._spawn(attempt, remaining, results, hedge=True)
+        errors = {}
+        for _ in range(2):
+            hedge, ok, value = results.get()
+            if ok:
+                if hedge:
+                    LLM_HEDGES.inc(prompt=prompt_type, outcome='won')
+                return value
+            errors[hedge] = value
+        # 两次都失败时抛出原请求的异常
+        raise errors[False]
+
+    async def call_async(self, prompt_type: str, attempt: Callable[[float], Awaitable[Any]], timeout: float) -> Any:
+        """call 的异步版本；胜出后取消另一个请求"""
+        delay = self.delay(prompt_type, timeout)
+        if delay is None:
+            return await attempt(timeout)
+
+        start = time.monotonic()
+        primary = asyncio.ensure_future(attempt(timeout))
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+            if not self.budget.try_spend():
+                LLM_HEDGES.inc(prompt=prompt_type, outcome='skipped')
+                return await primary
+
+            LLM_HEDGES.inc(prompt=prompt_type, outcome='issued')
+            hedge = asyncio.ensure_future(attempt(timeout - (time.monotonic() - start)))
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            LLM_HEDGES.inc(prompt=prompt_type, outcome='won')
+                        return task.result()
+            return primary.result()
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    @staticmethod
+    def _spawn(attempt: Callable[[float], Any], timeout: float, results: queue.Queue, hedge: bool):
+        # 在新线程中沿用调用方的上下文（时间预算等上下文变量）
+        context = contextvars.copy_context()
+
+        def run():
+            try:
+                results.put((hedge, True, context.run(attempt, timeout)))
+            except BaseException as e:
+                results.put((hedge, False, e))
+
+        threading.Thread(target=run, name='llm-hedge', daemon=True).start()
+
+    @staticmethod
+    def _unwrap(result):
+        _, ok, value = result
+        if not ok:
+            raise value
+        return value
+
+    def status(self) -> Dict:
+        """各提示类型的对冲阈值和剩余预算"""
+        thresholds = {}
+        for prompt_type, samples in self.tracker.counts().items():
+            threshold = self.tracker.quantile(prompt_type, self.quantile)
+            thresholds[prompt_type] = {
+                'samples': samples,
+                'threshold': round(threshold, 3) if threshold is not None else None
+            }
+        return {
+            'enabled': self.enabled,
+            'budget_tokens': round(self.budget.tokens, 2),
+            'prompts': thresholds
+        }
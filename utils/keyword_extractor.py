@@ -0,0 +1,76 @@
+import re
+from typing import Iterable, List, Set
+
+# 与大模型分词提示一致：去掉“电路图”“图”等过于常见、在数据中表达不一致的词，以及口语化的请求用语
+STOP_PHRASES = ['电路图', '线路图', '接线图', '原理图', '图纸', '我要找', '我想找', '帮我找', '请帮我', '需要', '相关', '的', '图']
+
+# 词表中收录的中文词最大长度，也是正向最大匹配的窗口
+MAX_WORD_LENGTH = 8
+
+_TOKEN_PATTERN = re.compile(r'[A-Za-z0-9][A-Za-z0-9.\-]*[A-Za-z0-9]|[A-Za-z0-9]|[\u4e00-\u9fff]+')
+_SPLIT_PATTERN = re.compile(r'->|[_\s【】\[\]()（）,，、/]+')
+
+
+class CatalogKeywordExtractor:
+    """
+    基于目录词表的本地关键词提取，大模型不可用时代替 extract_keywords
+    - 词表：层级路径各段、文件名按下划线和括号切分后的词元中的中文串（2–8 字）
+    - 查询去掉常见词后，字母数字串（型号、ECU 等）原样保留，
+      中文串按词表做正向最大匹配，能拆成两个词表词的长词再继续拆分（“东风天龙”→“东风”“天龙”），
+      未收录的连续片段不少于两个字时也作为关键词
+    """
+
+    def __init__(self, texts: Iterable[str]):
+        """texts：层级路径和文件名（词表只关心出现过哪些词，重复的路径可以只给一次）"""
+        self.vocabulary: Set[str] = set()
+        for value in texts:
+            for part in _SPLIT_PATTERN.split(value):
+                for run in re.findall(r'[\u4e00-\u9fff]+', part):
+                    if 2 <= len(run) <= MAX_WORD_LENGTH:
+                        self.vocabulary.add(run)
+
+    def extract(self, user_query: str) -> List[str]:
+        query = user_query
+        for phrase in STOP_PHRASES:
+            query = query.replace(phrase, ' ')
+
+        keywords = []
+        for token in _TOKEN_PATTERN.findall(query):
+            if re.match(r'[\u4e00-\u9fff]', token):
+                keywords.extend(self._segment(token))
+            elif len(token) >= 2:
+                keywords.append(token)
+
+        # 去重并保持顺序
+        return list(dict.fromkeys(keywords))
+
+    def _segment(self, text: str) -> List[str]:
+        """正向最大匹配；词表外的连续字符聚成一段"""
+        words = []
+        unknown = ''
+        i = 0
+        while i < len(text):
+            for length in range(min(MAX_WORD_LENGTH, len(text) - i), 1, -1):
+                if text[i:i + length] in self.vocabulary:
+                    break
+            else:
+                unknown += text[i]
+                i += 1
+                continue
+
+            if len(unknown) >= 2:
+                words.append(unknown)
+            unknown = ''
+            words.extend(self._split(text[i:i + length]))
+            i += length
+
+        if len(unknown) >= 2:
+            words.append(unknown)
+        return words
+
+    def _split(self, word: str) -> List[str]:
+        """词表中的复合词若能拆成两个词表词则递归拆开，子串检索的召回更好"""
+        for k in range(2, len(word) - 1):
+            if word[:k] in self.vocabulary and word[k:] in self.vocabulary:
+                return self._split(word[:k]) + self._split(word[k:])
+        return [word]
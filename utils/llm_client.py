@@ -1,20 +1,65 @@
+import asyncio
 import json
+import hashlib
 import openai
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Union
 import config
 import re
+import time
+import logging
+from utils.metrics import span, LLM_LATENCY, LLM_REQUESTS, LLM_TOKENS
+from utils.singleflight import SingleFlight, AsyncSingleFlight
+from utils.llm_gateway import LLMGateway, LLMUnavailable, ModelLimiter
+from utils.hedging import Hedger
+from utils.micro_batch import MicroBatcher, AsyncMicroBatcher
+from utils.prompt_compactor import PromptCompactor
+from utils.model_router import ModelRouter, RouteDecision
+from utils.result_facets import ResultFacets
+from utils.result_view import ResultView
+from utils.deadline import DeadlineExceeded, current_deadline, llm_timeout, mark_degraded
 
-class DeepSeekClient:
-    def __init__(self):
-        openai.api_key = config.Config.LLM_API_KEY
-        openai.api_base = config.Config.LLM_BASE_URL
-        self.chat_model = config.Config.LLM_MODEL
-        self.reasoner_model = config.Config.LLM_REASONER_MODEL
-    
-    def extract_keywords(self, user_query: str) -> List[str]:
-        """使用大模型分词，提取关键词（移除'电路图'和'图'）"""
-        prompt = f"""
-请从用户查询中提取关键词。用户查询是关于车辆电路图搜索的。
+logger = logging.getLogger(__name__)
+
+
+def parse_json_content(content: str) -> Dict:
+    """解析大模型返回的 JSON，去掉可能包裹的 Markdown 代码块标记"""
+    content = content.strip()
+    if content.startswith('```json'):
+        content = content[7:-3]
+    elif content.startswith('```'):
+        content = content[3:-3]
+    return json.loads(content)
+
+
+def batch_prompt(instructions: str, blocks: List[str], item_format: str) -> str:
+    """
+    把多条输入合并为一个提示：共用的说明只出现一次，各条输入按编号列出，
+    要求模型按编号顺序返回 {"results": [...]}
+    """
+    items = '\n\n'.join(f'### 输入 {i}\n{block}' for i, block in enumerate(blocks, 1))
+    return f"""
+{instructions}
+## 批量输入
+以下共有 {len(blocks)} 条输入，请逐条独立处理，不要让各条之间互相影响。
+请以JSON格式返回，格式为：{{"results": [第1条的结果, 第2条的结果, ...]}}
+results 按输入编号排列，条数必须为 {len(blocks)}，每条结果的格式为：
+{item_format}
+
+{items}
+"""
+
+
+def parse_batch_results(response, count: int) -> List[Dict]:
+    """解析合并请求的结果；条数不符或格式不对时抛出 ValueError，由调用方改为逐条请求"""
+    results = parse_json_content(response.choices[0].message.content).get('results')
+    if not isinstance(results, list) or len(results) != count or not all(isinstance(r, dict) for r in results):
+        raise ValueError(f'批量结果格式不符，期望 {count} 条')
+    return results
+
+
+KEYWORDS_SYSTEM_PROMPT = "你是一个关键词提取助手，请准确提取用户查询中的关键词。"
+
+KEYWORDS_INSTRUCTIONS = """请从用户查询中提取关键词。用户查询是关于车辆电路图搜索的。
 
 要求：
 1. 移除"电路图"和"图"这两个词（因为太常见且数据中表达不一致）
@@ -24,56 +69,275 @@ class DeepSeekClient:
 
 示例：
 用户查询："东风天龙仪表电路图"
-输出：{{"keywords": ["东风", "天龙", "仪表"]}}
+输出：{"keywords": ["东风", "天龙", "仪表"]}
 
 用户查询："我要找三一SY215C9的液压电脑板"
-输出：{{"keywords": ["三一", "SY215C9", "液压", "电脑板"]}}
+输出：{"keywords": ["三一", "SY215C9", "液压", "电脑板"]}
 
 用户查询："供电模块相关图纸"
-输出：{{"keywords": ["供电", "模块"]}}
+输出：{"keywords": ["供电", "模块"]}
 
 用户查询："解放J6的整车电路图"
-输出：{{"keywords": ["解放", "J6", "整车"]}}
+输出：{"keywords": ["解放", "J6", "整车"]}
+"""
 
-现在请处理这个查询：
-用户查询："{user_query}"
+# 最终结果的文本模板（字段见 ResultView.render）
+FINAL_RESULT_SINGLE_TEMPLATE = (
+    "✅ **已为您找到精确匹配的电路图**\n\n"
+    "📄 **文档标题**：{filename}\n"
+    "🔢 **文档ID**：{id}\n"
+    "📁 **分类**：{path}"
+)
+FINAL_RESULT_ITEM_TEMPLATE = (
+    "**结果 {n}：**\n"
+    "📄 **文档标题**：{filename}\n"
+    "🔢 **文档ID**：{id}\n"
+    "📁 **分类**：{path}\n"
+)
+FINAL_RESULT_SEPARATOR = "────────────────────\n\n"
 
-请以JSON格式返回，格式为：{{"keywords": ["关键词1", "关键词2", ...]}}
-"""
+
+class DeepSeekClient:
+    def __init__(self):
+        openai.api_key = config.Config.LLM_API_KEY
+        openai.api_base = config.Config.LLM_BASE_URL
+        self.chat_model = config.Config.LLM_MODEL
+        self.reasoner_model = config.Config.LLM_REASONER_MODEL
+        # 并发上限、排队和熔断
+        self.gateway = LLMGateway([self.chat_model, self.reasoner_model])
+        # 批量检索等离线调用另有更小的并发上限，避免挤占对话的名额
+        self.offline_limiter = ModelLimiter(
+            config.Config.BATCH_SEARCH_LLM_MAX_IN_FLIGHT,
+            config.Config.BATCH_SEARCH_LLM_MAX_QUEUE,
+            config.Config.LLM_QUEUE_TIMEOUT
+        )
+        # 相同提示的并发调用只请求一次上游（进程内全局合并）
+        self._flight = SingleFlight('llm')
+        self._async_flight = AsyncSingleFlight('llm')
+        # 慢于该提示类型 p90 的调用再发一个相同请求（默认关闭）
+        self.hedger = Hedger()
+        # 同类提示在短窗口内合并为一次多条目请求（默认关闭）
+        self.batcher = MicroBatcher()
+        self.async_batcher = AsyncMicroBatcher()
+        # 问题设计提示中的结果概览压缩
+        self.compactor = PromptCompactor()
+        # 问题设计的分级路由
+        self.router = ModelRouter()
+    
+    def chat_completion(self, prompt_type: str, model: str, messages: List[Dict], **kwargs):
+        """
+        调用大模型对话接口，并记录按模型、提示类型划分的耗时和 token 用量
+        prompt_type: intent / keywords / fuzzy_correct / question_design
+        与进行中的相同提示（模型、消息和参数都相同）合并，共享同一个响应；
+        经网关限流和熔断，被拒绝时抛出 LLMUnavailable；
+        处于时间预算内时，等待时间不超过剩余预算，超出时抛出 DeadlineExceeded；
+        开启对冲时，慢于该提示类型 p90 的调用会再发一个相同请求，先返回者胜出
+        """
+        request_timeout = kwargs.pop('request_timeout', config.Config.LLM_REQUEST_TIMEOUT)
+        timeout = llm_timeout(request_timeout)
+        key = self._prompt_key(model, messages, kwargs)
+        try:
+            # 超时在执行时按执行者自己的预算计算：领头者预算用完后，跟随者以自己的预算重新执行
+            return self._flight.do(
+                key, lambda: self._create(prompt_type, model, messages, llm_timeout(request_timeout), **kwargs),
+                timeout=timeout)
+        except TimeoutError as e:
+            raise DeadlineExceeded('等待进行中的相同调用超出剩余预算') from e
+    
+    async def chat_completion_async(self, prompt_type: str, model: str, messages: List[Dict], **kwargs):
+        """chat_completion 的异步版本，等待上游响应期间不占用线程"""
+        request_timeout = kwargs.pop('request_timeout', config.Config.LLM_REQUEST_TIMEOUT)
+        timeout = llm_timeout(request_timeout)
+        key = self._prompt_key(model, messages, kwargs)
+        try:
+            return await self._async_flight.do(
+                key, lambda: self._acreate(prompt_type, model, messages, llm_timeout(request_timeout), **kwargs),
+                timeout=timeout)
+        except TimeoutError as e:
+            raise DeadlineExceeded('等待进行中的相同调用超出剩余预算') from e
+    
+    @staticmethod
+    def _prompt_key(model: str, messages: List[Dict], params: Dict) -> str:
+        payload = json.dumps([model, messages, params], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+    
+    def _create(self, prompt_type: str, model: str, messages: List[Dict], timeout: float, **kwargs):
+        return self.hedger.call(
+            prompt_type, lambda t: self._attempt(prompt_type, model, messages, t, **kwargs), timeout)
+    
+    async def _acreate(self, prompt_type: str, model: str, messages: List[Dict], timeout: float, **kwargs):
+        return await self.hedger.call_async(
+            prompt_type, lambda t: self._attempt_async(prompt_type, model, messages, t, **kwargs), timeout)
+    
+    def _attempt(self, prompt_type: str, model: str, messages: List[Dict], timeout: float, **kwargs):
+        """经网关发出一次请求"""
+        sent = False
+        try:
+            with self.gateway.slot(model, wait_timeout=timeout):
+                sent = True
+                start = time.perf_counter()
+                try:
+                    response = openai.ChatCompletion.create(
+                        model=model, messages=messages, request_timeout=timeout, **kwargs)
+                except Exception as e:
+                    self._raise_call_error(e, prompt_type, model)
+                finally:
+                    LLM_LATENCY.observe(time.perf_counter() - start, model=model, prompt=prompt_type)
+                self.hedger.observe(prompt_type, time.perf_counter() - start)
+        except LLMUnavailable:
+            if not sent:
+                LLM_REQUESTS.inc(model=model, prompt=prompt_type, status='rejected')
+            raise
         
+        self._record_usage(prompt_type, model, response)
+        return response
+    
+    async def _attempt_async(self, prompt_type: str, model: str, messages: List[Dict], timeout: float, **kwargs):
+        sent = False
         try:
-            response = openai.ChatCompletion.create(
-                model=self.chat_model,
-                messages=[
-                    {"role": "system", "content": "你是一个关键词提取助手，请准确提取用户查询中的关键词。"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
-                max_tokens=500
-            )
-            
-            content = response.choices[0].message.content.strip()
-            
-            # 清理JSON
-            if content.startswith('```json'):
-                content = content[7:-3]
-            elif content.startswith('```'):
-                content = content[3:-3]
-            
-            result = json.loads(content)
-            keywords = result.get('keywords', [])
-            
-            # 确保都是字符串且非空
-            keywords = [str(kw).strip() for kw in keywords if str(kw).strip()]
-            
-            print(f"提取到的关键词（已移除'电路图'和'图'）: {keywords}")
-            return keywords
+            async with self.gateway.slot_async(model, wait_timeout=timeout):
+                sent = True
+                start = time.perf_counter()
+                try:
+                    response = await openai.ChatCompletion.acreate(
+                        model=model, messages=messages, request_timeout=timeout, **kwargs)
+                except Exception as e:
+                    self._raise_call_error(e, prompt_type, model)
+                finally:
+                    LLM_LATENCY.observe(time.perf_counter() - start, model=model, prompt=prompt_type)
+                self.hedger.observe(prompt_type, time.perf_counter() - start)
+        except LLMUnavailable:
+            if not sent:
+                LLM_REQUESTS.inc(model=model, prompt=prompt_type, status='rejected')
+            raise
+        
+        self._record_usage(prompt_type, model, response)
+        return response
+    
+    def _raise_call_error(self, error: Exception, prompt_type: str, model: str):
+        """记录失败的调用；因本轮时间预算而超时的调用转为 DeadlineExceeded"""
+        if isinstance(error, openai.error.Timeout) and current_deadline() is not None:
+            LLM_REQUESTS.inc(model=model, prompt=prompt_type, status='timeout')
+            exceeded = DeadlineExceeded('大模型调用超出剩余预算')
+            # 请求已经发出，网关按失败的调用计入熔断统计
+            exceeded.upstream_timeout = True
+            raise exceeded from error
+        LLM_REQUESTS.inc(model=model, prompt=prompt_type, status='error')
+        raise error
+    
+    def _record_usage(self, prompt_type: str, model: str, response):
+        """记录成功请求数和 token 用量"""
+        LLM_REQUESTS.inc(model=model, prompt=prompt_type, status='ok')
+        usage = response.get('usage') or {}
+        for kind in ('prompt_tokens', 'completion_tokens'):
+            if usage.get(kind):
+                LLM_TOKENS.inc(usage[kind], model=model, prompt=prompt_type, kind=kind)
+    
+    def extract_keywords(self, user_query: str) -> List[str]:
+        """
+        使用大模型分词，提取关键词（移除'电路图'和'图'）
+        网关拒绝调用时抛出 LLMUnavailable，由调用方改用本地提取；
+        开启微批处理时，同一时刻的多个查询合并为一次请求
+        """
+        try:
+            with span('keyword_llm'):
+                return self.batcher.run(
+                    'keywords', user_query, self._extract_keywords_one, self._extract_keywords_many)
             
+        except LLMUnavailable:
+            raise
         except Exception as e:
-            print(f"大模型分词失败: {e}")
+            logger.warning("大模型分词失败: %s", e)
             # 不进行降级，返回空列表
             return []
     
+    def extract_keywords_offline(self, user_query: str) -> List[str]:
+        """离线调用（批量检索）的 extract_keywords：先占用离线名额，名额排满时抛出 LLMUnavailable"""
+        self.offline_limiter.acquire()
+        try:
+            return self.extract_keywords(user_query)
+        finally:
+            self.offline_limiter.release()
+    
+    async def extract_keywords_async(self, user_query: str) -> List[str]:
+        """extract_keywords 的异步版本"""
+        try:
+            with span('keyword_llm'):
+                return await self.async_batcher.run(
+                    'keywords', user_query, self._extract_keywords_one_async, self._extract_keywords_many_async)
+            
+        except LLMUnavailable:
+            raise
+        except Exception as e:
+            logger.warning("大模型分词失败: %s", e)
+            return []
+    
+    def _extract_keywords_one(self, user_query: str) -> List[str]:
+        response = self.chat_completion(
+            'keywords', self.chat_model, self._keywords_messages(user_query),
+            temperature=0.1,
+            max_tokens=500
+        )
+        return self._parse_keywords(parse_json_content(response.choices[0].message.content))
+    
+    async def _extract_keywords_one_async(self, user_query: str) -> List[str]:
+        response = await self.chat_completion_async(
+            'keywords', self.chat_model, self._keywords_messages(user_query),
+            temperature=0.1,
+            max_tokens=500
+        )
+        return self._parse_keywords(parse_json_content(response.choices[0].message.content))
+    
+    def _extract_keywords_many(self, queries: List[str]) -> List[List[str]]:
+        response = self.chat_completion(
+            'keywords_batch', self.chat_model, self._keywords_batch_messages(queries),
+            temperature=0.1,
+            max_tokens=500 * len(queries)
+        )
+        return [self._parse_keywords(result) for result in parse_batch_results(response, len(queries))]
+    
+    async def _extract_keywords_many_async(self, queries: List[str]) -> List[List[str]]:
+        response = await self.chat_completion_async(
+            'keywords_batch', self.chat_model, self._keywords_batch_messages(queries),
+            temperature=0.1,
+            max_tokens=500 * len(queries)
+        )
+        return [self._parse_keywords(result) for result in parse_batch_results(response, len(queries))]
+    
+    def _keywords_messages(self, user_query: str) -> List[Dict]:
+        """构建关键词提取的提示"""
+        prompt = f"""
+{KEYWORDS_INSTRUCTIONS}
+现在请处理这个查询：
+用户查询："{user_query}"
+
+请以JSON格式返回，格式为：{{"keywords": ["关键词1", "关键词2", ...]}}
+"""
+        
+        return [
+            {"role": "system", "content": KEYWORDS_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _keywords_batch_messages(self, queries: List[str]) -> List[Dict]:
+        """构建多个查询合并的关键词提取提示，说明和示例只发送一次"""
+        blocks = [f'用户查询："{query}"' for query in queries]
+        return [
+            {"role": "system", "content": KEYWORDS_SYSTEM_PROMPT},
+            {"role": "user", "content": batch_prompt(
+                KEYWORDS_INSTRUCTIONS, blocks, '{"keywords": ["关键词1", "关键词2", ...]}')}
+        ]
+    
+    def _parse_keywords(self, result: Dict) -> List[str]:
+        """解析关键词提取结果"""
+        keywords = result.get('keywords', [])
+        
+        # 确保都是字符串且非空
+        keywords = [str(kw).strip() for kw in keywords if str(kw).strip()]
+        
+        logger.info("提取到的关键词（已移除'电路图'和'图'）: %s", keywords)
+        return keywords
+    
     def fuzzy_correct_query(self, user_query: str) -> Dict[str, Any]:
         """使用大模型对用户输入进行模糊匹配修正"""
         prompt = f"""
@@ -131,29 +395,22 @@ class DeepSeekClient:
 """
         
         try:
-            response = openai.ChatCompletion.create(
-                model=self.chat_model,
-                messages=[
-                    {"role": "system", "content": "你是一个车辆电路图搜索专家，擅长识别和修正不规范的查询表述。"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
-                max_tokens=800
-            )
-            
-            content = response.choices[0].message.content.strip()
+            with span('fuzzy_correct_llm'):
+                response = self.chat_completion(
+                    'fuzzy_correct',
+                    self.chat_model,
+                    [
+                        {"role": "system", "content": "你是一个车辆电路图搜索专家，擅长识别和修正不规范的查询表述。"},
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=0.1,
+                    max_tokens=800
+                )
             
-            # 清理JSON
-            if content.startswith('```json'):
-                content = content[7:-3]
-            elif content.startswith('```'):
-                content = content[3:-3]
-            
-            result = json.loads(content)
-            return result
+            return parse_json_content(response.choices[0].message.content)
             
         except Exception as e:
-            print(f"模糊匹配修正失败: {e}")
+            logger.warning("模糊匹配修正失败: %s", e)
             # 返回原始查询作为备选
             return {
                 "original_query": user_query,
@@ -164,24 +421,82 @@ class DeepSeekClient:
     
     def design_question_from_results(self, 
                                    user_query: str, 
-                                   results: List[Dict],
+                                   results: Union[ResultView, List[Dict]],
                                    previous_questions: List[Dict] = None) -> Dict:
-        """根据搜索结果设计选择题 - 使用reasoner模型进行推理"""
+        """
+        根据全部搜索结果设计选择题，选项应切分整个结果集
+        先按结果集的聚合统计评估歧义程度并路由：能按某层路径干净切分时本地出题，歧义较小时用对话模型，其余用推理模型
+        results 为本轮的结果视图（统计和概览直接读取它的列），也接受记录列表
+        """
+        if isinstance(results, list):
+            results = ResultView.from_records(results)
+        facets = ResultFacets(results)
+        route = self.router.route(facets)
+        if route.tier == 'local':
+            # 本地出题的选项是干净切分结果的路径段，原样使用（清理或截断会破坏各值只命中自己一组的保证）
+            return self._routed_question(route.question, route)
         
-        # 准备结果信息
-        results_info = []
-        for result in results:
-            results_info.append({
-                'ID': result['ID'],
-                '层级路径': result['层级路径'],
-                '关联文件名称': result['关联文件名称']
-            })
+        messages, extracted_options = self._question_design_messages(user_query, results, facets)
         
-        # 分析当前批次结果的特征
-        batch_count = len(results)
+        try:
+            with span('question_design_llm'):
+                response = self.chat_completion(
+                    'question_design', self._route_model(route), messages,
+                    temperature=0.1,
+                    max_tokens=1500
+                )
+            return self._routed_question(self._parse_question_design(response, results), route)
+            
+        except Exception as e:
+            logger.warning("大模型设计问题失败: %s", e)
+            # 使用提取的选项作为备选
+            return self._routed_question(self._fallback_question(len(results), extracted_options), route, 'fallback')
+    
+    async def design_question_from_results_async(self,
+                                                 user_query: str,
+                                                 results: Union[ResultView, List[Dict]],
+                                                 previous_questions: List[Dict] = None) -> Dict:
+        """design_question_from_results 的异步版本；统计、提示构建和选项校验在线程中执行，不阻塞事件循环"""
+        if isinstance(results, list):
+            results = ResultView.from_records(results)
+        facets = await asyncio.to_thread(ResultFacets, results)
+        route = await asyncio.to_thread(self.router.route, facets)
+        if route.tier == 'local':
+            return self._routed_question(route.question, route)
         
-        # 从结果中提取可能的选项
-        extracted_options = self._extract_potential_options(results)
+        messages, extracted_options = await asyncio.to_thread(
+            self._question_design_messages, user_query, results, facets)
+        
+        try:
+            with span('question_design_llm'):
+                response = await self.chat_completion_async(
+                    'question_design', self._route_model(route), messages,
+                    temperature=0.1,
+                    max_tokens=1500
+                )
+            question = await asyncio.to_thread(self._parse_question_design, response, results)
+            return self._routed_question(question, route)
+            
+        except Exception as e:
+            logger.warning("大模型设计问题失败: %s", e)
+            return self._routed_question(self._fallback_question(len(results), extracted_options), route, 'fallback')
+    
+    def _route_model(self, route: RouteDecision) -> str:
+        return self.chat_model if route.tier == 'chat' else self.reasoner_model
+    
+    @staticmethod
+    def _routed_question(question: Dict, route: RouteDecision, tier: str = None) -> Dict:
+        """在问题上记录路由决定（实际出题方式），供后续统计用户是否需要返回上一步"""
+        question['route'] = dict(route.to_dict(), tier=tier or route.tier)
+        return question
+    
+    def _question_design_messages(self, user_query: str, results: ResultView, facets: ResultFacets):
+        """构建问题设计的提示，同时返回从统计中得到的潜在选项"""
+        # 按层级路径归并的结果概览，不超过 token 预算
+        results_overview = self.compactor.compact(results)
+        
+        # 按结果数排序的潜在选项
+        extracted_options = facets.potential_options()
         
         prompt = f"""
 # 车辆电路图搜索问题设计
@@ -189,17 +504,22 @@ class DeepSeekClient:
 ## 用户查询分析
 用户查询："{user_query}"
 
-## 当前批次结果分析
-正在分析 {batch_count} 个结果，设计问题帮助用户进一步筛选。
+## 全部结果的统计
+共 {facets.total} 个结果，设计问题帮助用户进一步筛选。括号内为结果数：
+{facets.summary()}
 
-## 结果样本
-{json.dumps(results_info, ensure_ascii=False, indent=2)}
+## 结果概览
+（按层级路径归并：缩进表示下一级路径，括号内为该路径下的结果数；
+文件名以 · 开头，省略了扩展名和与所在路径重复的部分，主干相同的文件合并为一行，【】内列出各文件的标签；
+路径没有可归并的部分时逐行列出“层级路径 · 文件名”）
+{results_overview}
 
 ## 提取的潜在选项（基于实际数据）
-{json.dumps(extracted_options, ensure_ascii=False, indent=2)}
+{json.dumps(extracted_options, ensure_ascii=False)}
 
 ## 设计任务
 请设计一个选择题来帮助用户缩小范围。请基于实际数据设计具体的、可筛选的选项。
+选项要切分全部结果：各选项对应的结果数尽量均衡（每个最好不超过总数的一半），不被任何选项命中的结果会归入“其他”选项。
 
 ### 关键要求：
 1. **选项必须具体**：每个选项应该是用户可以直接选择的具体值，而不是描述性语言
@@ -220,7 +540,7 @@ class DeepSeekClient:
 
 ### 输出格式：
 {{
-    "analysis": "对当前批次结果的分析，说明设计问题的依据",
+    "analysis": "对全部结果的分析，说明设计问题的依据",
     "question": "给用户的清晰问题",
     "options": ["具体选项1", "具体选项2", "具体选项3"],
     "filter_field": "关联文件名称",  // 或"层级路径"
@@ -231,95 +551,30 @@ class DeepSeekClient:
 现在请根据上面的分析设计问题：
 """
         
-        try:
-            response = openai.ChatCompletion.create(
-                model=self.reasoner_model,
-                messages=[
-                    {"role": "system", "content": "你是一个专业的电路图搜索助手，擅长通过数据分析设计有效的问题。"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
-                max_tokens=1500
-            )
-            
-            content = response.choices[0].message.content.strip()
-            
-            # 清理JSON
-            if content.startswith('```json'):
-                content = content[7:-3]
-            elif content.startswith('```'):
-                content = content[3:-3]
-            
-            result = json.loads(content)
-            
-            # 验证并优化选项
-            validated_result = self._validate_and_optimize_options(result, results)
-            return validated_result
-            
-        except Exception as e:
-            print(f"推理模型设计问题失败: {e}")
-            # 使用提取的选项作为备选
-            return {
-                "analysis": f"分析了当前 {batch_count} 个结果，发现以下特征：",
-                "question": "请选择您需要的文档类型：",
-                "options": extracted_options.get('filename_keywords', ['仪表电路图', '针脚定义'])[:5],
-                "filter_field": "关联文件名称",
-                "filter_logic": "包含",
-                "design_reasoning": "基于文件名关键词提取"
-            }
-    
-    def _extract_potential_options(self, results: List[Dict]) -> Dict:
-        """从结果中提取潜在的选项"""
-        if not results:
-            return {"filename_keywords": [], "path_keywords": []}
-        
-        filename_keywords = set()
-        path_keywords = set()
-        
-        # 常见的关键词模式
-        common_patterns = [
-            r'【([^】]+)】',  # 方括号内的内容
-            r'\[([^\]]+)\]',  # 方括号内的内容
-            r'\(([^)]+)\)',  # 圆括号内的内容
-        ]
-        
-        # 常见的关键词
-        common_keywords = [
-            '仪表电路图', '针脚定义', '原理图', '接线图', '电路原理',
-            '整车', '仪表', '发动机', '底盘', '电气', 'ECU', 'BCM', 'VECU',
-            '保险丝', '继电器', '传感器', '东风', '天龙', '三一', '徐工', '红岩'
+        messages = [
+            {"role": "system", "content": "你是一个专业的电路图搜索助手，擅长通过数据分析设计有效的问题。"},
+            {"role": "user", "content": prompt}
         ]
-        
-        for result in results:
-            # 从文件名中提取
-            filename = result['关联文件名称']
-            
-            # 提取模式匹配的内容
-            for pattern in common_patterns:
-                matches = re.findall(pattern, filename)
-                for match in matches:
-                    if match and len(match) >= 2:
-                        filename_keywords.add(match)
-            
-            # 检查常见关键词
-            for keyword in common_keywords:
-                if keyword in filename:
-                    filename_keywords.add(keyword)
-            
-            # 从层级路径中提取
-            path = result['层级路径']
-            path_parts = path.split('->')
-            for part in path_parts:
-                part = part.strip()
-                if part and len(part) > 1 and part not in ['电路图', '整车', '资料']:
-                    path_keywords.add(part)
-        
+        return messages, extracted_options
+    
+    def _parse_question_design(self, response, results: ResultView) -> Dict:
+        """解析问题设计结果，并验证优化选项"""
+        result = parse_json_content(response.choices[0].message.content)
+        return self._validate_and_optimize_options(result, results)
+    
+    def _fallback_question(self, result_count: int, extracted_options: Dict) -> Dict:
+        """推理模型不可用时，用提取的选项构造问题"""
+        mark_degraded('question_design')
         return {
-            "filename_keywords": list(filename_keywords)[:10],  # 限制数量
-            "path_keywords": list(path_keywords)[:10]
+            "analysis": f"分析了全部 {result_count} 个结果，发现以下特征：",
+            "question": "请选择您需要的文档类型：",
+            "options": extracted_options.get('filename_keywords', ['仪表电路图', '针脚定义'])[:5],
+            "filter_field": "关联文件名称",
+            "filter_logic": "包含",
+            "design_reasoning": "基于文件名关键词提取"
         }
     
-    def _validate_and_optimize_options(self, question_data: Dict, results: List[Dict]) -> Dict:
+    def _validate_and_optimize_options(self, question_data: Dict, results: ResultView) -> Dict:
         """验证并优化选项，确保每个选项都能在结果中找到"""
         options = question_data.get('options', [])
         filter_field = question_data.get('filter_field', '关联文件名称')
@@ -352,13 +607,13 @@ class DeepSeekClient:
             cleaned_options = options
         
         # 验证每个选项是否能在结果中找到
+        field_values = [str(value) for value in results.column(filter_field)]
         valid_options = []
         for option in cleaned_options:
             found = False
             
             # 首先尝试精确匹配
-            for result in results:
-                field_value = str(result[filter_field])
+            for field_value in field_values:
                 if filter_logic == "包含" and option in field_value:
                     found = True
                     break
@@ -371,8 +626,7 @@ class DeepSeekClient:
                 # 尝试将选项拆分为关键词
                 keywords = re.findall(r'[\u4e00-\u9fffA-Za-z0-9]{2,}', option)
                 for keyword in keywords:
-                    for result in results:
-                        field_value = str(result[filter_field])
+                    for field_value in field_values:
                         if keyword in field_value:
                             found = True
                             valid_options.append(keyword)  # 使用关键词作为选项
@@ -387,10 +641,9 @@ class DeepSeekClient:
         # 如果有效选项不足，从结果中提取
         if len(valid_options) < 2:
             # 从文件名中提取常见关键词
-            for result in results:
-                filename = result['关联文件名称']
+            for filename in results.filenames:
                 # 提取长度2-6的中文词
-                chinese_words = re.findall(r'[\u4e00-\u9fff]{2,6}', filename)
+                chinese_words = re.findall(r'[\u4e00-\u9fff]{2,6}', str(filename))
                 for word in chinese_words:
                     if word not in valid_options and len(word) >= 2:
                         valid_options.append(word)
@@ -409,31 +662,18 @@ class DeepSeekClient:
         
         return question_data
     
-    def format_final_results(self, results: List[Dict], query: str) -> str:
-        """格式化最终结果"""
+    def format_final_results(self, results: Union[ResultView, List[Dict]], query: str) -> str:
+        """格式化最终结果（results 为本轮的结果视图，也接受记录列表）"""
+        if isinstance(results, list):
+            results = ResultView.from_records(results)
         if not results:
             return "抱歉，没有找到相关的电路图。请尝试更换关键词重新搜索。"
         
         if len(results) == 1:
-            result = results[0]
-            return (
-                f"✅ **已为您找到精确匹配的电路图**\n\n"
-                f"📄 **文档标题**：{result['关联文件名称']}\n"
-                f"🔢 **文档ID**：{result['ID']}\n"
-                f"📁 **分类**：{result['层级路径']}"
-            )
-        else:
-            formatted = f"✅ **为您找到 {len(results)} 个相关结果**\n\n"
-            
-            for i, result in enumerate(results, 1):
-                formatted += f"**结果 {i}：**\n"
-                formatted += f"📄 **文档标题**：{result['关联文件名称']}\n"
-                formatted += f"🔢 **文档ID**：{result['ID']}\n"
-                formatted += f"📁 **分类**：{result['层级路径']}\n"
-                
-                if i < len(results):
-                    formatted += f"────────────────────\n\n"
-                else:
-                    formatted += "\n"
-            
-            return formatted
\ No newline at end of file
+            return results.render(FINAL_RESULT_SINGLE_TEMPLATE)
+        
+        return (
+            f"✅ **为您找到 {len(results)} 个相关结果**\n\n"
+            + results.render(FINAL_RESULT_ITEM_TEMPLATE, FINAL_RESULT_SEPARATOR)
+            + "\n"
+        )
\ No newline at end of file
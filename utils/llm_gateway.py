@@ -0,0 +1,326 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from typing import Dict, List, Optional
+
+import config
+
+
+class LLMUnavailable(Exception):
+    """
+    网关拒绝了调用（熔断打开或等待队列已满），调用方应改走本地路径
+    upstream_timeout 为真表示请求已经发出，只是上游没能在调用方给定的时间内响应（被时间预算截断）
+    """
+    upstream_timeout = False
+
+
+def slow_call_seconds(reasoner: bool = False) -> float:
+    """
+    熔断使用的慢调用阈值：配置值与单轮预算内大模型可用时长的一定比例取小；
+    对话轮次不限时（CHAT_TURN_BUDGET 为 0）时直接使用配置值
+    """
+    configured = config.Config.LLM_REASONER_SLOW_CALL_SECONDS if reasoner else config.Config.LLM_SLOW_CALL_SECONDS
+    if not config.Config.CHAT_TURN_BUDGET:
+        return configured
+
+    available = config.Config.CHAT_TURN_BUDGET - config.Config.CHAT_BUDGET_RESERVE
+    if available < config.Config.LLM_MIN_CALL_SECONDS:
+        raise ValueError(
+            f'CHAT_TURN_BUDGET（{config.Config.CHAT_TURN_BUDGET}s）扣除 CHAT_BUDGET_RESERVE'
+            f'（{config.Config.CHAT_BUDGET_RESERVE}s）后不足一次大模型调用的最短时长'
+        )
+    return min(configured, available * config.Config.LLM_SLOW_CALL_BUDGET_SHARE)
+
+
+class _Waiter:
+    """等待并发名额的调用者；名额由释放者在锁内直接转交"""
+
+    def __init__(self, loop=None):
+        self.granted = False
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class ModelLimiter:
+    """
+    单个模型的并发上限和有界等待队列
+    名额用尽时调用者排队等待（线程和协程共用同一个队列，先到先得），
+    队列已满或等待超时则立即拒绝，避免请求在上游变慢时无限堆积
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int, queue_timeout: float):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _try_acquire(self, waiter_factory):
+        """有空闲名额时返回 None，否则登记并返回等待者；队列已满时拒绝"""
+        with self._lock:
+            if self.in_flight < self.max_in_flight and not self._waiters:
+                self.in_flight += 1
+                return None
+            if len(self._waiters) >= self.max_queue:
+                raise LLMUnavailable('等待队列已满')
+            waiter = waiter_factory()
+            self._waiters.append(waiter)
+            return waiter
+
+    def _abandon(self, waiter: _Waiter):
+        """等待超时或被取消：离开队列；若名额恰好已转交过来则归还给下一位"""
+        with self._lock:
+            if not waiter.granted:
+                self._waiters.remove(waiter)
+                return
+        self.release()
+
+    def _wait_timeout(self, timeout: Optional[float]) -> float:
+        return self.queue_timeout if timeout is None else min(self.queue_timeout, timeout)
+
+    def acquire(self, timeout: Optional[float] = None):
+        """timeout：调用方自身还能等待的秒数，与队列等待上限取小"""
+        waiter = self._try_acquire(_Waiter)
+        if waiter is None:
+            return
+        if not waiter.event.wait(self._wait_timeout(timeout)):
+            self._abandon(waiter)
+            raise LLMUnavailable('排队等待超时')
+
+    async def acquire_async(self, timeout: Optional[float] = None):
+        loop = asyncio.get_running_loop()
+        waiter = self._try_acquire(lambda: _Waiter(loop))
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self._wait_timeout(timeout))
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            raise LLMUnavailable('排队等待超时')
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                # 名额直接转交给队首，in_flight 不变
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.wake()
+            else:
+                self.in_flight -= 1
+
+
+class CircuitBreaker:
+    """
+    按最近若干次调用的错误率和慢调用比例熔断
+    - closed：正常放行，窗口内调用数达到下限且错误率或慢调用比例超过阈值时打开
+    - open：直接拒绝，冷却时间过后进入 half_open
+    - half_open：只放行一个探测调用，成功则关闭，失败则重新打开
+    """
+
+    def __init__(self, window: int, min_calls: int, error_rate: float,
+                 slow_call_seconds: float, slow_call_rate: float, open_seconds: float):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self._calls = deque(maxlen=window)  # (成功, 耗时)
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < self.open_seconds:
+                    return False
+                self.state = 'half_open'
+                self._probe_in_flight = False
+            if self.state == 'half_open':
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def record(self, success: bool, latency: float):
+        with self._lock:
+            if self.state == 'half_open':
+                self._probe_in_flight = False
+                if success and latency < self.slow_call_seconds:
+                    self.state = 'closed'
+                    self._calls.clear()
+                else:
+                    self._open()
+                return
+
+            self._calls.append((success, latency))
+            if self.state == 'closed' and len(self._calls) >= self.min_calls:
+                errors, slow = self._rates()
+                if errors >= self.error_rate or slow >= self.slow_call_rate:
+                    self._open()
+
+    def release_probe(self):
+        """探测调用未能发出（如排队被拒），让出探测名额"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _open(self):
+        self.state = 'open'
+        self.opened_at = time.monotonic()
+
+    def _rates(self):
+        total = len(self._calls)
+        if not total:
+            return 0.0, 0.0
+        errors = sum(1 for success, _ in self._calls if not success)
+        slow = sum(1 for _, latency in self._calls if latency >= self.slow_call_seconds)
+        return errors / total, slow / total
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            errors, slow = self._rates()
+            return {
+                'state': self.state,
+                'recent_calls': len(self._calls),
+                'error_rate': round(errors, 3),
+                'slow_call_rate': round(slow, 3)
+            }
+
+
+class LLMGateway:
+    """
+    所有大模型调用的入口：每个模型一个并发限制器和一个熔断器
+    推理模型耗时长，并发上限和慢调用阈值单独配置
+    """
+
+    def __init__(self, models: List[str] = ()):
+        self._limiters: Dict[str, ModelLimiter] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        # 预先创建已知模型，状态接口从启动起就能列出它们
+        for model in models:
+            self._model_parts(model)
+
+    def _model_parts(self, model: str):
+        with self._lock:
+            if model not in self._limiters:
+                reasoner = model == config.Config.LLM_REASONER_MODEL
+                self._limiters[model] = ModelLimiter(
+                    config.Config.LLM_REASONER_MAX_IN_FLIGHT if reasoner else config.Config.LLM_MAX_IN_FLIGHT,
+                    config.Config.LLM_MAX_QUEUE,
+                    config.Config.LLM_QUEUE_TIMEOUT
+                )
+                self._breakers[model] = CircuitBreaker(
+                    config.Config.LLM_BREAKER_WINDOW,
+                    config.Config.LLM_BREAKER_MIN_CALLS,
+                    config.Config.LLM_BREAKER_ERROR_RATE,
+                    slow_call_seconds(reasoner),
+                    config.Config.LLM_BREAKER_SLOW_CALL_RATE,
+                    config.Config.LLM_BREAKER_OPEN_SECONDS
+                )
+            return self._limiters[model], self._breakers[model]
+
+    @contextmanager
+    def slot(self, model: str, wait_timeout: Optional[float] = None):
+        """
+        占用一个调用名额；熔断打开或排队失败时抛出 LLMUnavailable
+        请求已发出但被时间预算截断（块内抛出 upstream_timeout 的 LLMUnavailable）按失败计入熔断统计，
+        上游停滞时即使每次调用都被预算截断，熔断也能打开；没有发出请求就放弃的调用不计入
+        """
+        limiter, breaker = self._model_parts(model)
+        if not breaker.allow():
+            raise LLMUnavailable(f'{model} 已熔断')
+        try:
+            limiter.acquire(wait_timeout)
+        except BaseException:
+            breaker.release_probe()
+            raise
+        start = time.perf_counter()
+        try:
+            yield
+        except LLMUnavailable as e:
+            self._settle_unavailable(breaker, e, time.perf_counter() - start)
+            raise
+        except Exception:
+            breaker.record(False, time.perf_counter() - start)
+            raise
+        else:
+            breaker.record(True, time.perf_counter() - start)
+        finally:
+            limiter.release()
+
+    @asynccontextmanager
+    async def slot_async(self, model: str, wait_timeout: Optional[float] = None):
+        """slot 的异步版本"""
+        limiter, breaker = self._model_parts(model)
+        if not breaker.allow():
+            raise LLMUnavailable(f'{model} 已熔断')
+        try:
+            await limiter.acquire_async(wait_timeout)
+        except BaseException:
+            breaker.release_probe()
+            raise
+        start = time.perf_counter()
+        try:
+            yield
+        except LLMUnavailable as e:
+            self._settle_unavailable(breaker, e, time.perf_counter() - start)
+            raise
+        except asyncio.CancelledError:
+            # 被取消的调用（如对冲中落败的请求）不计入熔断统计
+            breaker.release_probe()
+            raise
+        except Exception:
+            breaker.record(False, time.perf_counter() - start)
+            raise
+        else:
+            breaker.record(True, time.perf_counter() - start)
+        finally:
+            limiter.release()
+
+    @staticmethod
+    def _settle_unavailable(breaker: CircuitBreaker, error: LLMUnavailable, elapsed: float):
+        """块内抛出 LLMUnavailable：被预算截断的已发出请求按失败计入，其余只让出探测名额"""
+        if error.upstream_timeout:
+            breaker.record(False, elapsed)
+        else:
+            breaker.release_probe()
+
+    def status(self) -> Dict:
+        """各模型的熔断状态、并发和排队数"""
+        with self._lock:
+            models = list(self._limiters)
+        status = {}
+        for model in models:
+            limiter, breaker = self._model_parts(model)
+            status[model] = dict(
+                breaker.snapshot(),
+                in_flight=limiter.in_flight,
+                max_in_flight=limiter.max_in_flight,
+                queued=limiter.queued
+            )
+        return status
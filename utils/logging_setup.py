@@ -0,0 +1,87 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from datetime import datetime
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出一行 JSON，便于日志平台按字段检索"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SnapshotQueueHandler(logging.handlers.QueueHandler):
+    """
+    只在调用线程中把参数合并进消息（参数对象之后可能被改动），
+    时间戳、异常堆栈等格式化都留给监听线程中的写出 handler；
+    标准库的 prepare 会在调用线程中格式化异常堆栈并清掉 exc_info，JSON 日志就拿不到单独的 exc_info 字段
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup_logging(level: str = 'INFO', log_format: str = 'text'):
+    """
+    配置进程日志：请求线程只合并消息参数并把日志记录放入内存队列，
+    由后台 QueueListener 线程负责格式化时间戳、异常堆栈等并写入 stdout。
+    低于 level 的日志在调用处直接丢弃，参数不会被格式化。
+    重复调用只生效一次。
+    """
+    if _listener is not None:
+        return
+
+    if log_format == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s')
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+
+    logging.getLogger().setLevel(getattr(logging, str(level).upper(), logging.INFO))
+    _start_listener(stream_handler)
+    # fork 出的子进程（gunicorn 预加载模式的 worker 等）里没有父进程的监听线程，需要重新启动
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def _start_listener(*handlers: logging.Handler):
+    """新建日志队列和写出线程，根 logger 只向队列投递"""
+    global _listener
+    log_queue = queue.SimpleQueue()
+    logging.getLogger().handlers = [SnapshotQueueHandler(log_queue)]
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    # 进程退出前把队列中剩余的日志写完
+    atexit.register(_listener.stop)
+
+
+def _restart_after_fork():
+    """
+    子进程中换用新的队列和监听线程：父进程的队列可能正被其监听线程持有，
+    沿用会让子进程的日志堆积在队列中不被写出
+    """
+    if _listener is not None:
+        atexit.unregister(_listener.stop)
+        _start_listener(*_listener.handlers)
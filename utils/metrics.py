@@ -0,0 +1,210 @@
+import bisect
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+# 默认耗时分桶（秒），覆盖从毫秒级检索到数十秒的推理模型调用
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape_label_value(value) -> str:
+    """按 Prometheus 文本格式转义标签值"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """单调递增计数器"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(self.label_names, key)} {_format_number(value)}')
+        return lines
+
+
+class Histogram:
+    """累积分桶直方图，记录观测值分布、总和与次数"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 -> [各桶计数..., 总和, 次数]
+        self._series: Dict[Tuple, List[float]] = {}
+        self._lock = threading.Lock()
+        # 原始观测值的订阅者（基准测试用来计算精确分位数），默认为空
+        self._observers: List[Callable] = []
+
+    def add_observer(self, callback: Callable):
+        """订阅每一次观测：callback(value, labels)"""
+        self._observers.append(callback)
+
+    def remove_observer(self, callback: Callable):
+        self._observers.remove(callback)
+
+    def observe(self, value: float, **labels):
+        for callback in self._observers:
+            callback(value, labels)
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        bucket_index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if bucket_index < len(self.buckets):
+                series[bucket_index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def collect(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, f'le="{_format_number(float(bound))}"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f'{self.name}_bucket{labels} {series[-1]}')
+            lines.append(f'{self.name}_sum{_format_labels(self.label_names, key)} {_format_number(series[-2])}')
+            lines.append(f'{self.name}_count{_format_labels(self.label_names, key)} {series[-1]}')
+        return lines
+
+
+class MetricsRegistry:
+    """进程内指标注册表（每个 gunicorn worker 各自一份）"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help_text, label_names)
+
+    def histogram(self, name: str, help_text: str, label_names: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, label_names, buckets)
+
+    def _get_or_create(self, metric_class, name, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, *args)
+            return metric
+
+    def render(self) -> str:
+        """输出 Prometheus 文本格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+STAGE_LATENCY = registry.histogram(
+    'circuit_stage_duration_seconds', '对话流水线各阶段耗时（秒）', ('stage',))
+LLM_LATENCY = registry.histogram(
+    'circuit_llm_request_duration_seconds', '大模型调用耗时（秒）', ('model', 'prompt'))
+LLM_REQUESTS = registry.counter(
+    'circuit_llm_requests_total', '大模型调用次数', ('model', 'prompt', 'status'))
+LLM_TOKENS = registry.counter(
+    'circuit_llm_tokens_total', '大模型消耗的 token 数', ('model', 'prompt', 'kind'))
+COALESCED_REQUESTS = registry.counter(
+    'circuit_coalesced_requests_total', '合并到进行中相同请求的重复请求数', ('scope',))
+LLM_HEDGES = registry.counter(
+    'circuit_llm_hedges_total', '大模型对冲请求次数（issued 已发出 / won 先于原请求返回 / skipped 预算不足）',
+    ('prompt', 'outcome'))
+QUESTION_ROUTES = registry.counter(
+    'circuit_question_routes_total', '问题设计的分级路由次数（local / chat / reasoner）', ('tier',))
+QUESTION_ROUTE_OUTCOMES = registry.counter(
+    'circuit_question_route_outcomes_total',
+    '各路由级别设计的问题的后续操作（selected 选择选项 / other 查看其他结果 / back 返回上一步）', ('tier', 'outcome'))
+LLM_BATCHED_ITEMS = registry.counter(
+    'circuit_llm_batched_items_total', '微批处理的提示条数（batched 合并发送 / fallback 解析失败后单独请求）',
+    ('prompt', 'outcome'))
+
+
+@contextmanager
+def span(stage: str, timings: Dict[str, float] = None):
+    """
+    记录一个流水线阶段的耗时
+    timings: 可选，同时把本次耗时（毫秒）累加到该字典，供 explain 等调用方使用
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.observe(elapsed, stage=stage)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed * 1000
+
+
+# /proc/self/smaps_rollup 中关心的字段 -> 报告中的名称
+_SMAPS_FIELDS = {
+    'Rss': 'rss_mb',
+    'Pss': 'pss_mb',
+    'Shared_Clean': 'shared_clean_mb',
+    'Shared_Dirty': 'shared_dirty_mb',
+    'Private_Clean': 'private_clean_mb',
+    'Private_Dirty': 'private_dirty_mb'
+}
+
+
+def process_memory(pid: int = None) -> Dict[str, float]:
+    """
+    进程（默认为当前进程）的内存占用（MB）
+    Linux 下读取 smaps_rollup：Pss 按共享进程数分摊共享页，各 worker 的 Pss 之和即整组进程的实际占用；
+    Private_Dirty 是本进程独有（含写时复制后复制出）的页。其他平台只有当前进程的峰值 RSS
+    """
+    report = {'pid': pid or os.getpid()}
+    try:
+        with open(f"/proc/{pid or 'self'}/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in _SMAPS_FIELDS:
+                    report[_SMAPS_FIELDS[name]] = round(int(value.split()[0]) / 1024, 1)
+    except OSError:
+        if pid is not None:
+            return report
+        # ru_maxrss 在 Linux 上以 KB 为单位，macOS 上以字节为单位
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        report['peak_rss_mb'] = round(peak / (1024 * 1024 if os.uname().sysname == 'Darwin' else 1024), 1)
+    return report
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+import config
+from utils.deadline import DeadlineExceeded, current_deadline
+from utils.llm_gateway import LLMUnavailable
+from utils.metrics import LLM_BATCHED_ITEMS
+
+logger = logging.getLogger(__name__)
+
+
+class _Batch:
+    def __init__(self, event_factory):
+        self.items: List[Any] = []
+        self.results: Optional[List[Any]] = None
+        self.error: Optional[BaseException] = None
+        self.full = event_factory()
+        self.done = event_factory()
+
+
+def _follower_timeout() -> Optional[float]:
+    deadline = current_deadline()
+    return deadline.remaining() if deadline is not None else None
+
+
+class MicroBatcher:
+    """
+    提示微批处理（多线程版本）：同一分组（如提示类型）的调用在短窗口内到达时合并为一次多条目请求
+    第一个到达的调用者等待窗口结束或攒满 max_items 后发出合并请求，再把解析出的结果按序分发；
+    窗口内只有一个调用，或合并请求的结果无法解析时，各调用者改为各自单独请求；
+    网关拒绝（LLMUnavailable）时所有调用者共享这个异常，由各自走本地降级；
+    领头者自己的时间预算用完（DeadlineExceeded）时只有领头者失败，其他调用者在各自的预算内单独请求
+    run(key, item, single, combined)：single(item) 返回单条结果，combined(items) 返回等长的结果列表
+    """
+
+    def __init__(self):
+        self.enabled = config.Config.LLM_BATCH_ENABLED
+        self.window = config.Config.LLM_BATCH_WINDOW
+        self.max_items = config.Config.LLM_BATCH_MAX_ITEMS
+        self._open: Dict[Hashable, _Batch] = {}
+        self._lock = threading.Lock()
+
+    def run(self, key: Hashable, item: Any, single: Callable[[Any], Any],
+            combined: Callable[[List[Any]], List[Any]]) -> Any:
+        if not self.enabled:
+            return single(item)
+
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._open[key] = _Batch(threading.Event)
+            index = len(batch.items)
+            batch.items.append(item)
+            if len(batch.items) >= self.max_items:
+                del self._open[key]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._open.get(key) is batch:
+                    del self._open[key]
+            try:
+                expired = _send_batch(batch, key, combined)
+            finally:
+                batch.done.set()
+            if expired is not None:
+                raise expired
+        elif not batch.done.wait(_follower_timeout()):
+            raise DeadlineExceeded('等待批量请求超出剩余预算')
+
+        if batch.error is not None:
+            raise batch.error
+        if batch.results is None:
+            return single(item)
+        return batch.results[index]
+
+
+class AsyncMicroBatcher:
+    """MicroBatcher 的协程版本，只在同一个事件循环内使用；combined 和 single 为协程函数"""
+
+    def __init__(self):
+        self.enabled = config.Config.LLM_BATCH_ENABLED
+        self.window = config.Config.LLM_BATCH_WINDOW
+        self.max_items = config.Config.LLM_BATCH_MAX_ITEMS
+        self._open: Dict[Hashable, _Batch] = {}
+
+    async def run(self, key: Hashable, item: Any, single: Callable[[Any], Any],
+                  combined: Callable[[List[Any]], Any]) -> Any:
+        if not self.enabled:
+            return await single(item)
+
+        batch = self._open.get(key)
+        leader = batch is None
+        if leader:
+            batch = self._open[key] = _Batch(asyncio.Event)
+        index = len(batch.items)
+        batch.items.append(item)
+        if len(batch.items) >= self.max_items:
+            del self._open[key]
+            batch.full.set()
+
+        if leader:
+            try:
+                try:
+                    await asyncio.wait_for(batch.full.wait(), self.window)
+                except asyncio.TimeoutError:
+                    pass
+                if self._open.get(key) is batch:
+                    del self._open[key]
+                expired = await _send_batch_async(batch, key, combined)
+            finally:
+                # 领头者被取消时跟随者改为单独请求
+                if self._open.get(key) is batch:
+                    del self._open[key]
+                batch.done.set()
+            if expired is not None:
+                raise expired
+        else:
+            try:
+                await asyncio.wait_for(batch.done.wait(), _follower_timeout())
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded('等待批量请求超出剩余预算')
+
+        if batch.error is not None:
+            raise batch.error
+        if batch.results is None:
+            return await single(item)
+        return batch.results[index]
+
+
+def _send_batch(batch: _Batch, key: Hashable,
+                combined: Callable[[List[Any]], List[Any]]) -> Optional[DeadlineExceeded]:
+    """发出合并请求；领头者的预算用完时返回该异常，由领头者自己抛出"""
+    if len(batch.items) < 2:
+        return None
+    try:
+        batch.results = _check_results(batch, combined(batch.items))
+        LLM_BATCHED_ITEMS.inc(len(batch.items), prompt=key, outcome='batched')
+    except DeadlineExceeded as e:
+        # 领头者自己的预算用完：不共享给跟随者，跟随者改为单独请求
+        _log_fallback(batch, key, e)
+        return e
+    except LLMUnavailable as e:
+        batch.error = e
+    except Exception as e:
+        _log_fallback(batch, key, e)
+    return None
+
+
+async def _send_batch_async(batch: _Batch, key: Hashable,
+                            combined: Callable[[List[Any]], Any]) -> Optional[DeadlineExceeded]:
+    if len(batch.items) < 2:
+        return None
+    try:
+        batch.results = _check_results(batch, await combined(batch.items))
+        LLM_BATCHED_ITEMS.inc(len(batch.items), prompt=key, outcome='batched')
+    except DeadlineExceeded as e:
+        # 领头者自己的预算用完：不共享给跟随者，跟随者改为单独请求
+        _log_fallback(batch, key, e)
+        return e
+    except LLMUnavailable as e:
+        batch.error = e
+    except Exception as e:
+        _log_fallback(batch, key, e)
+    return None
+
+
+def _check_results(batch: _Batch, results: List[Any]) -> List[Any]:
+    if not isinstance(results, list) or len(results) != len(batch.items):
+        raise ValueError(f'批量结果数量不符: 期望 {len(batch.items)} 条')
+    return results
+
+
+def _log_fallback(batch: _Batch, key: Hashable, error: Exception):
+    logger.warning("批量请求失败，%d 条改为单独请求: %s", len(batch.items), error)
+    LLM_BATCHED_ITEMS.inc(len(batch.items), prompt=key, outcome='fallback')
@@ -0,0 +1,98 @@
+import logging
+import re
+from typing import Dict, Optional
+
+import config
+from utils.catalog_index import REGEX_META
+from utils.metrics import QUESTION_ROUTES, QUESTION_ROUTE_OUTCOMES
+from utils.result_facets import ResultFacets
+from utils.selection_text import clean_selection_text
+
+logger = logging.getLogger(__name__)
+
+# 含括号的路径段在筛选前会被清理，本地出题不使用
+_BRACKET_PATTERN = re.compile(r'[（）()\[\]【】]')
+
+
+def _filters_verbatim(value: str) -> bool:
+    """选择该值时的筛选与统计一致：不会被清理改写，也不含会被当作正则解释的字符"""
+    return (len(value) >= 2 and not _BRACKET_PATTERN.search(value)
+            and not any(char in REGEX_META for char in value)
+            and clean_selection_text(value) == value)
+
+
+class RouteDecision:
+    """一次问题设计的路由结果：local 本地出题 / chat 对话模型 / reasoner 推理模型"""
+
+    def __init__(self, tier: str, entropy: float, segments: int, question: Optional[Dict] = None):
+        self.tier = tier
+        self.entropy = entropy
+        self.segments = segments
+        self.question = question
+
+    def to_dict(self) -> Dict:
+        return {'tier': self.tier, 'entropy': round(self.entropy, 3), 'segments': self.segments}
+
+
+class ModelRouter:
+    """
+    按结果集的歧义程度为问题设计选择处理方式
+    - 某一层级路径恰好把全部结果分成 2–LOCAL_MAX_OPTIONS 组（每条结果都在该层有值，且各值按“包含”筛选互不串组）：
+      直接用这一层的值本地出题
+    - 第一个分叉层的熵（比特）和公共前缀之下前两层的不同路径段数都不超过阈值：交给对话模型
+    - 其余情况才交给推理模型
+    路由决定随问题保存在会话中，用户的后续操作（选择、查看其他结果、返回上一步）按级别计数，用于调整阈值
+    """
+
+    def __init__(self):
+        self.enabled = config.Config.QUESTION_ROUTER_ENABLED
+        self.local_max_options = config.Config.QUESTION_ROUTER_LOCAL_MAX_OPTIONS
+        self.chat_max_entropy = config.Config.QUESTION_ROUTER_CHAT_MAX_ENTROPY
+        self.chat_max_segments = config.Config.QUESTION_ROUTER_CHAT_MAX_SEGMENTS
+
+    def route(self, facets: ResultFacets) -> RouteDecision:
+        entropy = facets.branch_entropy()
+        segments = facets.branch_segments()
+
+        if not self.enabled:
+            decision = RouteDecision('reasoner', entropy, segments)
+        else:
+            question = self._local_question(facets)
+            if question is not None:
+                decision = RouteDecision('local', entropy, segments, question)
+            elif entropy <= self.chat_max_entropy and segments <= self.chat_max_segments:
+                decision = RouteDecision('chat', entropy, segments)
+            else:
+                decision = RouteDecision('reasoner', entropy, segments)
+
+        QUESTION_ROUTES.inc(tier=decision.tier)
+        logger.info("问题设计路由: %s（%d 条结果，分叉熵 %.2f，路径段 %d）",
+                    decision.tier, facets.total, entropy, segments)
+        return decision
+
+    @staticmethod
+    def record_outcome(question: Optional[Dict], outcome: str):
+        """记录用户对某个问题的后续操作：selected / other / back"""
+        route = (question or {}).get('route')
+        if route:
+            QUESTION_ROUTE_OUTCOMES.inc(tier=route['tier'], outcome=outcome)
+
+    def _local_question(self, facets: ResultFacets) -> Optional[Dict]:
+        """某层路径能干净地切分全部结果时，用该层的值构造选择题"""
+        level = facets.clean_level(self.local_max_options)
+        if level is None:
+            return None
+        counter = facets.path_levels[level]
+        if not all(_filters_verbatim(value) for value in counter):
+            return None
+
+        options = [value for value, _ in counter.most_common()]
+        summary = '、'.join(f'{value}（{count}）' for value, count in counter.most_common())
+        return {
+            'analysis': f'当前 {facets.total} 个结果按层级路径可以分为 {len(options)} 类：{summary}。',
+            'question': '请选择您需要的类别：',
+            'options': options,
+            'filter_field': '层级路径',
+            'filter_logic': '包含',
+            'design_reasoning': f'第 {facets.prefix_depth + level + 1} 层路径恰好把结果分成 {len(options)} 组，无需调用大模型'
+        }
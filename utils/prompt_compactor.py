@@ -0,0 +1,179 @@
+import itertools
+import json
+import logging
+import re
+from typing import Dict, List, Optional, Tuple
+
+import config
+from utils.result_view import ResultView
+
+logger = logging.getLogger(__name__)
+
+_CJK_PATTERN = re.compile(r'[\u4e00-\u9fff\u3000-\u303f\uff00-\uffef]')
+_TAG_PATTERN = re.compile(r'【([^】]*)】')
+_EXTENSION_PATTERN = re.compile(r'\.[A-Za-z][A-Za-z0-9]{1,4}$')
+
+# 超出预算时依次尝试的展开程度：(每个路径下列出的文件数, 展开的路径层数, 每层列出的分支数)，None 表示不限
+_DETAIL_LEVELS = [
+    (None, None, None),
+    (5, None, None),
+    (3, None, 12),
+    (1, None, 8),
+    (0, None, 8),
+    (0, 4, 6),
+    (0, 3, 5),
+    (0, 2, 4),
+    (0, 1, 4)
+]
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计 token 数：中文字符和全角标点各算一个，其余字符约三个算一个"""
+    cjk = len(_CJK_PATTERN.findall(text))
+    other = len(text) - cjk - text.count(' ') - text.count('\n')
+    return cjk + (max(other, 0) + 2) // 3
+
+
+# 逐条 JSON 列出（indent=2）时每条记录中键名、引号和缩进的 token 数
+_RECORD_OVERHEAD_TOKENS = estimate_tokens(
+    json.dumps([{'ID': '', '层级路径': '', '关联文件名称': ''}], ensure_ascii=False, indent=2)
+)
+
+
+class _Node:
+    __slots__ = ('children', 'files', 'count')
+
+    def __init__(self):
+        self.children: Dict[str, '_Node'] = {}
+        self.files: Dict[str, Tuple[int, List[str]]] = {}  # 主干 -> (文件数, 括号标签)
+        self.count = 0
+
+
+class PromptCompactor:
+    """
+    把搜索结果压缩成问题设计提示中的结果概览
+    - 共享的层级路径前缀归并成缩进的树，只有一个分支的路径连写为 a->b->c，括号内为该路径下的结果数
+    - 去掉 ID 等对设计问题无用的字段，文件名省略扩展名和与所在路径重复的词元
+    - 同一路径下主干相同的文件合并为一行，括号标签合并列出并注明数量
+    超出 token 预算时逐步减少列出的文件、分支和展开层数，因此也能概括整个结果集；
+    路径几乎没有共享前缀、归并后反而不比逐行列出“路径 · 文件名”更短时，改为逐行列出
+    """
+
+    def __init__(self, token_budget: Optional[int] = None):
+        self.token_budget = token_budget or config.Config.QUESTION_PROMPT_TOKEN_BUDGET
+
+    def compact(self, results: ResultView) -> str:
+        root = self._build_tree(results)
+
+        for max_files, max_depth, max_children in _DETAIL_LEVELS:
+            lines = []
+            self._render_children(root, 0, lines, max_files, max_depth, max_children)
+            text = '\n'.join(lines)
+            if estimate_tokens(text) <= self.token_budget:
+                break
+        else:
+            text = self._truncate(text)
+
+        flat = self._flat_listing(results, min(estimate_tokens(text), self.token_budget))
+        if flat is not None:
+            text = flat
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("结果概览压缩: %d 条结果, 约 %d -> %d tokens（预算 %d）",
+                        len(results), self._listing_tokens(results), estimate_tokens(text), self.token_budget)
+        return text
+
+    @staticmethod
+    def _listing_tokens(results: ResultView) -> int:
+        """逐条 JSON 列出结果时的 token 估计：字段值的 token 数加上每条记录固定的键名和标点，不实际序列化"""
+        values = ''.join(map(str, itertools.chain(results.ids, results.paths, results.filenames)))
+        return estimate_tokens(values) + _RECORD_OVERHEAD_TOKENS * len(results)
+
+    @staticmethod
+    def _flat_listing(results: ResultView, limit: int) -> Optional[str]:
+        """逐行列出“路径 · 文件名”（省略扩展名）；超过 limit 个 token 时返回 None"""
+        lines = []
+        used = 0
+        for path, filename in zip(results.paths, results.filenames):
+            line = f"{path} · {_EXTENSION_PATTERN.sub('', str(filename).strip())}"
+            used += estimate_tokens(line)
+            if used > limit:
+                return None
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def _build_tree(self, results: ResultView) -> _Node:
+        root = _Node()
+        for path, filename in zip(results.paths, results.filenames):
+            parts = [part.strip() for part in str(path).split('->') if part.strip()]
+            stem, tags = self._shorten(str(filename), set(parts))
+
+            node = root
+            node.count += 1
+            for part in parts:
+                node = node.children.setdefault(part, _Node())
+                node.count += 1
+
+            count, known_tags = node.files.get(stem, (0, []))
+            known_tags.extend(tag for tag in tags if tag not in known_tags)
+            node.files[stem] = (count + 1, known_tags)
+        return root
+
+    @staticmethod
+    def _shorten(filename: str, path_parts: set) -> Tuple[str, List[str]]:
+        """拆出【】标签，去掉扩展名和与路径重复的词元，返回 (主干, 标签)"""
+        name = _EXTENSION_PATTERN.sub('', filename.strip())
+        tags = [tag for tag in _TAG_PATTERN.findall(name) if tag]
+        stem = _TAG_PATTERN.sub('', name)
+        tokens = [token for token in stem.split('_') if token.strip()]
+        kept = [token for token in tokens if token.strip() not in path_parts]
+        return '_'.join(kept or tokens) or name, tags
+
+    def _render_children(self, node: _Node, depth: int, lines: List[str],
+                         max_files: Optional[int], max_depth: Optional[int], max_children: Optional[int]):
+        children = sorted(node.children.items(), key=lambda item: -item[1].count)
+        shown = children if max_children is None else children[:max_children]
+        for label, child in shown:
+            self._render_node(label, child, depth, lines, max_files, max_depth, max_children)
+
+        hidden = children[len(shown):]
+        if hidden:
+            hidden_count = sum(child.count for _, child in hidden)
+            lines.append(f"{'  ' * depth}…另有 {len(hidden)} 个分支（{hidden_count}）")
+
+    def _render_node(self, label: str, node: _Node, depth: int, lines: List[str],
+                     max_files: Optional[int], max_depth: Optional[int], max_children: Optional[int]):
+        # 只有一个分支且自身没有文件的路径连写
+        while len(node.children) == 1 and not node.files:
+            child_label, node = next(iter(node.children.items()))
+            label = f'{label}->{child_label}'
+        lines.append(f"{'  ' * depth}{label} ({node.count})")
+
+        if max_depth is not None and depth + 1 >= max_depth:
+            return
+
+        indent = '  ' * (depth + 1)
+        files = list(node.files.items())
+        listed = files if max_files is None else files[:max_files]
+        for stem, (count, tags) in listed:
+            tag_text = f"【{'|'.join(tags)}】" if tags else ''
+            count_text = f' ×{count}' if count > 1 else ''
+            lines.append(f'{indent}· {stem}{tag_text}{count_text}')
+        # 完全不列文件时，括号内的数量已经说明了规模
+        if listed and len(listed) < len(files):
+            rest = sum(count for _, (count, _) in files[len(listed):])
+            lines.append(f'{indent}· …另有 {rest} 个文件')
+
+        self._render_children(node, depth + 1, lines, max_files, max_depth, max_children)
+
+    def _truncate(self, text: str) -> str:
+        """最简概览仍超出预算时按行截断"""
+        lines = []
+        used = 0
+        for line in text.split('\n'):
+            used += estimate_tokens(line) + 1
+            if used > self.token_budget:
+                lines.append('…')
+                break
+            lines.append(line)
+        return '\n'.join(lines)
@@ -0,0 +1,134 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+
+from utils.result_view import ResultView
+
+# 文件名中的中文词（按分隔符切开后取 2–8 字的连续中文）和型号代码（同时含字母和数字）
+_NAME_SPLIT_PATTERN = re.compile(r'[_\s【】\[\]()（）,，、/\-]+')
+_CJK_RUN_PATTERN = re.compile(r'[\u4e00-\u9fff]{2,8}')
+_CODE_PATTERN = re.compile(r'[A-Za-z0-9][A-Za-z0-9.\-]*[A-Za-z0-9]')
+_EXTENSION_PATTERN = re.compile(r'\.[A-Za-z][A-Za-z0-9]{1,4}$')
+
+# 统计中忽略的泛用词
+_GENERIC_TOKENS = {'电路图', '资料', '原理图', '整车电路图'}
+
+
+class ResultFacets:
+    """
+    整个结果集的聚合统计，引导时据此让第一个问题就切分全部结果（直接读取结果视图的列）
+    - path_levels：公共路径前缀之下，每一层路径段的结果数
+    - filename_tokens：文件名中的中文词的文档频次（不含出现在所有结果中的词）
+    - model_codes：文件名中的型号代码（如 SY215C9、EDC17C63）的文档频次
+    """
+
+    def __init__(self, results: ResultView):
+        self.total = len(results)
+        self.full_paths = [str(path) for path in results.paths]
+        self._folded_paths = None
+        self.paths = [[part.strip() for part in path.split('->') if part.strip()] for path in self.full_paths]
+        self.common_prefix = self._common_prefix(self.paths)
+
+        depth = len(self.common_prefix)
+        max_len = max((len(path) for path in self.paths), default=0)
+        self.path_levels: List[Counter] = [
+            Counter(path[level] for path in self.paths if level < len(path))
+            for level in range(depth, max_len)
+        ]
+
+        self.filename_tokens = Counter()
+        self.model_codes = Counter()
+        for filename in results.filenames:
+            name = _EXTENSION_PATTERN.sub('', str(filename))
+            tokens = set()
+            codes = set()
+            for part in _NAME_SPLIT_PATTERN.split(name):
+                tokens.update(_CJK_RUN_PATTERN.findall(part))
+                codes.update(code for code in _CODE_PATTERN.findall(part)
+                             if re.search(r'[A-Za-z]', code) and re.search(r'\d', code))
+            self.filename_tokens.update(tokens - _GENERIC_TOKENS)
+            self.model_codes.update(codes)
+
+        # 出现在每个结果中的词无法区分结果
+        for counter in (self.filename_tokens, self.model_codes):
+            for token in [token for token, count in counter.items() if count >= self.total]:
+                del counter[token]
+
+    @staticmethod
+    def _common_prefix(paths: List[List[str]]) -> List[str]:
+        if not paths:
+            return []
+        prefix = []
+        for level in range(min(len(path) for path in paths)):
+            values = {path[level] for path in paths}
+            if len(values) != 1:
+                break
+            prefix.append(values.pop())
+        return prefix
+
+    @property
+    def prefix_depth(self) -> int:
+        return len(self.common_prefix)
+
+    def branch_entropy(self) -> float:
+        """第一个分叉层上路径段分布的熵（比特）；在该层没有路径段的结果记为一个空值"""
+        if not self.path_levels or not self.total:
+            return 0.0
+        counts = list(self.path_levels[0].values())
+        missing = self.total - sum(counts)
+        if missing:
+            counts.append(missing)
+        return -sum(count / self.total * math.log2(count / self.total) for count in counts)
+
+    def branch_segments(self, levels: int = 2) -> int:
+        """公共前缀之下前几层的不同路径段数"""
+        return sum(len(counter) for counter in self.path_levels[:levels])
+
+    def matches(self, value: str) -> int:
+        """按“包含”逻辑在层级路径中命中的结果数（与筛选一样不区分大小写）"""
+        if self._folded_paths is None:
+            self._folded_paths = [path.lower() for path in self.full_paths]
+        value = value.lower()
+        return sum(value in path for path in self._folded_paths)
+
+    def clean_level(self, max_options: int) -> Optional[int]:
+        """
+        找一层能把全部结果干净切分的路径（返回相对公共前缀的层号）：
+        每个结果在该层都有值，值的种数在 2–max_options 之间，且按“包含”筛选时各值只命中自己这一组
+        """
+        for level, counter in enumerate(self.path_levels):
+            if sum(counter.values()) != self.total or not 2 <= len(counter) <= max_options:
+                continue
+            if all(self.matches(value) == count for value, count in counter.items()):
+                return level
+        return None
+
+    def summary(self, top_n: int = 8, levels: int = 3) -> str:
+        """供问题设计提示使用的统计摘要"""
+        lines = [f'- 结果总数: {self.total}']
+        if self.common_prefix:
+            lines.append(f"- 公共路径: {'->'.join(self.common_prefix)}")
+        for level, counter in enumerate(self.path_levels[:levels]):
+            lines.append(f'- 第 {self.prefix_depth + level + 1} 层路径（{len(counter)} 种）: {self._format(counter, top_n)}')
+        if self.filename_tokens:
+            lines.append(f'- 文件名高频词: {self._format(self.filename_tokens, top_n)}')
+        if self.model_codes:
+            lines.append(f'- 型号代码: {self._format(self.model_codes, top_n)}')
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _format(counter: Counter, top_n: int) -> str:
+        items = counter.most_common(top_n)
+        text = '、'.join(f'{value}（{count}）' for value, count in items)
+        if len(counter) > top_n:
+            text += f' 等 {len(counter)} 种'
+        return text
+
+    def potential_options(self, limit: int = 10) -> Dict:
+        """按结果数从多到少给出潜在选项：第一个分叉层的路径段和文件名高频词"""
+        path_keywords = [value for value, _ in self.path_levels[0].most_common(limit)] if self.path_levels else []
+        return {
+            "filename_keywords": [token for token, _ in self.filename_tokens.most_common(limit)],
+            "path_keywords": path_keywords
+        }
@@ -0,0 +1,47 @@
+from typing import Dict, List
+
+
+class ResultView:
+    """
+    一轮对话中检索结果的展示视图：ID、层级路径、关联文件名称三列只从结果中按列取出一次，
+    之后的记录列表（供引导出题和前端展示）和各种文本模板都复用这份列数据，不再逐行遍历 DataFrame
+    模板使用 str.format 的命名字段：{n}（序号）、{id}、{path}、{filename}，整段文本由一次 join 生成
+    """
+
+    def __init__(self, ids: List, paths: List[str], filenames: List[str]):
+        self.ids = ids
+        self.paths = paths
+        self.filenames = filenames
+        self._records = None
+
+    @classmethod
+    def from_records(cls, records: List[Dict]) -> 'ResultView':
+        """由 format_results_for_display 格式的记录列表构造"""
+        return cls(
+            [record['ID'] for record in records],
+            [record['层级路径'] for record in records],
+            [record['关联文件名称'] for record in records]
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def column(self, field: str) -> List:
+        """按字段名（ID / 层级路径 / 关联文件名称）取一列"""
+        return {'ID': self.ids, '层级路径': self.paths, '关联文件名称': self.filenames}[field]
+
+    def records(self) -> List[Dict]:
+        """每条结果的展示字段，与 format_results_for_display 的输出相同；只构造一次"""
+        if self._records is None:
+            self._records = [
+                {'ID': row_id, '层级路径': path, '关联文件名称': filename}
+                for row_id, path, filename in zip(self.ids, self.paths, self.filenames)
+            ]
+        return self._records
+
+    def render(self, template: str, separator: str = '', start: int = 1) -> str:
+        """按模板渲染每条结果并用 separator 连接，序号 {n} 从 start 开始"""
+        return separator.join(
+            template.format(n=n, id=row_id, path=path, filename=filename)
+            for n, row_id, path, filename in zip(range(start, start + len(self)), self.ids, self.paths, self.filenames)
+        )
@@ -1,92 +1,134 @@
+import numpy as np
 import pandas as pd
-from typing import List, Dict, Tuple
+import re
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, Union
 import config
 import itertools
+import time
+import logging
+from utils.catalog_index import REGEX_META
+from utils.metrics import span
+from utils.result_view import ResultView
+
+logger = logging.getLogger(__name__)
+
+# 各检索字段在指标中的简称
+FIELD_STAGE_NAMES = {'层级路径': 'path', '关联文件名称': 'filename'}
+
+class SearchBackend:
+    """
+    检索后端：在层级路径和文件名两个字段中分别求“各关键词两两交集的并集”，再取两字段的并集
+    match 返回目录中的匹配行（保留目录的行索引和顺序），排序和格式化由 CircuitRetriever 完成；
+    explain 不为空时按字段记录每个关键词的命中数、被忽略的关键词、两两交集大小和并集大小；
+    ranked 为真的后端自行按匹配分数排好结果（并在 explain 中记录分数分布）
+    """
+    name = ''
+    ranked = False
+
+    def match(self, keywords: List[str], explain: Dict = None) -> pd.DataFrame:
+        raise NotImplementedError
+
+    @staticmethod
+    def _field_info(explain: Dict, field: str) -> Dict:
+        if explain is None:
+            return None
+        field_info = explain['fields'][field] = {
+            'keyword_hits': {},
+            'dropped_keywords': [],
+            'pairs': [],
+            'union_size': 0
+        }
+        return field_info
+
+
+class PandasSearchBackend(SearchBackend):
+    """在 DataLoader 的 DataFrame 中逐关键词扫描（str.contains）"""
+    name = 'pandas'
 
-class CircuitRetriever:
     def __init__(self, data_loader):
         self.data_loader = data_loader
-    
-    def search(self, keywords: List[str]) -> pd.DataFrame:
-        """
-        执行完整搜索流程（新策略）：
-        1. 层级路径：分别匹配 → 删除为0的 → 两两交集 → 取并集
-        2. 文件名：分别匹配 → 删除为0的 → 两两交集 → 取并集
-        3. 两者取并集（只要一方有结果就包含）
-        4. 按匹配关键词数量排序
-        """
-        print(f"\n===== 开始搜索，关键词: {keywords} =====")
-        
+
+    def match(self, keywords: List[str], explain: Dict = None) -> pd.DataFrame:
         # 1. 在层级路径中搜索（新策略：两两交集再并集）
-        hierarchy_results = self._search_with_pairwise_intersection('层级路径', keywords)
-        print(f"层级路径搜索结果: {len(hierarchy_results)} 行")
+        hierarchy_results = self._search_with_pairwise_intersection('层级路径', keywords, explain)
+        logger.debug("层级路径搜索结果: %d 行", len(hierarchy_results))
         
         # 2. 在文件名中搜索（新策略：两两交集再并集）
-        filename_results = self._search_with_pairwise_intersection('关联文件名称', keywords)
-        print(f"文件名搜索结果: {len(filename_results)} 行")
+        filename_results = self._search_with_pairwise_intersection('关联文件名称', keywords, explain)
+        logger.debug("文件名搜索结果: %d 行", len(filename_results))
         
         # 3. 取并集（只要任一字段有匹配就包含）
         if hierarchy_results.empty and filename_results.empty:
-            print("两个字段都没有匹配结果")
+            logger.debug("两个字段都没有匹配结果")
             return pd.DataFrame()
         elif hierarchy_results.empty:
-            print("只有文件名有结果，返回文件名结果")
-            union_results = filename_results
+            logger.debug("只有文件名有结果，返回文件名结果")
+            return filename_results
         elif filename_results.empty:
-            print("只有层级路径有结果，返回层级路径结果")
-            union_results = hierarchy_results
-        else:
-            # 取并集：合并两个结果，去重
-            hierarchy_ids = set(hierarchy_results['ID'].tolist())
-            filename_ids = set(filename_results['ID'].tolist())
-            union_ids = hierarchy_ids | filename_ids  # 并集操作
-            
-            # 从原始数据中获取所有并集结果
-            union_results = self.data_loader.data[
-                self.data_loader.data['ID'].isin(union_ids)
-            ].copy()
-            
-            print(f"并集结果: {len(union_results)} 行")
+            logger.debug("只有层级路径有结果，返回层级路径结果")
+            return hierarchy_results
         
-        # 4. 按匹配关键词数量排序
-        if not union_results.empty and keywords:
-            union_results = self._sort_by_keyword_matches(union_results, keywords)
+        # 取并集：合并两个结果，去重
+        hierarchy_ids = set(hierarchy_results['ID'].tolist())
+        filename_ids = set(filename_results['ID'].tolist())
+        union_ids = hierarchy_ids | filename_ids  # 并集操作
         
+        # 从原始数据中获取所有并集结果
+        union_results = self.data_loader.data[
+            self.data_loader.data['ID'].isin(union_ids)
+        ].copy()
+        
+        logger.debug("并集结果: %d 行", len(union_results))
         return union_results
     
-    def _search_with_pairwise_intersection(self, field: str, keywords: List[str]) -> pd.DataFrame:
+    def _search_with_pairwise_intersection(self, field: str, keywords: List[str], explain: Dict = None) -> pd.DataFrame:
         """
         新策略：先两两交集，再取并集
         """
         if not keywords:
             return pd.DataFrame()
         
-        print(f"在字段 '{field}' 中搜索关键词: {keywords}")
+        logger.debug("在字段 '%s' 中搜索关键词: %s", field, keywords)
+        
+        timings = explain['timings_ms'] if explain is not None else None
+        # 循环内的逐条调试日志只在开启 DEBUG 时才构造
+        debug = logger.isEnabledFor(logging.DEBUG)
+        field_info = self._field_info(explain, field)
         
         # 1. 获取每个关键词的匹配结果
         keyword_matches = {}
         valid_keywords = []
         
-        for keyword in keywords:
-            # 单个关键词匹配
-            mask = self.data_loader.data[field].str.contains(keyword, case=False, na=False)
-            match_df = self.data_loader.data[mask].copy()
-            
-            print(f"  关键词 '{keyword}' 匹配到 {len(match_df)} 行")
-            
-            if not match_df.empty:
-                keyword_matches[keyword] = match_df
-                valid_keywords.append(keyword)
-            else:
-                print(f"  关键词 '{keyword}' 匹配结果为0，将被忽略")
+        with span(f'retrieval_{FIELD_STAGE_NAMES.get(field, field)}', timings):
+            for keyword in keywords:
+                # 单个关键词匹配
+                mask = self.data_loader.data[field].str.contains(keyword, case=False, na=False)
+                match_df = self.data_loader.data[mask].copy()
+                
+                if debug:
+                    logger.debug("  关键词 '%s' 匹配到 %d 行", keyword, len(match_df))
+                if field_info is not None:
+                    field_info['keyword_hits'][keyword] = len(match_df)
+                
+                if not match_df.empty:
+                    keyword_matches[keyword] = match_df
+                    valid_keywords.append(keyword)
+                else:
+                    if debug:
+                        logger.debug("  关键词 '%s' 匹配结果为0，将被忽略", keyword)
+                    if field_info is not None:
+                        field_info['dropped_keywords'].append(keyword)
         
-        print(f"在字段 '{field}' 中，有效关键词: {valid_keywords}")
+        logger.debug("在字段 '%s' 中，有效关键词: %s", field, valid_keywords)
         
         if not valid_keywords:
             return pd.DataFrame()
         
         # 如果只有一个有效关键词，直接返回该关键词的结果
         if len(valid_keywords) == 1:
+            if field_info is not None:
+                field_info['union_size'] = len(keyword_matches[valid_keywords[0]])
             return keyword_matches[valid_keywords[0]]
         
         # 2. 两两取交集，然后取并集
@@ -94,36 +136,280 @@ class CircuitRetriever:
         
         # 生成所有两两组合
         keyword_pairs = list(itertools.combinations(valid_keywords, 2))
-        print(f"  生成 {len(keyword_pairs)} 个两两组合")
-        
-        for keyword1, keyword2 in keyword_pairs:
-            # 获取两个关键词的结果
-            df1 = keyword_matches[keyword1]
-            df2 = keyword_matches[keyword2]
-            
-            # 取交集
-            ids1 = set(df1['ID'].tolist())
-            ids2 = set(df2['ID'].tolist())
-            intersection_ids = ids1 & ids2
-            
-            if intersection_ids:
-                print(f"    组合 '{keyword1}' + '{keyword2}' 交集: {len(intersection_ids)} 行")
-                all_pairwise_ids.update(intersection_ids)
-            else:
-                print(f"    组合 '{keyword1}' + '{keyword2}' 交集: 0 行")
+        logger.debug("  生成 %d 个两两组合", len(keyword_pairs))
+        
+        with span('pairwise_intersection', timings):
+            for keyword1, keyword2 in keyword_pairs:
+                # 获取两个关键词的结果
+                df1 = keyword_matches[keyword1]
+                df2 = keyword_matches[keyword2]
+                
+                # 取交集
+                ids1 = set(df1['ID'].tolist())
+                ids2 = set(df2['ID'].tolist())
+                intersection_ids = ids1 & ids2
+                
+                if field_info is not None:
+                    field_info['pairs'].append({
+                        'keywords': [keyword1, keyword2],
+                        'size': len(intersection_ids)
+                    })
+                
+                if intersection_ids:
+                    if debug:
+                        logger.debug("    组合 '%s' + '%s' 交集: %d 行", keyword1, keyword2, len(intersection_ids))
+                    all_pairwise_ids.update(intersection_ids)
+                else:
+                    if debug:
+                        logger.debug("    组合 '%s' + '%s' 交集: 0 行", keyword1, keyword2)
+        
+        if field_info is not None:
+            field_info['union_size'] = len(all_pairwise_ids)
         
         # 3. 返回所有两两交集的并集
         if all_pairwise_ids:
             result = self.data_loader.data[
                 self.data_loader.data['ID'].isin(all_pairwise_ids)
             ].copy()
-            print(f"在字段 '{field}' 中，两两交集再并集后结果: {len(result)} 行")
+            logger.debug("在字段 '%s' 中，两两交集再并集后结果: %d 行", field, len(result))
             return result
         else:
-            print(f"在字段 '{field}' 中，所有两两组合都没有共同匹配的行")
+            logger.debug("在字段 '%s' 中，所有两两组合都没有共同匹配的行", field)
+            return pd.DataFrame()
+
+
+class CompactSearchBackend(SearchBackend):
+    """
+    在紧凑目录（CATALOG_STORE=compact）上检索：每个关键词的匹配位图来自 CatalogIndex（按 (字段, 关键词) 缓存），
+    两两交集的并集即“命中至少两个有效关键词的行”，用位图计数求出，只物化最终命中的行
+    """
+    name = 'compact'
+
+    def __init__(self, data_loader):
+        self.data_loader = data_loader
+
+    def match(self, keywords: List[str], explain: Dict = None) -> pd.DataFrame:
+        if not keywords:
             return pd.DataFrame()
+
+        union = None
+        for field in FIELD_STAGE_NAMES:
+            field_mask = self._field_mask(field, keywords, explain)
+            union = field_mask if union is None else union | field_mask
+
+        positions = np.flatnonzero(union)
+        logger.debug("并集结果: %d 行", len(positions))
+        if not positions.size:
+            return pd.DataFrame()
+        return self.data_loader.catalog.frame(positions)
+
+    def _field_mask(self, field: str, keywords: List[str], explain: Dict = None) -> np.ndarray:
+        """字段中各关键词两两交集的并集（只有一个有效关键词时为它的匹配行）"""
+        timings = explain['timings_ms'] if explain is not None else None
+        field_info = self._field_info(explain, field)
+        index = self.data_loader.index
+
+        valid = []
+        with span(f'retrieval_{FIELD_STAGE_NAMES[field]}', timings):
+            for keyword in keywords:
+                mask = index.keyword_mask(field, keyword)
+                hits = int(np.count_nonzero(mask))
+                if field_info is not None:
+                    field_info['keyword_hits'][keyword] = hits
+                if hits:
+                    valid.append((keyword, mask))
+                elif field_info is not None:
+                    field_info['dropped_keywords'].append(keyword)
+
+        if not valid:
+            return np.zeros(index.size, dtype=bool)
+        if len(valid) == 1:
+            if field_info is not None:
+                field_info['union_size'] = int(np.count_nonzero(valid[0][1]))
+            return valid[0][1]
+
+        with span('pairwise_intersection', timings):
+            counts = np.zeros(index.size, dtype=np.int32)
+            for _, mask in valid:
+                counts += mask
+            result = counts >= 2
+            if field_info is not None:
+                for (keyword1, mask1), (keyword2, mask2) in itertools.combinations(valid, 2):
+                    field_info['pairs'].append({
+                        'keywords': [keyword1, keyword2],
+                        'size': int(np.count_nonzero(mask1 & mask2))
+                    })
+                field_info['union_size'] = int(np.count_nonzero(result))
+        return result
+
+
+def create_search_backend(name: str, data_loader) -> SearchBackend:
+    """
+    按名称创建检索后端：pandas（默认，紧凑目录上为位图检索）、sqlite（FTS5 trigram 索引）
+    或 sharded（多进程分片检索）
+    """
+    if name == 'pandas':
+        if data_loader.catalog is not None:
+            return CompactSearchBackend(data_loader)
+        return PandasSearchBackend(data_loader)
+    if name == 'sqlite':
+        from utils.fts_backend import SqliteFtsBackend
+        return SqliteFtsBackend(data_loader, config.Config.SEARCH_FTS_PATH)
+    if name == 'sharded':
+        from utils.sharded_retrieval import ShardedSearchBackend
+        return ShardedSearchBackend(data_loader, config.Config.SEARCH_SHARDS)
+    raise ValueError(f'未知的检索后端: {name}')
+
+
+class _ProbeMemo:
+    """
+    一批查询共享的关键词探测结果：(字段, 关键词) -> 命中行位置（有序 int32 数组）
+    同一批中重复出现的关键词只探测一次索引；按占用字节数淘汰最久未用的条目，不写入 CatalogIndex 的位图缓存
+    """
+
+    def __init__(self, index, max_bytes: int):
+        self.index = index
+        self.max_bytes = max_bytes
+        self.requested = 0
+        self.probed = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def positions(self, field: str, keyword: str) -> np.ndarray:
+        key = (field, keyword.lower())
+        self.requested += 1
+        positions = self._entries.get(key)
+        if positions is not None:
+            self._entries.move_to_end(key)
+            return positions
+
+        self.probed += 1
+        positions = np.flatnonzero(self.index.keyword_mask(field, keyword, cache=False)).astype(np.int32)
+        self._entries[key] = positions
+        self._bytes += positions.nbytes
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+        return positions
+
+
+class CircuitRetriever:
+    def __init__(self, data_loader, backend: SearchBackend = None):
+        self.data_loader = data_loader
+        self.backend = backend or create_search_backend(config.Config.SEARCH_BACKEND, data_loader)
+        logger.info("检索后端: %s", self.backend.name)
+    
+    def search(self, keywords: List[str], explain: bool = False):
+        """
+        执行完整搜索流程（新策略）：
+        1. 层级路径：分别匹配 → 删除为0的 → 两两交集 → 取并集
+        2. 文件名：分别匹配 → 删除为0的 → 两两交集 → 取并集
+        3. 两者取并集（只要一方有结果就包含）
+        4. 按匹配关键词数量排序
+        
+        explain=True 时返回 (结果, 统计信息)，统计信息在搜索过程中顺带收集，不做额外扫描
+        """
+        logger.debug("===== 开始搜索，关键词: %s =====", keywords)
+        
+        if not explain:
+            return self._search(keywords)
+        
+        explain_info = {
+            'keywords': list(keywords),
+            'fields': {},
+            'union_size': 0,
+            'score_distribution': {},
+            'timings_ms': {}
+        }
+        start = time.perf_counter()
+        results = self._search(keywords, explain_info)
+        explain_info['timings_ms']['total'] = (time.perf_counter() - start) * 1000
+        explain_info['union_size'] = len(results)
+        return results, explain_info
+    
+    def search_batch(self, queries: Iterable[Union[str, List[str]]], offset: int = 0, limit: int = 20,
+                     extract: Callable[[str], List[str]] = None, stats: Dict = None) -> Iterator[Dict]:
+        """
+        批量检索（离线对接用，不经过对话）：queries 的每一项是关键词列表或原始查询文本，
+        原始查询用 extract 提取关键词（默认为目录词表的本地提取）
+        每个查询按与 search 相同的规则求结果并按匹配分数排序（分数相同时按目录顺序，翻页稳定），
+        逐条产出 {'query', 'keywords', 'total', 'offset', 'ids', 'scores'}，ids 为第 offset 名起的 limit 个结果；
+        同一批中相同的 (字段, 关键词) 只探测一次索引，stats 不为空时记录探测次数
+        """
+        extract = extract or self.data_loader.keyword_extractor.extract
+        probes = _ProbeMemo(self.data_loader.index, config.Config.BATCH_PROBE_CACHE_MB * 1024 * 1024)
+        queries_done = 0
+
+        for query in queries:
+            if isinstance(query, str):
+                keywords = extract(query)
+            else:
+                keywords = [str(keyword).strip() for keyword in query if str(keyword).strip()]
+            positions, scores = self._rank_positions(keywords, probes)
+            page = positions[offset:offset + limit]
+            queries_done += 1
+            if stats is not None:
+                stats.update({'queries': queries_done, 'probes_requested': probes.requested,
+                              'probes_executed': probes.probed})
+            yield {
+                'query': query if isinstance(query, str) else None,
+                'keywords': keywords,
+                'total': int(len(positions)),
+                'offset': offset,
+                'ids': self.data_loader.ids_at(page),
+                'scores': scores[offset:offset + limit].tolist()
+            }
+
+    @staticmethod
+    def _rank_positions(keywords: List[str], probes: _ProbeMemo) -> Tuple[np.ndarray, np.ndarray]:
+        """在行位置上求检索结果和匹配分数（与 search 的并集和排序规则相同），返回排好序的 (行位置, 分数)"""
+        empty = np.empty(0, dtype=np.int32)
+        if not keywords:
+            return empty, empty
+
+        # 1–3. 每个字段取命中至少两个有效关键词的行（只有一个有效关键词时为它的匹配行），两个字段再取并集
+        result = empty
+        for field in FIELD_STAGE_NAMES:
+            valid = [positions for positions in (probes.positions(field, keyword) for keyword in keywords)
+                     if positions.size]
+            if not valid:
+                continue
+            if len(valid) == 1:
+                field_rows = valid[0]
+            else:
+                rows, counts = np.unique(np.concatenate(valid), return_counts=True)
+                field_rows = rows[counts >= 2]
+            result = np.union1d(result, field_rows)
+        if not result.size:
+            return empty, empty
+
+        # 4. 匹配分数：各关键词在两个字段中按字面子串命中的次数之和
+        literal = [
+            probes.positions(field, re.escape(keyword) if any(char in REGEX_META for char in keyword) else keyword)
+            for field in FIELD_STAGE_NAMES for keyword in keywords
+        ]
+        rows, counts = np.unique(np.concatenate(literal), return_counts=True)
+        found = np.minimum(np.searchsorted(rows, result), max(len(rows) - 1, 0))
+        scores = np.where(rows[found] == result, counts[found], 0) if rows.size else np.zeros(len(result), dtype=np.int64)
+
+        order = np.lexsort((result, -scores))
+        return result[order], scores[order]
+
+    def _search(self, keywords: List[str], explain: Dict = None) -> pd.DataFrame:
+        """搜索流程的实际实现，explain 不为空时记录各步骤的统计信息"""
+        timings = explain['timings_ms'] if explain is not None else None
+        
+        # 1–3. 两个字段分别两两交集再并集，再取两字段的并集（由检索后端完成）
+        union_results = self.backend.match(keywords, explain)
+        
+        # 4. 按匹配关键词数量排序
+        if not union_results.empty and keywords and not self.backend.ranked:
+            with span('sort', timings):
+                union_results = self._sort_by_keyword_matches(union_results, keywords, explain)
+        
+        return union_results
     
-    def _sort_by_keyword_matches(self, results: pd.DataFrame, keywords: List[str]) -> pd.DataFrame:
+    def _sort_by_keyword_matches(self, results: pd.DataFrame, keywords: List[str], explain: Dict = None) -> pd.DataFrame:
         """按匹配关键词数量排序"""
         def count_matches(text):
             if pd.isna(text):
@@ -140,6 +426,11 @@ class CircuitRetriever:
             axis=1
         )
         
+        if explain is not None:
+            # 匹配分数分布：分数 -> 行数
+            score_counts = results['match_score'].value_counts().sort_index(ascending=False)
+            explain['score_distribution'] = {int(score): int(count) for score, count in score_counts.items()}
+        
         # 按分数降序排序
         results = results.sort_values('match_score', ascending=False)
         
@@ -148,21 +439,23 @@ class CircuitRetriever:
         
         return results
     
-    def format_results_for_display(self, results: pd.DataFrame, max_results: int = None) -> List[Dict]:
-        """格式化结果用于显示"""
-        if results.empty:
-            return []
-        
-        # 限制结果数量
+    def result_columns(self, results: pd.DataFrame, fields: List[str]) -> Dict[str, List]:
+        """按列取出结果子集的若干字段（不逐行构造字典）"""
+        catalog = self.data_loader.catalog
+        if catalog is not None:
+            positions = self.data_loader.index.positions_of(results)
+            return {field: catalog.column(field, positions) for field in fields}
+        return {field: results[field].tolist() for field in fields}
+    
+    def result_view(self, results: pd.DataFrame, max_results: int = None) -> ResultView:
+        """结果的展示视图：三列展示字段只按列取出一次，一轮对话中的记录列表和文本都由它生成"""
+        if results is None or results.empty:
+            return ResultView([], [], [])
         if max_results:
             results = results.head(max_results)
-        
-        formatted = []
-        for _, row in results.iterrows():
-            formatted.append({
-                'ID': row['ID'],
-                '层级路径': row['层级路径'],
-                '关联文件名称': row['关联文件名称']
-            })
-        
-        return formatted
\ No newline at end of file
+        columns = self.result_columns(results, ['ID', '层级路径', '关联文件名称'])
+        return ResultView(columns['ID'], columns['层级路径'], columns['关联文件名称'])
+    
+    def format_results_for_display(self, results: pd.DataFrame, max_results: int = None) -> List[Dict]:
+        """格式化结果用于显示"""
+        return self.result_view(results, max_results).records()
@@ -0,0 +1,24 @@
+import re
+
+
+def clean_selection_text(selection: str) -> str:
+    """清理选择文本，移除描述性内容（本地出题据此排除会被清理改写的选项）"""
+    # 移除括号及括号内的内容
+    cleaned = re.sub(r'（[^）]*）', '', selection)  # 中文括号
+    cleaned = re.sub(r'\([^)]*\)', '', cleaned)  # 英文括号
+    cleaned = re.sub(r'\[[^\]]*\]', '', cleaned)  # 方括号
+    cleaned = re.sub(r'【[^】]*】', '', cleaned)  # 方括号
+    
+    # 移除常见的描述性短语
+    descriptive_phrases = [
+        '完整的', '特定的', '相关', '文档', '文件', '图纸',
+        '通常含', '包含', '如', '例如', '比如', '不确定', '都需要看看',
+        '仪表电路图（文件名称通常含', '针脚定义文档'
+    ]
+    for phrase in descriptive_phrases:
+        cleaned = cleaned.replace(phrase, '')
+    
+    # 清理空格和标点
+    cleaned = cleaned.strip(' ，、。,.')
+    
+    return cleaned if cleaned else selection
@@ -0,0 +1,242 @@
+import atexit
+import itertools
+import logging
+import mmap
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils.catalog_index import REGEX_META
+from utils.compact_catalog import CompactCatalog, find_entries
+from utils.metrics import span
+from utils.retrieval import SearchBackend
+
+logger = logging.getLogger(__name__)
+
+# 共享文件优先放在内存文件系统中
+_SHARED_ROOT = '/dev/shm'
+
+# 子进程中已映射的共享目录：目录 -> _SharedArrays
+_attached: Dict[str, '_SharedArrays'] = {}
+
+
+class _SharedArrays:
+    """子进程中以 mmap 只读映射的紧凑目录（小写字节区、偏移和每行的路径号），各进程共享同一份物理内存"""
+
+    def __init__(self, directory: str):
+        self.filenames = self._map(os.path.join(directory, 'filenames.bin'))
+        self.paths = self._map(os.path.join(directory, 'paths.bin'))
+        self.filename_offsets = np.load(os.path.join(directory, 'filename_offsets.npy'), mmap_mode='r')
+        self.path_offsets = np.load(os.path.join(directory, 'path_offsets.npy'), mmap_mode='r')
+        self.path_ids = np.load(os.path.join(directory, 'path_ids.npy'), mmap_mode='r')
+
+    @staticmethod
+    def _map(path: str):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _entries(arena, offsets, needle: bytes, pattern: Optional[str], first: int, last: int) -> np.ndarray:
+    """第 first 到 last - 1 条中命中关键词的条目序号（pattern 不为空时按正则匹配）"""
+    if pattern is None:
+        return find_entries(arena, offsets, needle, first, last)
+    regex = re.compile(pattern, re.IGNORECASE)
+    return np.asarray([
+        i for i in range(first, last)
+        if regex.search(arena[int(offsets[i]):int(offsets[i + 1]) - 1].decode('utf-8'))
+    ], dtype=np.int64)
+
+
+def _match_shard(directory: str, first: int, last: int, path_first: int, path_last: int,
+                 keywords: List[Tuple[bytes, Optional[str]]], with_pairs: bool) -> Dict:
+    """
+    在一个分片（目录的第 first 到 last - 1 行）上匹配各关键词（子进程中执行）
+    返回每个关键词在两个字段中的命中数，以及至少命中一个关键词的行：行位置、两个字段各命中几个关键词、排序分数；
+    with_pairs 时另外返回各关键词两两交集的大小
+    """
+    shared = _attached.get(directory)
+    if shared is None:
+        shared = _attached[directory] = _SharedArrays(directory)
+
+    size = last - first
+    # 本分片各行的路径号（相对 path_first）；路径只在本分片用到的路径号区间内查找
+    local_path_ids = np.asarray(shared.path_ids[first:last], dtype=np.int64) - path_first
+
+    counts = {'path': np.zeros(size, dtype=np.uint16), 'filename': np.zeros(size, dtype=np.uint16)}
+    scores = np.zeros(size, dtype=np.uint16)
+    hits = {'path': [], 'filename': []}
+    masks = {'path': [], 'filename': []}
+
+    for needle, pattern in keywords:
+        for field, arena, offsets, entry_first, entry_last in (
+                ('path', shared.paths, shared.path_offsets, path_first, path_last),
+                ('filename', shared.filenames, shared.filename_offsets, first, last)):
+            matched = np.zeros(entry_last - entry_first, dtype=bool)
+            matched[_entries(arena, offsets, needle, pattern, entry_first, entry_last) - entry_first] = True
+            if pattern is not None:
+                # 排序分数按字面子串计算，与 CircuitRetriever 的排序一致
+                literal = np.zeros(entry_last - entry_first, dtype=bool)
+                literal[find_entries(arena, offsets, needle, entry_first, entry_last) - entry_first] = True
+            else:
+                literal = matched
+            if field == 'path':
+                matched, literal = matched[local_path_ids], literal[local_path_ids]
+
+            counts[field] += matched
+            scores += literal
+            hits[field].append(int(np.count_nonzero(matched)))
+            if with_pairs:
+                masks[field].append(matched)
+
+    candidates = np.flatnonzero((counts['path'] > 0) | (counts['filename'] > 0))
+    result = {
+        'hits': hits,
+        'positions': candidates + first,
+        'path_counts': counts['path'][candidates],
+        'filename_counts': counts['filename'][candidates],
+        'scores': scores[candidates]
+    }
+    if with_pairs:
+        result['pairs'] = {
+            field: [int(np.count_nonzero(a & b)) for a, b in itertools.combinations(field_masks, 2)]
+            for field, field_masks in masks.items()
+        }
+    return result
+
+
+class ShardedSearchBackend(SearchBackend):
+    """
+    分片检索：目录按行切成若干分片，由进程池并行匹配
+    - 紧凑目录的小写字节区、偏移和路径号写入 /dev/shm 下的文件，池中的进程以 mmap 只读映射，不复制目录
+    - 每个分片在子进程中完成各关键词的匹配、逐行计数和排序分数，协调进程汇总各关键词的全局命中数，
+      按“命中至少两个有效关键词（只有一个有效关键词时为命中它）”选出结果，再按分数合并排序
+    - 进程池用 spawn 方式在首次检索时创建（不从多线程进程中 fork）；gunicorn 预加载时每个 worker 各有自己的进程池
+    结果已按匹配分数从高到低排好（分数相同时按目录顺序），CircuitRetriever 不再排序
+    """
+    name = 'sharded'
+    ranked = True
+
+    def __init__(self, data_loader, shards: int):
+        self.data_loader = data_loader
+        # DataFrame 模式下先转换成紧凑目录再导出
+        self.catalog = data_loader.catalog
+        if self.catalog is None:
+            self.catalog = CompactCatalog.from_frame(data_loader.data)
+        self.shards = max(1, shards)
+
+        shared_root = _SHARED_ROOT if os.path.isdir(_SHARED_ROOT) else None
+        self.directory = tempfile.mkdtemp(prefix='circuit-shards-', dir=shared_root)
+        self.catalog.write_shared(self.directory)
+        self._owner_pid = os.getpid()
+        self._ranges = self._plan()
+
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        atexit.register(self.close)
+        logger.info("分片检索: %d 个分片，共享目录 %s", len(self._ranges), self.directory)
+
+    def _plan(self) -> List[Tuple[int, int, int, int]]:
+        """按行均分：(起始行, 结束行, 路径号下界, 路径号上界)；路径号按首次出现的顺序编号，相邻行的路径号通常集中"""
+        bounds = np.linspace(0, len(self.catalog), self.shards + 1).astype(np.int64)
+        ranges = []
+        for first, last in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            if first < last:
+                path_ids = self.catalog.path_ids[first:last]
+                ranges.append((first, last, int(path_ids.min()), int(path_ids.max()) + 1))
+        return ranges
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=len(self._ranges) or 1,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def close(self):
+        """关闭本进程的进程池；创建共享文件的进程同时删除共享目录"""
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        if os.getpid() == self._owner_pid:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def match(self, keywords: List[str], explain: Dict = None) -> pd.DataFrame:
+        if not keywords or not self._ranges:
+            return pd.DataFrame()
+
+        timings = explain['timings_ms'] if explain is not None else None
+        specs = [
+            (keyword.lower().encode('utf-8'), keyword if any(char in REGEX_META for char in keyword) else None)
+            for keyword in keywords
+        ]
+
+        with span('retrieval_sharded', timings):
+            futures = [
+                self.pool.submit(_match_shard, self.directory, first, last, path_first, path_last,
+                                 specs, explain is not None)
+                for first, last, path_first, path_last in self._ranges
+            ]
+            parts = [future.result() for future in futures]
+
+        with span('shard_merge', timings):
+            positions, scores = self._merge(keywords, parts, explain)
+
+        logger.debug("并集结果: %d 行", len(positions))
+        if explain is not None:
+            values, counts = np.unique(scores, return_counts=True)
+            explain['score_distribution'] = {
+                int(value): int(count) for value, count in sorted(zip(values, counts), reverse=True)
+            }
+        if not positions.size:
+            return pd.DataFrame()
+        if self.data_loader.catalog is not None:
+            return self.catalog.frame(positions)
+        return self.data_loader.data.iloc[positions].copy()
+
+    def _merge(self, keywords: List[str], parts: List[Dict], explain: Dict = None) -> Tuple[np.ndarray, np.ndarray]:
+        """汇总各分片：按全局有效关键词数选出结果行，返回按分数排好的 (行位置, 分数)"""
+        positions = np.concatenate([part['positions'] for part in parts])
+        scores = np.concatenate([part['scores'] for part in parts])
+        member = np.zeros(len(positions), dtype=bool)
+        # 各分片按 combinations 的顺序返回两两交集大小
+        pair_index = {pair: n for n, pair in enumerate(itertools.combinations(range(len(keywords)), 2))}
+
+        for field, key in (('层级路径', 'path'), ('关联文件名称', 'filename')):
+            hits = np.sum([part['hits'][key] for part in parts], axis=0)
+            counts = np.concatenate([part[f'{key}_counts'] for part in parts])
+            valid = [i for i in range(len(keywords)) if hits[i]]
+            field_member = counts >= (1 if len(valid) == 1 else 2) if valid else np.zeros(len(counts), dtype=bool)
+            member |= field_member
+
+            field_info = self._field_info(explain, field)
+            if field_info is not None:
+                for i, keyword in enumerate(keywords):
+                    field_info['keyword_hits'][keyword] = int(hits[i])
+                    if not hits[i]:
+                        field_info['dropped_keywords'].append(keyword)
+                if len(valid) > 1:
+                    pair_sizes = np.sum([part['pairs'][key] for part in parts], axis=0)
+                    for i, j in itertools.combinations(valid, 2):
+                        field_info['pairs'].append({
+                            'keywords': [keywords[i], keywords[j]],
+                            'size': int(pair_sizes[pair_index[(i, j)]])
+                        })
+                field_info['union_size'] = int(np.count_nonzero(field_member))
+
+        positions, scores = positions[member], scores[member]
+        # 分数从高到低，分数相同时按目录顺序
+        order = np.lexsort((positions, -scores.astype(np.int64)))
+        return positions[order], scores[order]
@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from utils.deadline import DeadlineExceeded
+from utils.metrics import COALESCED_REQUESTS
+
+
+class _LeaderCancelled(Exception):
+    """领头者被取消，跟随者应重新执行而不是随之取消"""
+
+
+class _Call:
+    """一次进行中的调用，跟随者等待其完成后共享结果"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _remaining(timeout: Optional[float], start: float) -> Optional[float]:
+    """跟随者已等待一段时间后剩余的等待时长"""
+    return None if timeout is None else max(0.0, timeout - (time.monotonic() - start))
+
+
+class SingleFlight:
+    """
+    合并相同键的并发调用（多线程版本）
+    第一个到达的调用者（领头者）执行函数，在它完成前到达的相同键调用只等待并共享其结果或异常；
+    领头者因自己的时间预算用完而失败（DeadlineExceeded）时不共享该异常，跟随者在自己的预算内重新执行；
+    调用完成后键即被移除，之后的调用会重新执行；
+    timeout 限定跟随者的等待时间，超时抛出 TimeoutError（领头者不受影响）
+    """
+
+    def __init__(self, scope: str):
+        self.scope = scope
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, func: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            COALESCED_REQUESTS.inc(scope=self.scope)
+            start = time.monotonic()
+            if not call.done.wait(timeout):
+                raise TimeoutError('等待进行中的相同调用超时')
+            if isinstance(call.error, DeadlineExceeded):
+                return self.do(key, func, _remaining(timeout, start))
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight 的协程版本，只在同一个事件循环内使用；
+    领头者被取消时跟随者不随之取消，而是像 DeadlineExceeded 一样在自己的预算内重新执行
+    """
+
+    def __init__(self, scope: str):
+        self.scope = scope
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """func 为无参的协程函数"""
+        future = self._calls.get(key)
+        if future is not None:
+            COALESCED_REQUESTS.inc(scope=self.scope)
+            # 跟随者被取消或超时不影响领头者和其他跟随者
+            start = time.monotonic()
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError('等待进行中的相同调用超时')
+            except (DeadlineExceeded, _LeaderCancelled):
+                # 领头者自己的预算用完或被取消，在本调用者的预算内重新执行
+                return await self.do(key, func, _remaining(timeout, start))
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # 没有跟随者时避免“异常未被读取”的警告
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
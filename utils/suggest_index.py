@@ -0,0 +1,124 @@
+import bisect
+import heapq
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+from utils.keyword_extractor import MAX_WORD_LENGTH, STOP_PHRASES
+
+_PATH_SPLIT_PATTERN = re.compile(r'->')
+_NAME_SPLIT_PATTERN = re.compile(r'[_\s【】\[\]()（）,，、/]+')
+_CJK_RUN_PATTERN = re.compile(r'[\u4e00-\u9fff]+')
+_CODE_PATTERN = re.compile(r'[A-Za-z0-9][A-Za-z0-9.\-]*[A-Za-z0-9]')
+_EXTENSION_PATTERN = re.compile(r'\.[A-Za-z][A-Za-z0-9]{1,4}$')
+
+# 同一个词有多个来源时按此顺序取类别
+_KIND_ORDER = ('path', 'code', 'name')
+
+# 查询末尾最多取多少个字符作为补全前缀
+MAX_PREFIX_LENGTH = 16
+
+
+class SuggestIndex:
+    """
+    输入联想的前缀索引（有序数组 + 二分查找）
+    - 词表：层级路径各段（品牌、系列、模块等，类别 path）、文件名中的型号代码（同时含字母和数字，类别 code）
+      和文件名按分隔符切开后 2–8 字的中文串（类别 name），不收录“电路图”等检索时会被去掉的常见词
+    - 权重：包含该词的目录行数，前缀相同的词按权重从高到低返回
+    词按小写排序存放，查找时用二分定位前缀区间，再从区间中取权重最高的 k 个；建好后只读，可在多线程间共享
+    """
+
+    def __init__(self, paths: Iterable[str], filenames: Iterable[str]):
+        """paths、filenames：目录各行的层级路径和文件名（按行对应）"""
+        counts = Counter()
+        kinds: Dict[str, str] = {}
+
+        for path, filename in zip(paths, filenames):
+            row_terms = {}
+            for part in _PATH_SPLIT_PATTERN.split(path):
+                part = part.strip()
+                if part:
+                    row_terms.setdefault(part, 'path')
+            for part in _NAME_SPLIT_PATTERN.split(_EXTENSION_PATTERN.sub('', filename)):
+                for code in _CODE_PATTERN.findall(part):
+                    if len(code) >= 3 and re.search(r'[A-Za-z]', code) and re.search(r'\d', code):
+                        row_terms.setdefault(code, 'code')
+                for run in _CJK_RUN_PATTERN.findall(part):
+                    if 2 <= len(run) <= MAX_WORD_LENGTH:
+                        row_terms.setdefault(run, 'name')
+
+            for term, kind in row_terms.items():
+                counts[term] += 1
+                if term not in kinds or _KIND_ORDER.index(kind) < _KIND_ORDER.index(kinds[term]):
+                    kinds[term] = kind
+
+        self.stop_words = set(STOP_PHRASES)
+        entries = sorted(
+            (term.lower(), term, kinds[term], count)
+            for term, count in counts.items()
+            if term not in self.stop_words
+        )
+        self.keys: List[str] = [entry[0] for entry in entries]
+        self.terms: List[str] = [entry[1] for entry in entries]
+        self.kinds: List[str] = [entry[2] for entry in entries]
+        self.weights: List[int] = [entry[3] for entry in entries]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, term: str) -> bool:
+        key = term.lower()
+        i = bisect.bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def complete(self, prefix: str, limit: int) -> List[int]:
+        """以 prefix 开头（不区分大小写、不含 prefix 本身）的词中权重最高的 limit 个，返回词的下标"""
+        key = prefix.lower()
+        lo = bisect.bisect_left(self.keys, key)
+        hi = bisect.bisect_left(self.keys, key + '\uffff', lo)
+        if lo < hi and self.keys[lo] == key:
+            lo += 1
+        if hi - lo <= limit:
+            candidates = range(lo, hi)
+        else:
+            candidates = heapq.nlargest(limit, range(lo, hi), key=self.weights.__getitem__)
+        return sorted(candidates, key=lambda i: -self.weights[i])
+
+    def suggest(self, query: str, limit: int) -> List[Dict]:
+        """
+        补全查询的最后一个词：优先用最后一段输入的最长后缀作前缀，
+        没有以它开头的词时逐字缩短（“东风天龙仪”依次尝试“东风天龙仪”“风天龙仪”…“仪”），
+        缩短到一个完整的词表词或常见词（“图”等）为止，此时输入已经完整，不再给出建议
+        """
+        head, tail = self._split_tail(query)
+        if not tail:
+            return []
+
+        for start in range(max(0, len(tail) - MAX_PREFIX_LENGTH), len(tail)):
+            suffix = tail[start:]
+            if suffix in self.stop_words:
+                return []
+            matches = self.complete(suffix, limit)
+            if not matches and suffix in self:
+                return []
+            if matches:
+                stem = head + tail[:start]
+                return [
+                    {
+                        'text': self.terms[i],
+                        'query': stem + self.terms[i],
+                        'kind': self.kinds[i],
+                        'count': self.weights[i]
+                    }
+                    for i in matches
+                ]
+        return []
+
+    @staticmethod
+    def _split_tail(query: str) -> Tuple[str, str]:
+        """拆成 (前面已输入的部分, 最后一段没有空白的输入)"""
+        stripped = query.lstrip()
+        if not stripped or stripped[-1].isspace():
+            return stripped, ''
+        cut = max(stripped.rfind(' '), stripped.rfind('\u3000'))
+        return stripped[:cut + 1], stripped[cut + 1:]